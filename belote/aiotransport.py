@@ -0,0 +1,164 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Provides a way to send / receive packets through a socket, on an asyncio
+event loop
+
+Same interface as transport.Transport (on_recv, on_drop, run, stop, send) but
+without any thread of its own: all connections share the loop's thread.
+on_recv and on_drop are called from the loop thread, send and stop can be
+called from any thread.
+"""
+
+import asyncio
+import logging
+
+from . import packet
+from . import transport
+
+log = logging.getLogger(__name__)
+
+
+class Transport(asyncio.BufferedProtocol):
+
+    def __init__(self, loop, max_frame_len=packet.MESSAGE_LEN_MAX):
+        # Callbacks; on_written gets the tags given to send() once their
+        # frames are handed to the socket
+        self.on_recv = None
+        self.on_drop = None
+        self.on_connect = None
+        self.on_written = None
+
+        self._loop = loop
+        self._transport = None
+        self._running = True
+
+        # Whether to send binary frames (see packet.py), once negotiated
+        self.binary = False
+
+        # Received bytes, until they form complete frames. The event loop
+        # reads straight into its buffer.
+        self._rx_frames = packet.FrameReader(max_frame_len)
+
+        # capture.Capture of the recent frames, None not to keep any
+        self._capture = None
+
+        # Frames sent within one loop iteration are written together; while
+        # the socket buffer is full (paused), they wait here
+        self._paused = False
+        self._tx_queue = transport.TxQueue()
+        self._flush_scheduled = False
+
+
+    @property
+    def tx_pending(self):
+        # Bytes waiting to be sent
+        return self._tx_queue.size
+
+
+    @property
+    def capture(self):
+        return self._capture
+
+
+    @capture.setter
+    def capture(self, capture):
+        # Received frames are only copied out of the buffer while captured
+        self._capture = capture
+        self._rx_frames.keep_frames = capture is not None
+
+
+    def connection_made(self, transport):
+        self._transport = transport
+        if self.on_connect:
+            self.on_connect(self, transport.get_extra_info('peername'))
+
+
+    def connection_lost(self, exc):
+        self._transport = None
+        if not self._running:
+            return
+        self._running = False
+        log.error("Connection dropped")
+        if self.on_drop:
+            self.on_drop(self)
+
+
+    def get_buffer(self, sizehint):
+        return self._rx_frames.buffer(max(sizehint, 16384))
+
+
+    def buffer_updated(self, nbytes):
+        self._rx_frames.commit(nbytes)
+
+        # We might read several packets at once, or only part of one
+        try:
+            rx_packets = self._rx_frames.frames()
+        except ValueError as e:
+            log.error("Invalid frame: {}".format(e))
+            self._transport.abort()
+            return
+
+        for rx_packet in rx_packets:
+            if not self._running:
+                break
+            if self._capture is not None:
+                self._capture.rx(rx_packet.rx_frame)
+            self.on_recv(self, rx_packet)
+
+
+    def pause_writing(self):
+        self._paused = True
+
+
+    def resume_writing(self):
+        self._paused = False
+        self.__flush()
+
+
+    def __queue(self, tx_packet, tx_bytes, tag):
+        if self._transport is None:
+            return
+
+        if not self._tx_queue.push(tx_packet, tx_bytes, tag):
+            log.error("Client not reading, dropping connection")
+            self._transport.abort()
+            return
+
+        if not self._paused and not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon(self.__flush)
+
+
+    def __flush(self):
+        self._flush_scheduled = False
+        if self._transport is None or self._paused:
+            return
+        if len(self._tx_queue):
+            frames, tags = self._tx_queue.drain()
+            self._transport.writelines(frames)
+            if tags and self.on_written:
+                self.on_written(self, tags)
+
+
+    def run(self):
+        # Nothing to start: the event loop drives us
+        pass
+
+
+    def stop(self):
+        self._running = False
+        if self._transport is not None:
+            self._loop.call_soon_threadsafe(self._transport.close)
+
+
+    def send(self, tx_packet, tag=None):
+        tx_bytes = tx_packet.to_frame(self.binary)
+        if self._capture is not None:
+            self._capture.tx(tx_bytes)
+        self._loop.call_soon_threadsafe(self.__queue, tx_packet, tx_bytes,
+            tag)
@@ -0,0 +1,302 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Microbenchmarks of the rules, serialization and broadcast hot paths
+
+Each benchmark builds its inputs from a seeded random.Random, so that every
+run times the same work, then returns a callable doing `ops` operations. The
+callable is run in batches of at least MIN_BATCH_TIME seconds, several
+times, and the median time per operation is kept.
+"""
+
+import json
+import platform
+import random
+import statistics
+import time
+
+from . import bitboard
+from . import card
+from . import constants
+from . import game
+from . import packet
+from . import player
+from . import pli
+from . import simulation
+
+# Seconds each timed batch lasts at least
+MIN_BATCH_TIME = 0.1
+
+_trumps = [trump.value for trump in constants.Trump]
+
+
+def _players():
+    return [player.Player(str(idx), "bot{}".format(idx)) for idx in range(4)]
+
+
+def _plis(rng, count):
+    """
+    Random plis being played: (pli, players, hands by seat, trump), with 0 to
+    3 legal cards played already
+    """
+    result = []
+    for _ in range(count):
+        players = _players()
+        deck = list(card.all)
+        rng.shuffle(deck)
+        hands = [bitboard.from_cards(deck[idx * 8:idx * 8 + 8])
+            for idx in range(4)]
+        trump = rng.choice(_trumps)
+
+        p = pli.Pli(players, rng.randrange(4))
+        for _ in range(rng.randrange(4)):
+            seat = players.index(p.next_player)
+            legal = p.legal_moves(players[seat], hands[seat], trump)
+            played = card.from_mask(legal)[rng.randrange(bitboard.count(legal))]
+            p.play_card(players[seat], played, trump)
+            hands[seat] &= ~played.mask
+
+        result.append((p, players, hands, trump))
+    return result
+
+
+def _games(rng, count):
+    """
+    Games in the middle of a round
+    """
+    result = []
+    for _ in range(count):
+        # Delayed transitions are run right away
+        timers = []
+        g = game.Game(rng=rng,
+            schedule=lambda delay, callback: timers.append(callback))
+        g.on_status_changed = lambda: None
+        for p in _players():
+            g.add_player(p)
+
+        g.pick_trump(g.announcing_player, rng.choice(_trumps))
+        for _ in range(rng.randrange(1, 28)):
+            current = g.current_pli.next_player
+            legal = g.current_pli.legal_moves(current, g.hand(current),
+                g.trump_suit)
+            g.play_card(current, card.from_mask(legal)[
+                rng.randrange(bitboard.count(legal))])
+            while timers:
+                timers.pop(0)()
+
+        result.append(g)
+    return result
+
+
+def bench_sort_value(rng):
+    cards = [(rng.choice(card.all), rng.choice(_trumps)) for _ in range(1000)]
+    def run():
+        for c, trump in cards:
+            c.sort_value(trump)
+    return run, len(cards)
+
+
+def bench_overtakes(rng):
+    pairs = [(rng.choice(card.all), rng.choice(card.all), rng.choice(_trumps))
+        for _ in range(1000)]
+    def run():
+        for c, other, trump in pairs:
+            c.overtakes(other, trump)
+    return run, len(pairs)
+
+
+def bench_is_card_legal(rng):
+    cases = []
+    for p, players, hands, trump in _plis(rng, 1000):
+        seat = players.index(p.next_player)
+        cases.append((p, players[seat], rng.choice(card.all), hands[seat],
+            trump))
+    def run():
+        for p, current, c, hand, trump in cases:
+            p.is_card_legal(current, c, hand, trump)
+    return run, len(cases)
+
+
+def bench_taking_player_idx(rng):
+    cases = [(p, trump) for p, _, _, trump in _plis(rng, 1000)
+        if not p.is_empty]
+    def run():
+        for p, trump in cases:
+            p.taking_player_idx(trump)
+    return run, len(cases)
+
+
+def bench_proxy_for_player(rng):
+    # A new version for each game, seen by its four players: proxies are
+    # cached per version, so that is what a broadcast costs
+    games = _games(rng, 50)
+    def run():
+        for g in games:
+            g._version += 1
+            for p in g.players:
+                g.proxy_for_player(p)
+    return run, len(games)
+
+
+def _proxies(rng):
+    return [g.proxy_for_player(rng.choice(g.players))
+        for g in _games(rng, 50)]
+
+
+def bench_to_args(rng):
+    proxies = _proxies(rng)
+    def run():
+        for proxy in proxies:
+            proxy.to_args()
+    return run, len(proxies)
+
+
+def bench_from_args(rng):
+    args = [[str(arg) for arg in proxy.to_args()] for proxy in _proxies(rng)]
+    def run():
+        for a in args:
+            game.from_args(a)
+    return run, len(args)
+
+
+def bench_proxy_to_bytes(rng):
+    proxies = _proxies(rng)
+    def run():
+        for proxy in proxies:
+            proxy.to_bytes()
+    return run, len(proxies)
+
+
+def bench_proxy_from_bytes(rng):
+    bodies = [proxy.to_bytes() for proxy in _proxies(rng)]
+    def run():
+        for body in bodies:
+            game.from_bytes(body)
+    return run, len(bodies)
+
+
+def _status_packets(rng):
+    return [packet.Packet(constants.MessageType.NOTIF,
+        constants.NotifOpcode.GAME_STATUS, *proxy.to_args())
+            for proxy in _proxies(rng)]
+
+
+def bench_packet_to_bytes(rng):
+    packets = _status_packets(rng)
+    def run():
+        for tx_packet in packets:
+            tx_packet.to_bytes()
+    return run, len(packets)
+
+
+def bench_packet_from_bytes(rng):
+    frames = [tx_packet.to_bytes() for tx_packet in _status_packets(rng)]
+    def run():
+        for frame in frames:
+            packet.from_bytes(frame)
+    return run, len(frames)
+
+
+def bench_round(rng):
+    # Deal, trump and 32 cards, with the delayed transitions run at once
+    simulator = simulation.Simulator(rng.random())
+    def run():
+        simulator.run(1)
+    return run, 1
+
+
+BENCHMARKS = {
+    'card.sort_value': bench_sort_value,
+    'card.overtakes': bench_overtakes,
+    'pli.is_card_legal': bench_is_card_legal,
+    'pli.taking_player_idx': bench_taking_player_idx,
+    'game.proxy_for_player': bench_proxy_for_player,
+    'game_proxy.to_args': bench_to_args,
+    'game.from_args': bench_from_args,
+    'game_proxy.to_bytes': bench_proxy_to_bytes,
+    'game.from_bytes': bench_proxy_from_bytes,
+    'packet.to_bytes': bench_packet_to_bytes,
+    'packet.from_bytes': bench_packet_from_bytes,
+    'game.round': bench_round,
+}
+
+
+def _time(run, ops, repeat):
+    # Batch size so that a batch lasts at least MIN_BATCH_TIME
+    batch = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(batch):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= MIN_BATCH_TIME:
+            break
+        batch *= 2
+
+    timings = [elapsed]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(batch):
+            run()
+        timings.append(time.perf_counter() - start)
+
+    per_op = [1e9 * t / (batch * ops) for t in timings]
+    return {
+        'ns_per_op': statistics.median(per_op),
+        'min_ns_per_op': min(per_op),
+        'ops': batch * ops,
+        'repeat': repeat,
+    }
+
+
+def run(seed=0, repeat=5, names=None, report=None):
+    """
+    Run the benchmarks (all, or those whose name contains one of names),
+    return the results as a JSON-serializable dict
+    """
+    results = {}
+    for name, bench in BENCHMARKS.items():
+        if names and not any(n in name for n in names):
+            continue
+        fn, ops = bench(random.Random("{}:{}".format(seed, name)))
+        results[name] = _time(fn, ops, repeat)
+        if report:
+            report(name, results[name])
+
+    return {
+        'seed': seed,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    (name, baseline ns, current ns, ratio, regressed) for each benchmark in
+    both, regressed meaning slower by more than threshold
+    """
+    rows = []
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['ns_per_op'] / base['ns_per_op']
+        rows.append((name, base['ns_per_op'], result['ns_per_op'], ratio,
+            ratio > 1 + threshold))
+    return rows
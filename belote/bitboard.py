@@ -0,0 +1,213 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Compact 32-bit representation of a set of cards
+
+Each of the 32 cards is assigned one bit, following the order of
+constants.CardCode. A hand, the cards of a pli or the cards won by a team are
+then plain ints, and most rules questions become mask operations.
+
+All per-card tables below are indexed by bit index and keyed by trump (one of
+the constants.Trump values, or None while no trump has been picked yet).
+"""
+
+from . import constants
+
+
+SUITS = ['H', 'S', 'D', 'C']
+VALUES = ['7', '8', '9', '10', 'J', 'Q', 'K', 'A']
+
+ALL = (1 << len(constants.CardCode)) - 1
+
+# Bit index of each card code
+INDEX = {code.value: idx for idx, code in enumerate(constants.CardCode)}
+
+# Code of each bit index
+CODES = [code.value for code in constants.CardCode]
+
+# Mask of every card of a given suit
+SUIT_MASK = {suit: 0 for suit in SUITS}
+for _code, _idx in INDEX.items():
+    SUIT_MASK[_code[-1:]] |= 1 << _idx
+
+# Keys for the per-trump tables
+TRUMPS = [trump.value for trump in constants.Trump] + [None]
+
+# Mask of every card considered a trump
+TRUMP_MASK = {
+    trump: (ALL if trump == constants.Trump.AT else SUIT_MASK.get(trump, 0))
+        for trump in TRUMPS
+}
+
+_regular_order = ['A', '10', 'K', 'Q', 'J', '9', '8', '7']
+_trump_order = ['J', '9', 'A', '10', 'K', 'Q', '8', '7']
+
+_regular_points = {
+     'A': 11,
+    '10': 10,
+     'K': 4,
+     'Q': 3,
+     'J': 2,
+     '9': 0,
+     '8': 0,
+     '7': 0,
+}
+
+_trump_points = {
+     'J' : 20,
+     '9' : 14,
+     'A' : 11,
+    '10' : 10,
+     'K' : 4,
+     'Q' : 3,
+     '8' : 0,
+     '7' : 0,
+}
+
+# Global order of each suit within one's game
+_suit_sort_order = ['H', 'C', 'D', 'S']
+
+
+def _is_trump(idx, trump):
+    return bool(TRUMP_MASK[trump] & (1 << idx))
+
+
+def _order(idx, trump):
+    return _trump_order if _is_trump(idx, trump) else _regular_order
+
+
+def _value(idx):
+    return CODES[idx][:-1]
+
+
+def _suit(idx):
+    return CODES[idx][-1:]
+
+
+# Points are kept as integers in units of 1/SCALE of a displayed point.
+# All-trump and no-trump rounds are brought back to the 152 points of a
+# regular round (out of 248 and 120 respectively), and SCALE is the smallest
+# unit for which every mode is exact.
+SCALE = 465
+
+def _multiplier(trump):
+    if trump == constants.Trump.AT:
+        return SCALE * 152 // 248
+    if trump == constants.Trump.NT:
+        return SCALE * 152 // 120
+    return SCALE
+
+
+# Position of a card within its suit, lower is stronger
+RANK = {
+    trump: [_order(idx, trump).index(_value(idx)) for idx in range(len(CODES))]
+        for trump in TRUMPS
+}
+
+# Sorting key of a card within a hand
+SORT = {
+    trump: [_suit_sort_order.index(_suit(idx)) * 10 + RANK[trump][idx]
+        for idx in range(len(CODES))]
+            for trump in TRUMPS
+}
+
+# Points brought by each card, in 1/SCALE units
+POINTS = {
+    trump: [_multiplier(trump) * (_trump_points if _is_trump(idx, trump)
+        else _regular_points)[_value(idx)] for idx in range(len(CODES))]
+            for trump in TRUMPS
+}
+
+
+def _suit_points(suit_idx, trump):
+    # Points of each of the 256 subsets of one suit
+    table = []
+    for byte in range(256):
+        table.append(sum(POINTS[trump][suit_idx * 8 + bit]
+            for bit in range(8) if byte & (1 << bit)))
+    return table
+
+
+_SUIT_POINTS = {
+    trump: [_suit_points(suit_idx, trump) for suit_idx in range(len(SUITS))]
+        for trump in TRUMPS
+}
+
+
+def _beaten_by(idx, trump):
+    # Trumps beat any non trump, then higher ranked cards of the same suit
+    mask = 0
+    if not _is_trump(idx, trump):
+        mask |= TRUMP_MASK[trump]
+    for other in range(len(CODES)):
+        if (_suit(other) == _suit(idx)
+            and RANK[trump][other] < RANK[trump][idx]):
+            mask |= 1 << other
+    return mask
+
+
+# Mask of every card that overtakes a given card
+BEATEN_BY = {
+    trump: [_beaten_by(idx, trump) for idx in range(len(CODES))]
+        for trump in TRUMPS
+}
+
+
+def bit(code):
+    """
+    Mask of a single card code, 0 if the code is not a card
+    """
+    idx = INDEX.get(code)
+    return 0 if idx is None else 1 << idx
+
+
+def from_cards(cards):
+    mask = 0
+    for card in cards:
+        mask |= card.mask
+    return mask
+
+
+def indices(mask):
+    """
+    Iterate over the bit indices set in a mask, lowest first
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def count(mask):
+    return bin(mask).count('1')
+
+
+def points(mask, trump):
+    """
+    Points held in a mask (a pli, a hand, won cards...), in 1/SCALE units
+    """
+    table = _SUIT_POINTS[trump]
+    return (table[0][mask & 0xFF]
+        + table[1][(mask >> 8) & 0xFF]
+        + table[2][(mask >> 16) & 0xFF]
+        + table[3][(mask >> 24) & 0xFF])
+
+
+def display_points(points):
+    """
+    Round points in 1/SCALE units to the nearest displayed point
+    """
+    return (2 * points + SCALE) // (2 * SCALE)
+
+
+def overtakes(idx, other_idx, trump):
+    """
+    Whether card idx overtakes card other_idx (None meaning no card yet)
+    """
+    if other_idx is None:
+        return True
+    return bool(BEATEN_BY[trump][other_idx] & (1 << idx))
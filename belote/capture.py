@@ -0,0 +1,128 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Recent traffic of a connection, kept as raw frames
+
+A Capture keeps the last frames received and sent on a transport, with the
+time they were received or queued for sending, in a ring. Nothing is decoded
+or formatted until the capture is dumped to a file; decode() and the
+capture.py tool read such files back.
+
+Dump format: header (magic, version, peer as UTF-8), then one record per
+frame: time (seconds since the epoch), direction, length, then the frame
+bytes as they are on the wire.
+"""
+
+import collections
+import struct
+import time
+
+from . import game
+from . import packet
+
+
+VERSION = 1
+
+# Frames kept per connection
+CAPTURE_FRAMES = 256
+
+RX = 0
+TX = 1
+
+_MAGIC = b'BLTC'
+
+_header = struct.Struct('>4sBB')
+_record = struct.Struct('>dBI')
+
+
+class Capture:
+
+    def __init__(self, max_frames=CAPTURE_FRAMES):
+        # (time, direction, frame bytes); appending is thread-safe
+        self._frames = collections.deque(maxlen=max_frames)
+
+
+    def __len__(self):
+        return len(self._frames)
+
+
+    def rx(self, frame):
+        self._frames.append((time.time(), RX, frame))
+
+
+    def tx(self, frame):
+        self._frames.append((time.time(), TX, frame))
+
+
+    def dump(self, path, peer=''):
+        frames = list(self._frames)
+        encoded_peer = packet.truncate_utf8(str(peer))
+
+        with open(path, 'wb') as f:
+            f.write(_header.pack(_MAGIC, VERSION, len(encoded_peer)))
+            f.write(encoded_peer)
+            for timestamp, direction, frame in frames:
+                f.write(_record.pack(timestamp, direction, len(frame)))
+                f.write(frame)
+
+
+def load(path):
+    """
+    (peer, [(time, direction, frame bytes)]) of a dumped capture, ignoring a
+    truncated last record
+    Raises ValueError if path is not a capture
+    """
+    with open(path, 'rb') as f:
+        buf = f.read()
+
+    try:
+        magic, version, peer_len = _header.unpack_from(buf, 0)
+    except struct.error:
+        raise ValueError("not a capture")
+    if magic != _MAGIC or version != VERSION:
+        raise ValueError("not a capture, or of another version")
+
+    offset = _header.size
+    peer = buf[offset:offset + peer_len].decode('utf-8', 'replace')
+    offset += peer_len
+
+    frames = []
+    while offset + _record.size <= len(buf):
+        timestamp, direction, length = _record.unpack_from(buf, offset)
+        offset += _record.size
+        if offset + length > len(buf):
+            break
+        frames.append((timestamp, direction, buf[offset:offset + length]))
+        offset += length
+
+    return peer, frames
+
+
+def decode(frame):
+    """
+    Packet of a raw frame, text or binary
+    Raises ValueError on malformed frames
+    """
+    if frame[:1] == bytes([packet.BINARY_MARKER]):
+        return packet.from_binary(memoryview(frame)[packet.BINARY_HEADER.size:])
+    return packet.from_bytes(frame.rstrip(packet.MESSAGE_SEP))
+
+
+def describe(rx_packet):
+    """
+    Readable form of a decoded packet, binary game statuses included
+    """
+    if rx_packet.body is None:
+        return str(rx_packet)
+    try:
+        args = game.from_bytes(rx_packet.body).to_args()
+    except (ValueError, IndexError, KeyError, struct.error):
+        return "{}|{}|<{} bytes>".format(rx_packet.msg_type,
+            rx_packet.opcode, len(rx_packet.body))
+    # Enum arguments are str already, and joined as their value
+    return "|".join([rx_packet.msg_type, rx_packet.opcode] +
+        [arg if isinstance(arg, str) else str(arg) for arg in args])
@@ -4,38 +4,19 @@
 # Proprietary and confidential.
 #
 
+from . import bitboard
 from . import constants
 
 """
 Card arbstraction
 Allows for easy sorting (by color and by value, depending on trump suit)
+
+There is exactly one instance per card (plus the EMPTY placeholder): use
+from_code() rather than creating new ones, and compare them by identity.
 """
 class Card():
 
-    regular_order = ['A', '10', 'K', 'Q', 'J', '9', '8', '7']
-    trump_order = ['J', '9', 'A', '10', 'K', 'Q', '8', '7']
-
-    regular_points = {
-         'A': 11,
-        '10': 10,
-         'K': 4,
-         'Q': 3,
-         'J': 2,
-         '9': 0,
-         '8': 0,
-         '7': 0,
-    }
-
-    trump_points = {
-         'J' : 20,
-         '9' : 14,
-         'A' : 11,
-        '10' : 10,
-         'K' : 4,
-         'Q' : 3,
-         '8' : 0,
-         '7' : 0,
-    }
+    __slots__ = ('_code', '_suit', '_value', '_index', '_mask')
 
     @property
     def code(self):
@@ -44,75 +25,75 @@ class Card():
 
     @property
     def suit(self):
-        return self._code[-1:]
+        return self._suit
 
 
     @property
     def value(self):
-        return self._code[:-1]
-
-
-    def __init__(self, code):
-        self._code = code
+        return self._value
 
 
-    def __eq__(self, other):
-        if not isinstance(other, Card):
-            return NotImplemented
-        return self.code == other.code
+    @property
+    def index(self):
+        # Bit index of the card (see bitboard), None for an empty card
+        return self._index
 
 
-    def sort_value(self, trump_suit):
+    @property
+    def mask(self):
+        return self._mask
 
-        is_trump = (trump_suit == self.suit or trump_suit == constants.Trump.AT)
 
-        # Global order of each suit within one's game
-        suit_order = ['H', 'C', 'D', 'S']
+    def __init__(self, code):
+        self._code = code
+        self._suit = code[-1:]
+        self._value = code[:-1]
+        self._index = bitboard.INDEX.get(code)
+        self._mask = bitboard.bit(code)
 
-        # Order within the suit, depending if we are trump
-        value_order = (Card.trump_order if is_trump else Card.regular_order)
 
-        return suit_order.index(self.suit) * 10 + value_order.index(self.value)
+    def sort_value(self, trump_suit):
+        return bitboard.SORT[trump_suit][self._index]
 
 
     def point_value(self, trump_suit):
-
-        is_trump = (trump_suit == self.suit or trump_suit == constants.Trump.AT)
-
-        points = (Card.trump_points if is_trump else Card.regular_points)
-
-        if trump_suit == constants.Trump.AT:
-            multiplier = float(152) / 248
-        elif trump_suit == constants.Trump.NT:
-            multiplier = float(152) / 120
-        else:
-            multiplier = 1
-
-        return multiplier * points[self.value]
+        # In 1/bitboard.SCALE units, see bitboard.display_points
+        return bitboard.POINTS[trump_suit][self._index]
 
 
     def overtakes(self, other, trump_suit):
         if other is None:
             return True
+        return bool(bitboard.BEATEN_BY[trump_suit][other._index] & self._mask)
 
-        is_trump = (trump_suit == self.suit
-            or trump_suit == constants.Trump.AT)
 
-        other_trump = (trump_suit == other.suit
-            or trump_suit == constants.Trump.AT)
 
-        # The trump always wins against anything else
-        if is_trump != other_trump:
-            return is_trump
+def from_code(code):
+    """
+    The card for a given code; anything that is not a card maps to EMPTY
+    """
+    return _by_code.get(code, EMPTY)
 
-        # Are we the right suit ?
-        if self.suit != other.suit:
-            return False
 
-        value_order = (Card.trump_order if is_trump else Card.regular_order)
+def from_index(idx):
+    """
+    The card for a bitboard index; anything out of range maps to EMPTY
+    """
+    return _by_index[idx] if 0 <= idx < len(_by_index) else EMPTY
 
-        return value_order.index(self.value) < value_order.index(other.value)
 
+def from_mask(mask):
+    """
+    Cards contained in a bitboard mask
+    """
+    return [_by_index[idx] for idx in bitboard.indices(mask)]
 
 
 all = [Card(code.value) for code in constants.CardCode]
+
+# Placeholder for a missing card (e.g. someone who has not played yet)
+EMPTY = Card("")
+
+# Kept apart from `all`, which callers are free to shuffle
+_by_index = tuple(all)
+_by_code = {c.code: c for c in all}
@@ -8,6 +8,9 @@ import logging
 import random
 import socket
 import os
+import struct
+import threading
+import time
 
 from . import constants
 from . import packet
@@ -19,14 +22,28 @@ from . import game
 log = logging.getLogger(__name__)
 
 
+# Seconds to keep trying to get back to the server once the connection drops
+RECONNECT_TIMEOUT = 60
+
+
 class Client:
 
-    def __init__(self, host, port, name, windowed):
+    def __init__(self, host, port, name, windowed, table=None,
+        spectate=False, max_fps=gui.MAX_FPS):
 
         # Server info
         self._host = host
         self._port = port
         self._windowed = windowed
+        self._max_fps = max_fps
+
+        # Table to sit at, None for the first one with a free seat
+        self._table = table
+        # Only watch that table, without taking a seat
+        self._spectate = spectate
+
+        # Latest game status received, base for GAME_DELTA
+        self._proxy = None
 
         # Local player instance
         identifier = "{:x}".format(random.getrandbits(32))
@@ -35,6 +52,23 @@ class Client:
 
     def run(self):
         # Connect to server
+        sock = self.__connect()
+        if sock is None:
+            os._exit(0)
+        self.__start_transport(sock)
+
+        # Create GUI
+        self._gui = gui.GUI(self._windowed, self._max_fps)
+        self._gui.on_trump_picked = self._pick_trump
+        self._gui.on_card_picked = self._play_card
+
+        # Register as a new player
+        self._register()
+
+        self._gui.run()
+
+
+    def __connect(self):
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             sock.connect((self._host, self._port))
@@ -44,24 +78,17 @@ class Client:
             log.error("Unable to establish connection to server {}:{}"
                 .format(self._host, self._port))
             sock.close()
-            os._exit(0)
+            return None
+        return sock
 
-        # Create transport
+
+    def __start_transport(self, sock):
+        self._proxy = None
         self._transport = transport.Transport(sock)
         self._transport.on_recv = self.__recv
         self._transport.on_drop = self.__drop
         self._transport.run()
 
-        # Create GUI
-        self._gui = gui.GUI(self._windowed)
-        self._gui.on_trump_picked = self._pick_trump
-        self._gui.on_card_picked = self._play_card
-
-        # Register as a new player
-        self._register()
-
-        self._gui.run()
-
 
     def _perform(self, opcode, *args):
         tx_packet = packet.Packet(constants.MessageType.COMMAND, opcode, *args)
@@ -70,14 +97,44 @@ class Client:
 
     def __drop(self, transport):
         log.error("Connection dropped with server")
+
+        # Its TX thread would otherwise wait for frames forever
+        transport.stop()
+
+        # The server may just be restarting: registering again with the same
+        # identifier gets us our seat back
+        thread = threading.Thread(target=self.__reconnect)
+        thread.daemon = True
+        thread.start()
+
+
+    def __reconnect(self):
+        deadline = time.monotonic() + RECONNECT_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(1)
+            sock = self.__connect()
+            if sock is not None:
+                self.__start_transport(sock)
+                self._register()
+                return
         os._exit(0)
 
 
     def _register(self):
+        if self._spectate:
+            self._perform(
+                constants.CommandOpcode.SPECTATE,
+                self._table or "0",
+                str(packet.BINARY_VERSION))
+            return
+
+        # Also offer to switch to the binary protocol
         self._perform(
             constants.CommandOpcode.CREATE_PLAYER,
             self._player.identifier,
-            self._player.name)
+            self._player.name,
+            self._table or "",
+            str(packet.BINARY_VERSION))
 
 
     def _pick_trump(self, trump):
@@ -89,6 +146,7 @@ class Client:
 
 
     def _handle_new_proxy(self, proxy):
+        self._proxy = proxy
         self._gui.set_game(proxy)
 
 
@@ -100,8 +158,34 @@ class Client:
             log.warn("Cannot handle incoming message {}", rx_packet)
             return
 
+        if rx_packet.opcode == constants.NotifOpcode.PROTOCOL:
+            # Server accepted binary frames: send ours that way from now on
+            self._transport.binary = True
+
         if rx_packet.opcode == constants.NotifOpcode.GAME_STATUS:
-            proxy = game.from_args(rx_packet.args)
+            try:
+                if rx_packet.body is not None:
+                    proxy = game.from_bytes(rx_packet.body)
+                else:
+                    proxy = game.from_args(rx_packet.args)
+            except (ValueError, IndexError, KeyError, struct.error) as e:
+                log.error("Invalid game status: {}".format(e))
+                self._perform(constants.CommandOpcode.RESYNC)
+                return
+            self._handle_new_proxy(proxy)
+
+        if rx_packet.opcode == constants.NotifOpcode.GAME_DELTA:
+            try:
+                proxy = (game.apply_delta(self._proxy, rx_packet.args)
+                    if self._proxy else None)
+            except (ValueError, IndexError, KeyError) as e:
+                # Raising here would end the RX thread
+                log.error("Invalid game delta: {}".format(e))
+                proxy = None
+            if proxy is None:
+                # Not based on what we have: ask for the whole status
+                self._perform(constants.CommandOpcode.RESYNC)
+                return
             self._handle_new_proxy(proxy)
 
 
@@ -19,6 +19,9 @@ MessageType = Enum('MessageType', [(a, a) for a in (
 # Notification opcodes
 NotifOpcode = Enum('NotifOpcode', [(a, a) for a in (
     'GAME_STATUS',
+    'TABLE_LIST',
+    'PROTOCOL',
+    'GAME_DELTA',
 )], type=str)
 
 
@@ -27,6 +30,11 @@ CommandOpcode = Enum('CommandOpcode', [(a, a) for a in (
     'CREATE_PLAYER',
     'PICK_TRUMP',
     'PLAY_CARD',
+    'LIST_TABLES',
+    'CREATE_TABLE',
+    'JOIN_TABLE',
+    'RESYNC',
+    'SPECTATE',
 )], type=str)
 
 
@@ -4,21 +4,33 @@
 # Proprietary and confidential.
 #
 
+import collections
 import logging
 import random
-import threading
+import struct
 
 from enum import Enum
 
+from . import bitboard
 from . import card
 from . import constants
+from . import packet
 from . import player
 from . import pli
+from . import scheduler
 
 
 log = logging.getLogger(__name__)
 
 
+_trumps = [trump.value for trump in constants.Trump]
+
+# Binary GameProxy encoding
+_NONE = 0xFF
+_proxy_header = struct.Struct('>BBHHB')
+_proxy_version = struct.Struct('>I')
+
+
 """
 Full game context holding the state of the current game for the server side
 Contains all the logic to advance the game to next level
@@ -33,11 +45,46 @@ class Game:
     )], type=str)
 
 
-    def __init__(self):
+    # See snapshot()
+    Snapshot = collections.namedtuple('Snapshot', (
+        'players',
+        'starting_player',
+        'round_ongoing',
+        'trump_suit',
+        'hands',
+        'points',
+        'taken',
+        'previous_pli',
+        'current_pli',
+        'deck',
+        'version',
+    ))
+
+
+    def __init__(self, rng=random, schedule=None, pli_delay=2, round_delay=10,
+        journal=None):
+        # Source of randomness for shuffling and cutting the deck
+        self._rng = rng
+
+        # How delayed transitions (end of pli, end of round) are run:
+        # schedule(delay, callback) returns a scheduler.Timer
+        self._schedule = schedule or scheduler.shared().schedule
+
+        # Seconds from the last card of a pli to the next pli, and from the
+        # last card of a round to the next round
+        self._pli_delay = pli_delay
+        self._round_delay = round_delay
+
+        # journal.Journal recording every event, if any
+        self._journal = journal
+
+        # Pending delayed transitions, cancelled if the round is interrupted
+        self._timers = []
+
         # Array of joined-in players
         self._players = []
 
-        # Map player -> array of card in hand
+        # Map player -> bitboard of the cards in hand
         self._hands = {}
 
         # Who started the current round (a "round" is 8 pli)
@@ -49,20 +96,33 @@ class Game:
         # The previous pli played
         self._previous_pli = None
 
-        # By team (even/odd), won pli so far and point total
-        self._plis = [[], []]
-        self._points = [0.0, 0.0]
+        # Pli won so far, in the order they were played. By team (even/odd),
+        # bitboard of the cards they hold and point total (in
+        # 1/bitboard.SCALE units)
+        self._plis = []
+        self._won = [0, 0]
+        self._points = [0, 0]
 
         # Misc
         self._trump_suit = None
 
-        self._deck = card.all
-        random.shuffle(self._deck)
+        self._deck = list(card.all)
+        self._rng.shuffle(self._deck)
 
         self._round_ongoing = False
 
-        # Callback
+        # Bumped on every status change, so that clients can tell which
+        # state they are looking at
+        self._version = 0
+
+        # Proxy cache: shared table view and proxies of version _view_version
+        self._view_version = None
+        self._view = None
+        self._proxies = {}
+
+        # Callbacks
         self.on_status_changed = None
+        self.on_round_finished = None
 
 
     @property
@@ -76,8 +136,39 @@ class Game:
         return Game.State.FINISHED
 
 
+    @property
+    def version(self):
+        return self._version
+
+
+    @property
+    def players(self):
+        return self._players
+
+
+    @property
+    def trump_suit(self):
+        return self._trump_suit
+
+
+    @property
+    def current_pli(self):
+        return self._current_pli
+
+
+    @property
+    def announcing_player(self):
+        # The player that has to pick the trump suit this round
+        return self._players[self._starting_player]
+
+
+    def hand(self, player):
+        # Bitboard of the cards in a player's hand
+        return self._hands.get(player, 0)
+
+
     def _cut(self, deck):
-        cut_idx = random.choice(range(len(deck)))
+        cut_idx = self._rng.choice(range(len(deck)))
         return deck[cut_idx:] + deck[:cut_idx]
 
 
@@ -87,22 +178,14 @@ class Game:
             self._starting_player, self._starting_player + 4)]
 
         idx = 0
-        dealt = {}
-
-        # 3
-        for i in range(4):
-            dealt[ordered_players[i]] = deck[idx:idx+3]
-            idx += 3
+        dealt = {p: 0 for p in ordered_players}
 
-        # 2
-        for i in range(4):
-            dealt[ordered_players[i]] += deck[idx:idx+2]
-            idx += 2
-
-        # 3
-        for i in range(4):
-            dealt[ordered_players[i]] += deck[idx:idx+3]
-            idx += 3
+        # 3, 2, 3
+        for count in (3, 2, 3):
+            for i in range(4):
+                dealt[ordered_players[i]] |= bitboard.from_cards(
+                    deck[idx:idx+count])
+                idx += count
 
         return dealt
 
@@ -110,7 +193,7 @@ class Game:
     def _start_pli(self, starting_player):
         self._current_pli = pli.Pli(self._players, starting_player)
 
-        self.on_status_changed()
+        self._status_changed()
 
 
     def _start_round(self):
@@ -119,13 +202,18 @@ class Game:
             return
 
         self._round_ongoing = True
+        self._timers = []
 
          # Reset values from previous round we want to keep while "Finished"
         self._trump_suit = None
-        self._points = [0.0, 0.0]
+        self._points = [0, 0]
         self._deck = self._cut(self._deck)
         self._hands = self._deal(self._deck)
 
+        if self._journal:
+            self._journal.deal(self._starting_player,
+                [self._hands[p] for p in self._players])
+
         self._start_pli(self._starting_player)
 
 
@@ -138,8 +226,16 @@ class Game:
             log.error("Only the starting player shall select the trump suit")
             return
 
+        if not suit in _trumps:
+            log.error("Invalid trump suit")
+            return
+
         self._trump_suit = suit
-        self.on_status_changed()
+
+        if self._journal:
+            self._journal.trump(self._starting_player, suit)
+
+        self._status_changed()
 
 
     def play_card(self, player, card):
@@ -148,7 +244,7 @@ class Game:
             return
 
         hand = self._hands[player]
-        if not card in hand:
+        if not hand & card.mask:
             log.error("Trying to play card not in player's hand")
             return
 
@@ -158,35 +254,54 @@ class Game:
             return
 
         # Actually play the card
-        self._current_pli.play_card(player, card)
-        self._hands[player].remove(card)
+        self._current_pli.play_card(player, card, self._trump_suit)
+        self._hands[player] &= ~card.mask
+
+        if self._journal:
+            self._journal.card(self._players.index(player), card.index)
 
-        is_last_pli = len(self._hands[player]) == 0
+        is_last_pli = self._hands[player] == 0
 
         if self._current_pli.is_complete:
             if is_last_pli:
-                # Round completed, will terminate the round in 2 seconds
-                threading.Timer(2, self._finish_round).start()
-                threading.Timer(10, self._start_round).start()
+                # Round completed, will terminate the round shortly
+                self._defer(self._pli_delay, self._finish_round)
+                self._defer(self._round_delay, self._start_round)
             else:
-                # Hand completed, will reset the pli in 2 seconds
-                threading.Timer(2, self._finish_pli).start()
+                # Hand completed, will reset the pli shortly
+                self._defer(self._pli_delay, self._finish_pli)
 
+        self._status_changed()
+
+
+    def _status_changed(self):
+        self._version += 1
         self.on_status_changed()
 
 
+    def _defer(self, delay, callback):
+        self._timers.append(self._schedule(delay, callback))
+
+
+    def _cancel_timers(self):
+        for timer in self._timers:
+            timer.cancel()
+        self._timers = []
+
+
     def _finish_pli(self):
 
         # Find out who won it
         taking_player = self._current_pli.taking_player(self._trump_suit)
         taking_player_idx = self._players.index(taking_player)
 
-        is_last_pli = len(self._hands[taking_player]) == 0
+        is_last_pli = self._hands[taking_player] == 0
 
         points = (self._current_pli.total_points(self._trump_suit)
-            + (10 if is_last_pli else 0))
+            + (10 * bitboard.SCALE if is_last_pli else 0))
 
-        self._plis[taking_player_idx % 2].append(self._current_pli)
+        self._plis.append(self._current_pli)
+        self._won[taking_player_idx % 2] |= self._current_pli.mask
         self._points[taking_player_idx % 2] += points
 
         self._previous_pli = self._current_pli
@@ -198,11 +313,12 @@ class Game:
         self._current_pli = None
         self._previous_pli = None
         self._hands = {}
-        self._plis = [[], []]
+        self._plis = []
+        self._won = [0, 0]
         self._starting_player = (self._starting_player + 1) % 4
         self._round_ongoing = False
 
-        self.on_status_changed()
+        self._status_changed()
 
 
     def _finish_round(self):
@@ -210,9 +326,17 @@ class Game:
         # Finish the last pli
         self._finish_pli()
 
+        if self._journal:
+            self._journal.round(self._trump_suit, self._points)
+
+        if self.on_round_finished:
+            self.on_round_finished(self._trump_suit, list(self._points))
+
         # Reasssemble the deck
-        odd_cards = sum([pli.cards for pli in self._plis[0]], [])
-        even_cards = sum([pli.cards for pli in self._plis[1]], [])
+        odd_cards = sum([pli.cards for pli in self._plis
+            if pli.taking_player_idx(self._trump_suit) % 2 == 0], [])
+        even_cards = sum([pli.cards for pli in self._plis
+            if pli.taking_player_idx(self._trump_suit) % 2 == 1], [])
         self._deck = odd_cards + even_cards
 
         # Clean current round
@@ -226,10 +350,13 @@ class Game:
 
         self._players.append(player)
 
+        if self._journal:
+            self._journal.join(len(self._players) - 1, player.name)
+
         if len(self._players) == 4:
             self._start_round()
         else:
-            self.on_status_changed()
+            self._status_changed()
 
 
     def remove_player(self, player):
@@ -238,13 +365,165 @@ class Game:
             return
 
         state = self.state
+
+        if self._journal:
+            self._journal.leave(self._players.index(player))
+
         self._players.remove(player)
 
+        # Whatever was about to happen (next pli, next round) no longer can
+        self._cancel_timers()
+
         if self._round_ongoing:
             log.info("Player left while in a round: resetting")
             self._reset_round()
         else:
-            self.on_status_changed()
+            self._status_changed()
+
+
+    def snapshot(self):
+        """
+        Everything needed to restore() the game as it is now
+        Made of immutable values only (players aside), so that it can be kept
+        or serialized while the game goes on. Plis are given by their
+        starting seat and the indices of the cards played, in order, and
+        the plis taken so far in the order they were played.
+        """
+        def cards(p):
+            return (self._players.index(p.starting_player),
+                tuple(c.index for c in p.cards))
+
+        return Game.Snapshot(
+            players=tuple(self._players),
+            starting_player=self._starting_player,
+            round_ongoing=self._round_ongoing,
+            trump_suit=self._trump_suit,
+            hands=tuple(self._hands.get(p, 0) for p in self._players),
+            points=tuple(self._points),
+            taken=tuple(cards(p) for p in self._plis),
+            previous_pli=cards(self._previous_pli)
+                if self._previous_pli else None,
+            current_pli=cards(self._current_pli)
+                if self._current_pli else None,
+            deck=tuple(c.index for c in self._deck),
+            version=self._version)
+
+
+    def restore(self, snapshot):
+        """
+        Go back to a snapshot() of this or another game
+        Transitions that were pending then (end of pli, next round) are
+        scheduled again.
+        """
+        self._cancel_timers()
+
+        self._players = list(snapshot.players)
+        self._starting_player = snapshot.starting_player
+        self._round_ongoing = snapshot.round_ongoing
+        self._trump_suit = snapshot.trump_suit
+        self._hands = dict(zip(self._players, snapshot.hands))
+        self._points = list(snapshot.points)
+        self._deck = [card.from_index(idx) for idx in snapshot.deck]
+
+        def replay(cards):
+            if cards is None:
+                return None
+            starting_player_idx, indices = cards
+            p = pli.Pli(self._players, starting_player_idx)
+            for idx in indices:
+                p.play_card(
+                    self._players[(starting_player_idx + len(p.cards)) % 4],
+                    card.from_index(idx), self._trump_suit)
+            return p
+
+        self._plis = []
+        self._won = [0, 0]
+        for cards in snapshot.taken:
+            p = replay(cards)
+            self._plis.append(p)
+            self._won[p.taking_player_idx(self._trump_suit) % 2] |= p.mask
+
+        self._previous_pli = replay(snapshot.previous_pli)
+        self._current_pli = replay(snapshot.current_pli)
+
+        # A complete pli is only ever waiting to be collected
+        if self._round_ongoing and self._current_pli.is_complete:
+            if not any(self._hands.values()):
+                self._defer(self._pli_delay, self._finish_round)
+                self._defer(self._round_delay, self._start_round)
+            else:
+                self._defer(self._pli_delay, self._finish_pli)
+        elif not self._round_ongoing and len(self._players) == 4:
+            self._defer(self._round_delay, self._start_round)
+
+        if self._journal:
+            self._journal_restored()
+
+        # Whoever looks at the game must see it changed
+        self._version = max(self._version, snapshot.version)
+        self._status_changed()
+
+
+    def _journal_restored(self):
+        # The journal gets the restored game as if it had just been played:
+        # players, then the round so far
+        for seat, p in enumerate(self._players):
+            self._journal.join(seat, p.name)
+
+        if not self._round_ongoing:
+            return
+
+        played = []
+        for p in self._plis + [self._current_pli]:
+            starting_player_idx = self._players.index(p.starting_player)
+            for idx, c in enumerate(p.cards):
+                played.append(((starting_player_idx + idx) % 4, c))
+
+        hands = [self._hands[p] for p in self._players]
+        for seat, c in played:
+            hands[seat] |= c.mask
+
+        self._journal.deal(self._starting_player, hands)
+        if self._trump_suit is not None:
+            self._journal.trump(self._starting_player, self._trump_suit)
+        for seat, c in played:
+            self._journal.card(seat, c.index)
+
+
+    def _table_view(self):
+        """
+        Everything in a proxy that does not depend on who is looking, by seat
+        Computed once per version and shared by every proxy of that version
+        """
+        if self._view_version == self._version:
+            return self._view
+
+        players = self._players
+        seats = range(len(players))
+
+        def by_seat(pli):
+            cards = [card.EMPTY] * 4
+            if pli:
+                for idx in seats:
+                    cards[idx] = pli.card_played_by(players[idx]) or card.EMPTY
+            return cards
+
+        self._view = {
+            'state': self.state,
+            'points': [bitboard.display_points(p) for p in self._points],
+            'starting_player': (players.index(
+                self._current_pli.starting_player)
+                    if self._current_pli
+                else self._starting_player),
+            'players': [players[idx].name if idx < len(players) else ""
+                for idx in range(4)],
+            'current_pli': by_seat(self._current_pli),
+            'previous_pli': by_seat(self._previous_pli),
+        }
+        self._view_version = self._version
+        self._proxies = {}
+
+        return self._view
 
 
     def proxy_for_player(self, player):
@@ -252,63 +531,58 @@ class Game:
             log.error("Attempting to generate a proxy for a player not in game")
             return None
 
-        # Create a permutation so that the requesting player is always index 0
-        player_index = self._players.index(player)
-        idx_permutation = [
-            (player_index + 0) % 4,
-            (player_index + 1) % 4,
-            (player_index + 2) % 4,
-            (player_index + 3) % 4
-        ]
+        return self._proxy(player)
+
+
+    def public_proxy(self):
+        """
+        What a spectator sees: the table from the first seat, without hand
+        """
+        return self._proxy(None)
+
+
+    def _proxy(self, player):
+        view = self._table_view()
+
+        # Proxies of the current version are built once, and never modified
+        proxy = self._proxies.get(player)
+        if proxy is not None:
+            return proxy
+
+        # Rotate the table so that the requesting player is always index 0
+        player_index = (self._players.index(player)
+            if player is not None else 0)
+
+        def rotate(seats):
+            return seats[player_index:] + seats[:player_index]
 
         proxy = GameProxy()
 
-        proxy._state = self.state
+        proxy._version = self._version
+        proxy._state = view['state']
         proxy._trump_suit = self._trump_suit
-        proxy._player_points = round(self._points[(player_index % 2)])
-        proxy._enemy_points  = round(self._points[(player_index + 1) % 2])
-
-        starting_player_idx = (self._players.index(
-            self._current_pli.starting_player)
-                if self._current_pli
-            else self._starting_player)
-
-        proxy._starting_player = idx_permutation.index(starting_player_idx)
-
-        proxy._players = [
-            self._players[idx].name if idx < len(self._players) else ""
-                for idx in idx_permutation
-        ]
-
-        proxy._current_pli = [
-            self._current_pli.card_played_by(self._players[idx])
-                if self._current_pli and self._current_pli.card_played_by(
-                    self._players[idx])
-                else card.Card("")
-            for idx in idx_permutation
-        ]
-
-        proxy._previous_pli = [
-            self._previous_pli.card_played_by(self._players[idx])
-                if self._previous_pli and self._previous_pli.card_played_by(
-                    self._players[idx])
-                else card.Card("")
-            for idx in idx_permutation
-        ]
-
-        proxy._hand = self._hands[player] if player in self._hands else []
+        proxy._player_points = view['points'][player_index % 2]
+        proxy._enemy_points  = view['points'][(player_index + 1) % 2]
+        proxy._starting_player = (view['starting_player'] - player_index) % 4
+        proxy._players = rotate(view['players'])
+        proxy._current_pli = rotate(view['current_pli'])
+        proxy._previous_pli = rotate(view['previous_pli'])
+
+        hand = self._hands.get(player, 0)
+        proxy._hand = card.from_mask(hand)
         proxy._hand.sort(key=lambda x: x.sort_value(self._trump_suit))
 
-        proxy._legal = [
-            (1 if self._current_pli.is_card_legal(player ,card, proxy._hand,
-                self._trump_suit) else 0)
-                    if self._current_pli else 0
-                for card in proxy._hand
-            ]
+        legal = (self._current_pli.legal_moves(player, hand, self._trump_suit)
+            if self._current_pli and hand else 0)
+        proxy._legal = [1 if legal & c.mask else 0 for c in proxy._hand]
 
+        self._proxies[player] = proxy
         return proxy
 
 
+_states = list(Game.State)
+
+
 """
 A simplified game context containing only what is necessary for the client side,
 and not game logic
@@ -316,6 +590,7 @@ and not game logic
 class GameProxy:
 
     def __init__(self):
+        self._version = 0
         self._state = None
         self._trump_suit = None
         self._starting_player = 0
@@ -323,10 +598,16 @@ class GameProxy:
         self._enemy_points = 0
         self._players = []
         self._current_pli = []
+        self._previous_pli = []
         self._hand = []
         self._legal = []
 
 
+    @property
+    def version(self):
+        return self._version
+
+
     @property
     def state(self):
         return self._state
@@ -393,9 +674,66 @@ class GameProxy:
         args += [card.code for card in self._hand]
         args += [str(legal) for legal in self._legal]
 
+        args.append(str(self._version))
+
         return args
 
 
+    def delta_args(self, previous):
+        """
+        Arguments of a GAME_DELTA from previous to this proxy:
+        base version, version, then for each field that changed its index in
+        _delta_fields, its number of values and the values
+        """
+        args = [str(previous._version), str(self._version)]
+
+        for idx, (name, encode, _) in enumerate(_delta_fields):
+            value = getattr(self, name)
+            if value == getattr(previous, name):
+                continue
+            values = encode(value)
+            args += [str(idx), str(len(values))]
+            args += values
+
+        return args
+
+
+    def to_bytes(self):
+        """
+        Compact binary form (see packet.BINARY_VERSION):
+        state, trump, points, starting player, 4 length-prefixed names,
+        one byte per card of both plis, hand size and cards, legal bitmask,
+        version
+        """
+        buf = bytearray(_proxy_header.pack(
+            _states.index(self._state),
+            _trumps.index(self._trump_suit) if self._trump_suit else _NONE,
+            self._player_points,
+            self._enemy_points,
+            self._starting_player))
+
+        for name in self._players:
+            encoded = packet.truncate_utf8(name)
+            buf.append(len(encoded))
+            buf += encoded
+
+        for c in self._current_pli + self._previous_pli:
+            buf.append(_NONE if c.index is None else c.index)
+
+        buf.append(len(self._hand))
+        buf += bytes(c.index for c in self._hand)
+
+        legal_mask = 0
+        for idx, legal in enumerate(self._legal):
+            if legal:
+                legal_mask |= 1 << idx
+        buf.append(legal_mask)
+
+        buf += _proxy_version.pack(self._version)
+
+        return bytes(buf)
+
+
 def from_args(args):
 
     proxy = GameProxy()
@@ -420,16 +758,103 @@ def from_args(args):
     proxy._players = args[idx: idx+4]
     idx += 4
 
-    proxy._current_pli = [card.Card(code) for code in args[idx: idx+4]]
+    proxy._current_pli = [card.from_code(c) for c in args[idx: idx+4]]
     idx += 4
-    proxy._previous_pli = [card.Card(code) for code in args[idx: idx+4]]
+    proxy._previous_pli = [card.from_code(c) for c in args[idx: idx+4]]
     idx += 4
 
     hand_count = int(args[idx])
     idx += 1
-    proxy._hand = [card.Card(code) for code in args[idx: idx+hand_count]]
+    proxy._hand = [card.from_code(c) for c in args[idx: idx+hand_count]]
     idx += hand_count
     proxy._legal = [int(legal) for legal in args[idx: idx+hand_count]]
     idx += hand_count
 
+    # Servers that do not send deltas do not send versions either
+    if idx < len(args):
+        proxy._version = int(args[idx])
+
+    return proxy
+
+
+def apply_delta(proxy, args):
+    """
+    New proxy from proxy and the arguments of a GAME_DELTA, or None if the
+    delta does not apply to this proxy's version
+    """
+    if int(args[0]) != proxy._version:
+        return None
+
+    updated = GameProxy()
+    updated.__dict__.update(proxy.__dict__)
+    updated._version = int(args[1])
+
+    idx = 2
+    while idx < len(args):
+        name, _, decode = _delta_fields[int(args[idx])]
+        count = int(args[idx+1])
+        setattr(updated, name, decode(args[idx+2: idx+2+count]))
+        idx += 2 + count
+
+    return updated
+
+
+def from_bytes(buf):
+
+    proxy = GameProxy()
+
+    (state, trump, proxy._player_points, proxy._enemy_points,
+        proxy._starting_player) = _proxy_header.unpack_from(buf)
+    idx = _proxy_header.size
+
+    proxy._state = _states[state]
+    proxy._trump_suit = _trumps[trump] if trump != _NONE else ""
+
+    proxy._players = []
+    for _ in range(4):
+        length = buf[idx]
+        proxy._players.append(buf[idx+1:idx+1+length].decode('utf-8', 'strict'))
+        idx += 1 + length
+
+    plis = [card.from_index(c) for c in buf[idx: idx+8]]
+    proxy._current_pli = plis[:4]
+    proxy._previous_pli = plis[4:]
+    idx += 8
+
+    hand_count = buf[idx]
+    idx += 1
+    proxy._hand = [card.from_index(c) for c in buf[idx: idx+hand_count]]
+    idx += hand_count
+
+    legal_mask = buf[idx]
+    proxy._legal = [(legal_mask >> i) & 1 for i in range(hand_count)]
+    idx += 1
+
+    proxy._version, = _proxy_version.unpack_from(buf, idx)
+
     return proxy
+
+
+def _codes(cards):
+    return [c.code for c in cards]
+
+
+def _cards(codes):
+    return [card.from_code(c) for c in codes]
+
+
+# GameProxy fields carried by GAME_DELTA, in wire order (only ever append):
+# (attribute, encode to list of strings, decode from list of strings)
+_delta_fields = [
+    ('_state',           lambda v: [v],           lambda a: a[0]),
+    ('_trump_suit',      lambda v: [v or ""],     lambda a: a[0]),
+    ('_player_points',   lambda v: [str(v)],      lambda a: int(a[0])),
+    ('_enemy_points',    lambda v: [str(v)],      lambda a: int(a[0])),
+    ('_starting_player', lambda v: [str(v)],      lambda a: int(a[0])),
+    ('_players',         list,                    list),
+    ('_current_pli',     _codes,                  _cards),
+    ('_previous_pli',    _codes,                  _cards),
+    ('_hand',            _codes,                  _cards),
+    ('_legal',           lambda v: [str(l) for l in v],
+                                                  lambda a: [int(l) for l in a]),
+]
@@ -4,19 +4,53 @@
 # Proprietary and confidential.
 #
 
+import collections
 import logging
 import pygame
 import os
+import threading
 
 from . import constants
 from . import game
 
 from . geometry import *
 
+log = logging.getLogger(__name__)
+
+
+BACKGROUND_COLOR = (80, 150, 15)
+TOOLBAR_COLOR = (100, 100, 100)
+TEXT_COLOR = (255, 255, 255)
+
+# Rendered texts kept, past which the cache starts over
+TEXT_CACHE_MAX = 256
+
+# Frames per second the display is updated at, at most
+MAX_FPS = 30
+
+# Posted when set_game() hands a new proxy over
+GAME_EVENT = pygame.USEREVENT + 1
+
+# Milliseconds between GAME_EVENTs from a timer, while posting one failed
+POST_RETRY_INTERVAL = 100
+
+# Layers of the scene, bottom to top
+LAYERS = ('toolbar', 'hand', 'pli', 'names', 'trump', 'selector')
+
+
+# Something drawn on screen: content is ('fill', color), ('texture', name) or
+# ('text', string), rect is (x, y, width, height)
+Sprite = collections.namedtuple('Sprite', ['content', 'rect'])
+
+
+def _int_rect(rect):
+    return (int(rect.min_x), int(rect.min_y), int(rect.width),
+        int(rect.height))
+
 
 class GUI:
 
-    def __init__(self, windowed):
+    def __init__(self, windowed, max_fps=MAX_FPS):
 
         # Setup window
         if windowed:
@@ -27,6 +61,7 @@ class GUI:
         # GUI is not threaded, the runloop takes place in the main thread
         # This means run() won't return
         self._running = False
+        self._max_fps = max_fps
 
         # Callbacks
         self.on_trump_picked = None
@@ -36,32 +71,100 @@ class GUI:
         self._card_rects = []
         self._trump_rects = []
 
+        # Proxy shown, only touched by the GUI thread
         self._game = None
+
+        # Latest proxy from set_game(), whether a GAME_EVENT is posted for it
+        # already, and whether a timer posts them since posting failed
+        self._pending_game = None
+        self._pending_posted = False
+        self._pending_timer = False
+        self._pending_lock = threading.Lock()
+
         self._texture_cache = {}
+        self._text_cache = {}
+        self._font = None
+
+        # Map layer -> sprites on screen, None until the whole screen is
+        # drawn, and the proxy they show
+        self._scene = None
+        self._scene_proxy = None
 
         pygame.display.set_caption("Belote")
         pygame.init()
 
+        # Only wake up for what we handle: not for mouse motion
+        pygame.event.set_blocked(None)
+        pygame.event.set_allowed([pygame.QUIT, pygame.MOUSEBUTTONDOWN,
+            pygame.VIDEOEXPOSE, pygame.VIDEORESIZE, GAME_EVENT])
+
 
     def set_game(self, game):
-        self._game = game
+        # Called from the network thread: the GUI thread picks the proxy up
+        # on the next GAME_EVENT. Proxies received before it does are
+        # skipped.
+        with self._pending_lock:
+            self._pending_game = game
+            if self._pending_posted:
+                return
+            self._pending_posted = True
+
+        try:
+            posted = pygame.event.post(pygame.event.Event(GAME_EVENT))
+        except pygame.error as e:
+            log.warning("Could not post game event: {}".format(e))
+            posted = False
+
+        # False when the event queue is full or the event blocked (None with
+        # older pygame): a timer posts GAME_EVENTs until one gets through
+        if posted is False:
+            with self._pending_lock:
+                self._pending_timer = True
+            pygame.time.set_timer(GAME_EVENT, POST_RETRY_INTERVAL)
+
+
+    def __take_game(self):
+        with self._pending_lock:
+            self._game = self._pending_game
+            self._pending_posted = False
+            timer, self._pending_timer = self._pending_timer, False
+        if timer:
+            pygame.time.set_timer(GAME_EVENT, 0)
+
+
+    def invalidate(self):
+        # Draw the whole screen again on the next redraw
+        self._scene = None
 
 
     def run(self):
         self._running = True
+        clock = pygame.time.Clock()
+        self._redraw(self._game)
+
         while self._running:
 
-            # Redraw
-            self._redraw(self._game)
+            # Sleep until something happens, then take whatever else is
+            # pending as well
+            events = [pygame.event.wait()] + pygame.event.get()
 
             # Process input events
-            for event in pygame.event.get():
+            for event in events:
                 if event.type == pygame.QUIT:
                     self._running = False
                     pygame.quit()
                     os._exit(1)
                 if event.type == pygame.MOUSEBUTTONDOWN:
                     self._handle_click(event)
+                if event.type in (pygame.VIDEOEXPOSE, pygame.VIDEORESIZE):
+                    self.invalidate()
+                if event.type == GAME_EVENT:
+                    self.__take_game()
+
+            # Redraw, if anything changed, then let events pile up until the
+            # next frame is due
+            self._redraw(self._game)
+            clock.tick(self._max_fps)
 
 
     def _texture(self, name, size = None):
@@ -76,12 +179,77 @@ class GUI:
         surface = pygame.image.load(texture_path)
         if size != None:
             surface = pygame.transform.smoothscale(surface, size)
+        surface = surface.convert_alpha()
         self._texture_cache[key] = surface
 
         return surface
 
 
+    def _text(self, text):
+
+        surface = self._text_cache.get(text)
+        if surface is not None:
+            return surface
+
+        if self._font is None:
+            self._font = pygame.font.SysFont('arial', 20)
+        if len(self._text_cache) >= TEXT_CACHE_MAX:
+            self._text_cache = {}
+
+        surface = self._font.render(text, 1, TEXT_COLOR)
+        self._text_cache[text] = surface
+        return surface
+
+
     def _redraw(self, proxy):
+        # Lay the scene out, then only draw again the regions where a sprite
+        # appeared, moved, changed or disappeared since the previous redraw
+        if self._scene is not None and proxy is self._scene_proxy:
+            return
+
+        scene = self._layout(proxy)
+        self._scene_proxy = proxy
+
+        if self._scene is None:
+            dirty = [pygame.Rect(0, 0,
+                self._win.get_width(), self._win.get_height())]
+        else:
+            dirty = []
+            for layer in LAYERS:
+                changed = set(self._scene[layer]) ^ set(scene[layer])
+                dirty += [pygame.Rect(sprite.rect) for sprite in changed]
+
+        self._scene = scene
+        if not dirty:
+            return
+
+        for rect in dirty:
+            self._win.set_clip(rect)
+            self._win.fill(BACKGROUND_COLOR, rect)
+            for layer in LAYERS:
+                for sprite in scene[layer]:
+                    if rect.colliderect(sprite.rect):
+                        self._draw(sprite)
+        self._win.set_clip(None)
+
+        pygame.display.update(dirty)
+
+
+    def _draw(self, sprite):
+        kind, value = sprite.content
+        x, y, width, height = sprite.rect
+
+        if kind == 'fill':
+            self._win.fill(value, sprite.rect)
+        elif kind == 'texture':
+            self._win.blit(self._texture(value, (width, height)), (x, y))
+        else:
+            self._win.blit(self._text(value), (x, y))
+
+
+    def _layout(self, proxy):
+
+        scene = {layer: () for layer in LAYERS}
 
         screen = Rect(
             origin = Point(0, 0),
@@ -89,30 +257,20 @@ class GUI:
 
         game_area = Rect(center = screen.center, size = Size(800, 800))
 
-        # Background: solid green color over the wholes screen
-        background = pygame.Surface((screen.width, screen.height))
-        background = background.convert()
-        background.fill((80, 150, 15))
-
-        self._win.blit(background, (screen.origin.x, screen.origin.y))
-
         # Toolbar: bottom of the screen
         toolbar_height = 40
         toolbar_rect = Rect(
             origin = Point(screen.min_x, screen.max_y - toolbar_height),
             size = Size(screen.width, toolbar_height))
 
-        toolbar = pygame.Surface((toolbar_rect.width, toolbar_rect.height))
-        toolbar = toolbar.convert()
-        toolbar.fill((100, 100, 100))
+        toolbar = [Sprite(('fill', TOOLBAR_COLOR), _int_rect(toolbar_rect))]
+        scene['toolbar'] = tuple(toolbar)
 
-        self._win.blit(toolbar, (toolbar_rect.origin.x, toolbar_rect.origin.y))
+        self._card_rects = []
+        self._trump_rects = []
 
         if proxy is None:
-            pygame.display.update()
-            return
-
-        font = pygame.font.SysFont('arial', 20)
+            return scene
 
         # Game status
         status = {
@@ -122,22 +280,23 @@ class GUI:
             game.Game.State.FINISHED:            "Finished",
         }
 
-        status_text = font.render(status[proxy.state], 1, (255, 255, 255))
+        status_text = self._text(status[proxy.state])
         status_origin = Point(
             toolbar_rect.min_x + 30,
             toolbar_rect.mid_y - status_text.get_height() / 2)
 
-        self._win.blit(status_text, (status_origin.x, status_origin.y))
+        toolbar.append(self._text_sprite(status[proxy.state], status_origin))
 
         # Points
         points = "us: {} - them: {}".format(
             proxy.player_points, proxy.enemy_points)
-        points_text = font.render(points, 1, (255, 255, 255))
+        points_text = self._text(points)
         points_origin = Point(
             toolbar_rect.max_x - 30 - points_text.get_width(),
             toolbar_rect.mid_y - points_text.get_height() / 2)
 
-        self._win.blit(points_text, (points_origin.x, points_origin.y))
+        toolbar.append(self._text_sprite(points, points_origin))
+        scene['toolbar'] = tuple(toolbar)
 
         # Hand
         card_spacing = 30
@@ -157,8 +316,7 @@ class GUI:
             center = hand_zone_center,
             size = Size(hand_zone_width, hand_zone_height))
 
-        self._card_rects = []
-
+        hand = []
         for i in range(num_cards_hand):
             card_hilight = proxy.legal[i] and 1 - proxy.legal[i] in proxy.legal
 
@@ -168,12 +326,11 @@ class GUI:
                     hand_zone_rect.min_y - (30 if card_hilight else 0)),
                 size = card_size)
 
-            card_rect = pygame.Rect(
-                card_position.origin.x, card_position.origin.y,
-                card_size.width, card_size.height)
-
-            self._card_rects.append(card_rect)
-            self._smooth_draw(proxy.hand[i].code, card_position)
+            sprite = Sprite(('texture', proxy.hand[i].code),
+                _int_rect(card_position))
+            self._card_rects.append(pygame.Rect(sprite.rect))
+            hand.append(sprite)
+        scene['hand'] = tuple(hand)
 
         # Current pli
         main_play_area_size = Size(
@@ -183,13 +340,15 @@ class GUI:
             origin = game_area.origin,
             size = main_play_area_size)
 
-        self._render_pli(proxy.current_pli, card_zone_rect, card_size)
-
         # Previous pli
         previous_pli_rect = Rect(
             origin = Point(0, 0),
             size = Size(320, 280))
-        self._render_pli(proxy.previous_pli, previous_pli_rect, small_card_size)
+
+        scene['pli'] = tuple(
+            self._layout_pli(proxy.current_pli, card_zone_rect, card_size) +
+            self._layout_pli(proxy.previous_pli, previous_pli_rect,
+                small_card_size))
 
         # Player names
         player_names_contour = card_zone_rect.inset_by(50, 20)
@@ -200,28 +359,30 @@ class GUI:
             3: player_names_contour.center_left,
         }
 
+        names = []
         for idx in range(4):
             player_name = proxy.players[idx]
 
             # Add an indicator if this is the current "first" player
-            if idx == self._game.starting_player:
+            if idx == proxy.starting_player:
                 player_name = '• {} •'.format(player_name)
 
-            player_text = font.render(player_name, 1, (255, 255, 255))
+            player_text = self._text(player_name)
             player_text_rect = Rect(
                 center = player_name_center[idx],
                 size = Size(player_text.get_width(), player_text.get_height()))
 
-            self._win.blit(player_text,
-                (player_text_rect.origin.x, player_text_rect.origin.y))
+            names.append(self._text_sprite(player_name,
+                player_text_rect.origin))
+        scene['names'] = tuple(names)
 
         # Current Trump suit
         if proxy.trump_suit:
             trump_rect = Rect(origin = Point(10, 10), size = Size(50, 50))
-            self._smooth_draw(proxy.trump_suit, trump_rect)
+            scene['trump'] = (Sprite(('texture', proxy.trump_suit),
+                _int_rect(trump_rect)),)
 
         # Trump selection if necessary
-        self._trump_rects = []
         if proxy.state == game.Game.State.ANNOUNCING \
             and proxy.starting_player == 0:
 
@@ -237,28 +398,28 @@ class GUI:
                 constants.Trump.NT: trump_zone_contour.bottom_right,
             }
 
+            selector = []
             for trump in trumps:
                 trump_size = Size(150, 150)
                 trump_rect = Rect(
                     center = trump_center[trump],
                     size = trump_size)
-                self._trump_rects.append(pygame.Rect(
-                    trump_rect.origin.x, trump_rect.origin.y,
-                    trump_rect.width, trump_rect.height
-                ))
-                self._smooth_draw(trump, trump_rect)
+                sprite = Sprite(('texture', trump), _int_rect(trump_rect))
+                self._trump_rects.append(pygame.Rect(sprite.rect))
+                selector.append(sprite)
+            scene['selector'] = tuple(selector)
 
-        pygame.display.update()
+        return scene
 
 
-    def _smooth_draw(self, texture_name, rect):
-        texture = self._texture(texture_name, (rect.width, rect.height))
-        self._win.blit(texture, (rect.min_x, rect.min_y))
+    def _text_sprite(self, text, origin):
+        surface = self._text(text)
+        return Sprite(('text', text), (int(origin.x), int(origin.y),
+            surface.get_width(), surface.get_height()))
 
 
-    # Create and appends the rect to self
-    # Also apply the bit texture to the rects
-    def _render_pli(self, pli, rect, card_size):
+    # Sprites of the cards of a pli, around the center of rect
+    def _layout_pli(self, pli, rect, card_size):
 
         card_zone_contour = rect.inset_by(
             card_size.width + 25,
@@ -271,6 +432,7 @@ class GUI:
             3: card_zone_contour.center_left,
         }
 
+        sprites = []
         for idx in range(4):
             card = pli[idx]
 
@@ -278,8 +440,9 @@ class GUI:
                 continue
 
             card_rect = Rect(center = card_center[idx], size = card_size)
+            sprites.append(Sprite(('texture', card.code), _int_rect(card_rect)))
 
-            self._smooth_draw(card.code, card_rect)
+        return sprites
 
 
     def _handle_click(self, event):
@@ -0,0 +1,220 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Append-only binary journal of what happens at a table
+
+Every event is one fixed-size record: kind, seat, one 16-bit argument and
+three 32-bit values. Records are packed into a preallocated buffer and only
+written out when it is full or a round ends, so that journaling a card costs
+a single struct.pack_into.
+
+    HEADER  arg: format version, a: wall clock time at opening. Starts an
+            empty table, followed by a JOIN for each player already seated
+    JOIN    seat: where the player sat, a-c: utf-8 name, truncated to 12 bytes
+    LEAVE   seat: the seat freed (the next players move up a seat)
+    DEAL    seat: starting player, a-c: hands of seats 0 to 2 (bitboards,
+            seat 3 holds the remaining cards)
+    TRUMP   seat: who picked, arg: trump index in bitboard.TRUMPS
+    CARD    seat: who played, arg: card index
+    ROUND   arg: trump index, a-b: points of both teams (1/SCALE units)
+"""
+
+import collections
+import logging
+import mmap
+import os
+import struct
+import time
+
+from . import bitboard
+
+log = logging.getLogger(__name__)
+
+
+VERSION = 1
+
+HEADER, JOIN, LEAVE, DEAL, TRUMP, CARD, ROUND = range(7)
+
+_record = struct.Struct('>BBHIII')
+_record_name = struct.Struct('>BBH12s')
+_name = struct.Struct('>III')
+
+RECORD_LEN = _record.size
+
+Record = collections.namedtuple('Record', 'kind seat arg a b c')
+
+
+class Journal:
+
+    def __init__(self, path, buffer_records=256, fsync_interval=5,
+        max_bytes=1 << 24, backups=4):
+
+        self._path = path
+
+        # Records not written out yet
+        self._buffer = bytearray(buffer_records * RECORD_LEN)
+        self._offset = 0
+
+        # Durability: written data is synced at most every fsync_interval
+        # seconds, on a flush
+        self._fsync_interval = fsync_interval
+        self._synced_at = time.monotonic()
+
+        # Once larger than max_bytes, the file is moved to path.1 (path.1 to
+        # path.2...) at the end of a round, keeping that many backups
+        self._max_bytes = max_bytes
+        self._backups = backups
+
+        # Names of the seated players, so that every file starts with them
+        self._seats = []
+
+        self._file = None
+        self.__open()
+
+
+    @property
+    def path(self):
+        return self._path
+
+
+    def __open(self):
+        self._file = open(self._path, 'ab', buffering=0)
+        self._size = self._file.tell()
+        self.__append(HEADER, 0, VERSION, int(time.time()))
+        for seat, name in enumerate(self._seats):
+            self.__append_join(seat, name)
+
+
+    def __append(self, kind, seat, arg, a=0, b=0, c=0):
+        if self._offset == len(self._buffer):
+            self.flush()
+        _record.pack_into(self._buffer, self._offset, kind, seat, arg, a, b, c)
+        self._offset += RECORD_LEN
+
+
+    def join(self, seat, name):
+        self._seats.insert(seat, name)
+        self.__append_join(seat, name)
+
+
+    def __append_join(self, seat, name):
+        if self._offset == len(self._buffer):
+            self.flush()
+        _record_name.pack_into(self._buffer, self._offset, JOIN, seat, 0,
+            name.encode('utf-8')[:12])
+        self._offset += RECORD_LEN
+
+
+    def leave(self, seat):
+        del self._seats[seat]
+        self.__append(LEAVE, seat, 0)
+
+
+    def deal(self, starting_seat, hands):
+        self.__append(DEAL, starting_seat, 0, hands[0], hands[1], hands[2])
+
+
+    def trump(self, seat, trump_suit):
+        self.__append(TRUMP, seat, bitboard.TRUMPS.index(trump_suit))
+
+
+    def card(self, seat, card_index):
+        self.__append(CARD, seat, card_index)
+
+
+    def round(self, trump_suit, points):
+        self.__append(ROUND, 0, bitboard.TRUMPS.index(trump_suit),
+            points[0], points[1])
+
+        # A round boundary is the natural point to write out, and the only
+        # one where a new file may start
+        self.flush()
+        if self._size >= self._max_bytes:
+            self.__rotate()
+
+
+    def flush(self):
+        if self._file is None:
+            return
+
+        if self._offset:
+            self._file.write(memoryview(self._buffer)[:self._offset])
+            self._size += self._offset
+            self._offset = 0
+
+        now = time.monotonic()
+        if now - self._synced_at >= self._fsync_interval:
+            os.fsync(self._file.fileno())
+            self._synced_at = now
+
+
+    def __rotate(self):
+        self.__close()
+
+        for idx in range(self._backups - 1, 0, -1):
+            src = "{}.{}".format(self._path, idx)
+            if os.path.exists(src):
+                os.replace(src, "{}.{}".format(self._path, idx + 1))
+        if self._backups:
+            os.replace(self._path, "{}.1".format(self._path))
+        else:
+            os.remove(self._path)
+
+        log.info("Rotated journal {}".format(self._path))
+        self.__open()
+
+
+    def __close(self):
+        self._synced_at = float('-inf')
+        self.flush()
+        self._file.close()
+        self._file = None
+
+
+    def close(self):
+        if self._file is not None:
+            self.__close()
+
+
+def paths(path):
+    """
+    Files of a rotated journal, oldest first
+    """
+    rotated = []
+    idx = 1
+    while os.path.exists("{}.{}".format(path, idx)):
+        rotated.append("{}.{}".format(path, idx))
+        idx += 1
+
+    rotated.reverse()
+    if os.path.exists(path):
+        rotated.append(path)
+    return rotated
+
+
+def records(path):
+    """
+    Iterate over the records of one journal file, through a memory map
+    A truncated last record (interrupted write) is ignored.
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        size -= size % RECORD_LEN
+        if not size:
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for offset in range(0, size, RECORD_LEN):
+                yield Record._make(_record.unpack_from(mm, offset))
+
+
+def name(record):
+    """
+    Player name held by a JOIN record
+    """
+    return _name.pack(record.a, record.b, record.c).rstrip(b'\0').decode(
+        'utf-8', 'replace')
@@ -0,0 +1,392 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Load a server with many headless clients
+
+Each simulated client speaks the real protocol (aiotransport / packet), lets
+the server seat it, and plays legal moves from the GameProxy it receives,
+chosen by a seat policy of simulation.py. All clients share one asyncio
+event loop.
+
+The round trip of a command is measured from sending it to receiving the
+first status in which it took effect.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import time
+
+from . import aiotransport
+from . import bitboard
+from . import constants
+from . import game
+from . import packet
+from . import simulation
+
+log = logging.getLogger(__name__)
+
+
+# Seconds after which a command that did not take effect is given up on
+COMMAND_TIMEOUT = 5
+
+
+def percentile(ordered, fraction):
+    """
+    Nearest-rank percentile of an already sorted list, None if empty
+    """
+    if not ordered:
+        return None
+    idx = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[idx]
+
+
+"""
+Statistics of all the clients, over the current interval and the whole run
+"""
+class Stats:
+
+    def __init__(self):
+        self.connected = 0
+        self.dropped = 0
+
+        self.commands = 0
+        self.statuses = 0
+        self.resyncs = 0
+        self.timeouts = 0
+        self.latencies = []
+
+        # Whole run
+        self.total_commands = 0
+        self.total_statuses = 0
+        self.total_latencies = []
+
+
+    def interval(self):
+        """
+        Close the current interval, return its (commands, statuses, sorted
+        latencies)
+        """
+        latencies = sorted(self.latencies)
+        result = (self.commands, self.statuses, latencies)
+
+        self.total_commands += self.commands
+        self.total_statuses += self.statuses
+        self.total_latencies += latencies
+
+        self.commands = 0
+        self.statuses = 0
+        self.latencies = []
+        return result
+
+
+"""
+CPU and memory use of a process, read from /proc (Linux only)
+"""
+class ProcessMonitor:
+
+    def __init__(self, pid):
+        self._pid = pid
+        self._ticks = os.sysconf('SC_CLK_TCK')
+        self._last = self.__cpu_time()
+        self._last_at = time.monotonic()
+
+
+    @property
+    def available(self):
+        return self._last is not None
+
+
+    def __cpu_time(self):
+        try:
+            with open('/proc/{}/stat'.format(self._pid)) as f:
+                # Skip the command name, which may contain spaces
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            return None
+        # utime and stime, fields 14 and 15 of stat
+        return (int(fields[11]) + int(fields[12])) / self._ticks
+
+
+    def __rss(self):
+        try:
+            with open('/proc/{}/status'.format(self._pid)) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+
+    def sample(self):
+        """
+        (CPU use since the previous sample, in %, resident memory in bytes),
+        None for what could not be read
+        """
+        cpu_time = self.__cpu_time()
+        now = time.monotonic()
+
+        cpu = None
+        if cpu_time is not None and self._last is not None and \
+            now > self._last_at:
+            cpu = 100 * (cpu_time - self._last) / (now - self._last_at)
+
+        self._last = cpu_time
+        self._last_at = now
+        return cpu, self.__rss()
+
+
+"""
+One headless client
+"""
+class Bot:
+
+    def __init__(self, loop, stats, index, policy, binary=True, think=0):
+        self._loop = loop
+        self._stats = stats
+        self._index = index
+        self._policy = policy
+        self._binary = binary
+        self._think = think
+
+        self._transport = None
+        self._proxy = None
+
+        # Command in flight: (sent at, predicate telling whether a proxy
+        # shows it took effect)
+        self._pending = None
+        self._timeout = None
+
+
+    async def connect(self, host, port):
+        trans = aiotransport.Transport(self._loop)
+        trans.on_recv = self.__recv
+        trans.on_drop = self.__drop
+        await self._loop.create_connection(lambda: trans, host, port)
+        self._transport = trans
+        self._stats.connected += 1
+
+        args = ["{:08x}".format(self._index), "bot{}".format(self._index), ""]
+        if self._binary:
+            args.append(str(packet.BINARY_VERSION))
+        self.__perform(constants.CommandOpcode.CREATE_PLAYER, *args)
+
+
+    def stop(self):
+        if self._transport:
+            self._transport.stop()
+
+
+    def __perform(self, opcode, *args):
+        self._transport.send(packet.Packet(
+            constants.MessageType.COMMAND, opcode, *args))
+
+
+    def __drop(self, transport):
+        self._stats.connected -= 1
+        self._stats.dropped += 1
+
+
+    def __recv(self, transport, rx_packet):
+        if rx_packet.opcode == constants.NotifOpcode.PROTOCOL:
+            transport.binary = True
+            return
+
+        if rx_packet.opcode == constants.NotifOpcode.GAME_STATUS:
+            if rx_packet.body is not None:
+                proxy = game.from_bytes(rx_packet.body)
+            else:
+                proxy = game.from_args(rx_packet.args)
+
+        elif rx_packet.opcode == constants.NotifOpcode.GAME_DELTA:
+            proxy = (game.apply_delta(self._proxy, rx_packet.args)
+                if self._proxy else None)
+            if proxy is None:
+                self._stats.resyncs += 1
+                self.__perform(constants.CommandOpcode.RESYNC)
+                return
+
+        else:
+            return
+
+        self._stats.statuses += 1
+        self._proxy = proxy
+
+        if self._pending:
+            sent_at, took_effect = self._pending
+            if not took_effect(proxy):
+                return
+            self._stats.latencies.append(time.perf_counter() - sent_at)
+            self.__clear_pending()
+
+        if self._think:
+            self._loop.call_later(self._think, self.__act, proxy)
+        else:
+            self.__act(proxy)
+
+
+    def __clear_pending(self):
+        self._pending = None
+        if self._timeout:
+            self._timeout.cancel()
+            self._timeout = None
+
+
+    def __give_up(self):
+        # The command was refused (or lost in a race): try again from the
+        # latest status
+        log.warning("Command of bot{} did not take effect".format(self._index))
+        self._timeout = None
+        self._pending = None
+        self._stats.timeouts += 1
+        if self._proxy:
+            self.__act(self._proxy)
+
+
+    def __act(self, proxy):
+        if self._pending or proxy is not self._proxy:
+            return
+
+        if proxy.state == game.Game.State.ANNOUNCING and \
+            proxy.starting_player == 0:
+            trump = self._policy.pick_trump(None, None)
+            # An unset trump suit is decoded as ""
+            self.__send(lambda p: bool(p.trump_suit),
+                constants.CommandOpcode.PICK_TRUMP, trump)
+            return
+
+        # Seats are rotated so that we are seat 0; legal cards are given
+        # even when it is not our turn
+        played = sum(1 for c in proxy.current_pli if c.code)
+        if proxy.state == game.Game.State.ONGOING and played < 4 and \
+            (proxy.starting_player + played) % 4 == 0 and any(proxy.legal):
+            legal = bitboard.from_cards(
+                c for c, l in zip(proxy.hand, proxy.legal) if l)
+            chosen = self._policy.play_card(None, None, legal)
+            self.__send(lambda p: chosen not in p.hand,
+                constants.CommandOpcode.PLAY_CARD, chosen.code)
+
+
+    def __send(self, took_effect, opcode, *args):
+        self._pending = (time.perf_counter(), took_effect)
+        self._timeout = self._loop.call_later(COMMAND_TIMEOUT, self.__give_up)
+        self._stats.commands += 1
+        self.__perform(opcode, *args)
+
+
+"""
+Run clients against a server and report, every interval, their throughput
+and round trip latencies, and the server's CPU and memory use if its pid is
+known
+"""
+class LoadTest:
+
+    def __init__(self, host, port, clients, policy='random', binary=True,
+        think=0, ramp=50, seed=None, server_pid=None):
+
+        self._host = host
+        self._port = port
+        self._clients = clients
+        self._binary = binary
+        self._think = think
+        self._ramp = ramp
+
+        self._rng = random.Random(seed)
+        self._policy = policy
+
+        self._monitor = ProcessMonitor(server_pid) if server_pid else None
+        self._stats = Stats()
+        self._bots = []
+
+
+    def __policy(self):
+        if self._policy == 'first':
+            return simulation.FirstPolicy()
+        return simulation.RandomPolicy(random.Random(self._rng.random()))
+
+
+    async def __connect_all(self, loop):
+        for index in range(self._clients):
+            bot = Bot(loop, self._stats, index, self.__policy(),
+                self._binary, self._think)
+            self._bots.append(bot)
+            try:
+                await bot.connect(self._host, self._port)
+            except OSError as e:
+                log.error("Client {} could not connect: {}".format(index, e))
+            if self._ramp:
+                await asyncio.sleep(1 / self._ramp)
+
+
+    def __report(self, elapsed, interval, commands, statuses, latencies):
+        line = "{:7.1f}s {:5d} clients {:8.1f} cmd/s {:8.1f} status/s".format(
+            elapsed, self._stats.connected,
+            commands / interval, statuses / interval)
+
+        if latencies:
+            line += "  rtt p50 {:.2f} p99 {:.2f} p99.9 {:.2f} ms".format(
+                *[1000 * percentile(latencies, q)
+                    for q in (0.5, 0.99, 0.999)])
+
+        if self._monitor:
+            cpu, rss = self._monitor.sample()
+            if cpu is not None:
+                line += "  server cpu {:.0f}%".format(cpu)
+            if rss is not None:
+                line += " rss {:.1f} MB".format(rss / (1 << 20))
+
+        print(line, flush=True)
+
+
+    async def __run(self, duration, interval):
+        loop = asyncio.get_event_loop()
+        connecting = loop.create_task(self.__connect_all(loop))
+
+        start = time.monotonic()
+        last = start
+        while True:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            self.__report(now - start, now - last, *self._stats.interval())
+            last = now
+            if now - start >= duration:
+                break
+
+        connecting.cancel()
+        for bot in self._bots:
+            bot.stop()
+
+        # Let the transports close
+        await asyncio.sleep(0.1)
+        return now - start
+
+
+    def run(self, duration, interval=1):
+        """
+        Run for duration seconds, then print a summary
+        """
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            elapsed = loop.run_until_complete(self.__run(duration, interval))
+        finally:
+            loop.close()
+
+        stats = self._stats
+        latencies = sorted(stats.total_latencies)
+        print("Total: {} commands ({:.1f}/s), {} statuses ({:.1f}/s), "
+            "{} timeouts, {} resyncs, {} dropped".format(
+                stats.total_commands, stats.total_commands / elapsed,
+                stats.total_statuses, stats.total_statuses / elapsed,
+                stats.timeouts, stats.resyncs, stats.dropped))
+        if latencies:
+            print("Round trip: p50 {:.2f} ms, p99 {:.2f} ms, "
+                "p99.9 {:.2f} ms, max {:.2f} ms".format(
+                    *[1000 * percentile(latencies, q)
+                        for q in (0.5, 0.99, 0.999, 1)]))
@@ -0,0 +1,271 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Counters, gauges and histograms, exported in the Prometheus text format
+
+Updating a metric is a dict update under a lock; nothing is formatted until
+the metrics are exported. Gauges are read when exporting, from a callback.
+Label values are given as a tuple, in the order of the label names.
+"""
+
+import bisect
+import http.server
+import logging
+import os
+import threading
+import urllib.parse
+
+log = logging.getLogger(__name__)
+
+
+# Default histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5,
+    1, 2.5, 5,
+)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value)
+        .replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float) and value == float('inf'):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+
+    kind = 'counter'
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+    def value(self, labels=()):
+        return self._values.get(labels, 0)
+
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        return [(self.name, labels, (), value) for labels, value in values]
+
+
+class Gauge:
+
+    kind = 'gauge'
+
+    def __init__(self, name, description, read, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+        # read() returns the value, or a dict label values -> value when the
+        # gauge has labels
+        self._read = read
+
+
+    def samples(self):
+        value = self._read()
+        if not self.labels:
+            return [(self.name, (), (), value)]
+        return [(self.name, labels, (), v) for labels, v in value.items()]
+
+
+class Histogram:
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+
+        self._buckets = tuple(buckets)
+
+        # Map label values -> [count per bucket (+Inf last), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+
+    def observe(self, value, labels=()):
+        idx = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = [[0] * (len(self._buckets) + 1), 0]
+                self._values[labels] = entry
+            entry[0][idx] += 1
+            entry[1] += value
+
+
+    def count(self, labels=()):
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+
+    def samples(self):
+        with self._lock:
+            values = [(labels, list(counts), total)
+                for labels, (counts, total) in self._values.items()]
+
+        samples = []
+        for labels, counts, total in values:
+            cumulated = 0
+            for bound, count in zip(self._buckets + (float('inf'),), counts):
+                cumulated += count
+                samples.append((self.name + '_bucket', labels,
+                    (('le', _format_value(float(bound))),), cumulated))
+            samples.append((self.name + '_sum', labels, (), total))
+            samples.append((self.name + '_count', labels, (), cumulated))
+        return samples
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = []
+
+
+    def counter(self, name, description, labels=()):
+        return self.__add(Counter(name, description, labels))
+
+
+    def gauge(self, name, description, read, labels=()):
+        return self.__add(Gauge(name, description, read, labels))
+
+
+    def histogram(self, name, description, labels=(),
+        buckets=LATENCY_BUCKETS):
+        return self.__add(Histogram(name, description, labels, buckets))
+
+
+    def __add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+    def to_text(self):
+        """
+        Every metric, in the Prometheus text exposition format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append("# HELP {} {}".format(metric.name,
+                metric.description))
+            lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+            for name, labels, extra, value in metric.samples():
+                lines.append("{}{} {}".format(name,
+                    _format_labels(metric.labels, labels, extra),
+                    _format_value(value)))
+        return "\n".join(lines) + "\n"
+
+
+def serve(registry, port, host='127.0.0.1', routes=None):
+    """
+    Serve the metrics over HTTP, from a thread of its own, at /metrics
+    routes maps other paths -> callable taking the query parameters (a dict)
+    and returning the text to answer with
+    Returns the HTTP server, to shutdown() when done
+    """
+    routes = dict(routes or {})
+    routes['/metrics'] = lambda params: registry.to_text()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            route = routes.get(url.path)
+            if route is None:
+                self.send_error(404)
+                return
+
+            params = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                body = route(params).encode('utf-8')
+            except ValueError as e:
+                self.send_error(400, str(e))
+                return
+
+            self.send_response(200)
+            self.send_header('Content-Type',
+                'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return httpd
+
+
+"""
+Write the metrics to a file every interval seconds, replaced atomically (for
+node_exporter's textfile collector, for instance)
+"""
+class FileExporter:
+
+    def __init__(self, registry, path, interval=10):
+        self._registry = registry
+        self._path = path
+        self._interval = interval
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.__loop)
+        self._thread.daemon = True
+
+
+    def run(self):
+        self._thread.start()
+
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+    def __write(self):
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self._registry.to_text())
+        os.replace(tmp_path, self._path)
+
+
+    def __loop(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.__write()
+            except OSError as e:
+                log.error("Could not write metrics to {}: {}".format(
+                    self._path, e))
@@ -7,20 +7,93 @@
 """
 Define a packet format (incoming and outgoing) between a client and a server
 
-The representation for our protocol is text-based (UTF-8 encoded)
+The default representation for our protocol is text-based (UTF-8 encoded)
 MSG_TYPE|OPCODE|ARG1|ARG2|ARG3|...\n
 
+Peers can negotiate a compact binary representation instead (see
+BINARY_VERSION). A binary frame starts with BINARY_MARKER, which no text frame
+can start with, so both kinds can be told apart on the same stream:
+BINARY_MARKER | PAYLOAD_LEN (2 bytes) | MSG_TYPE (1 byte) | OPCODE (1 byte) | BODY
+
+The body is either opcode-specific (see BINARY_BODY_OPCODES) or the list of
+arguments, each one prefixed with its length on one byte.
 """
 
-MESSAGE_LEN_MAX = 256
+import struct
+
+from . import constants
+
+# Default maximum length of a frame, separator / header excluded
+MESSAGE_LEN_MAX = 4096
+MESSAGE_SEP = b'\n'
+
+# Highest binary protocol version we speak, announced in CREATE_PLAYER
+#  1: binary frames
+#  2: GAME_DELTA notifications
+BINARY_VERSION = 2
+DELTA_VERSION = 2
+
+BINARY_MARKER = 0
+BINARY_HEADER = struct.Struct('>BH')
+
+# Opcodes whose body is not an argument list but a dedicated encoding,
+# carried as-is in Packet.body
+BINARY_BODY_OPCODES = [
+    constants.NotifOpcode.GAME_STATUS,
+]
+
+# A queued frame of one of these opcodes is obsolete once a newer full
+# snapshot (SNAPSHOT_OPCODES) is queued for the same client
+SNAPSHOT_OPCODES = [
+    constants.NotifOpcode.GAME_STATUS,
+]
+SUPERSEDED_OPCODES = [
+    constants.NotifOpcode.GAME_STATUS,
+    constants.NotifOpcode.GAME_DELTA,
+]
+
+# One byte per message type and opcode, in declaration order: only ever append
+# new opcodes to constants
+_msg_type_bytes = {t: idx for idx, t in enumerate(constants.MessageType)}
+_msg_types = list(constants.MessageType)
+
+_opcode_bytes = {
+    constants.MessageType.NOTIF:
+        {op: idx for idx, op in enumerate(constants.NotifOpcode)},
+    constants.MessageType.COMMAND:
+        {op: idx for idx, op in enumerate(constants.CommandOpcode)},
+}
+_opcodes = {
+    constants.MessageType.NOTIF: list(constants.NotifOpcode),
+    constants.MessageType.COMMAND: list(constants.CommandOpcode),
+}
+
+
+def truncate_utf8(value, max_len=255):
+    """
+    UTF-8 encoding of value, cut to at most max_len bytes at a character
+    boundary, so that it stays valid UTF-8
+    """
+    encoded = value.encode('utf-8', 'strict')
+    if len(encoded) <= max_len:
+        return encoded
+    return encoded[:max_len].decode('utf-8', 'ignore').encode('utf-8')
 
 
 class Packet:
 
-    def __init__ (self, msg_type, opcode, *args):
+    def __init__ (self, msg_type, opcode, *args, body=None):
         self.msg_type = msg_type
         self.opcode   = opcode
         self.args     = list(args)
+        # Binary body for BINARY_BODY_OPCODES, instead of args
+        self.body     = body
+        # Encoded frames, by framing, for packets sent several times
+        self._frames  = {}
+        # Length of the frame it was received in, separator included, and
+        # the frame itself if kept (see FrameReader.keep_frames)
+        self.rx_len   = 0
+        self.rx_frame = b''
 
 
     def __str__(self):
@@ -41,8 +114,46 @@ class Packet:
         return self.__str__().encode('utf-8', 'strict')
 
 
+    def to_binary(self):
+        payload = bytearray((
+            _msg_type_bytes[self.msg_type],
+            _opcode_bytes[self.msg_type][self.opcode]))
+
+        if self.body is not None:
+            payload += self.body
+        else:
+            for arg in self.args:
+                encoded = truncate_utf8(arg)
+                payload.append(len(encoded))
+                payload += encoded
+
+        # Same limit as on reception, which the header could not exceed anyway
+        if len(payload) > MESSAGE_LEN_MAX:
+            raise ValueError('packet.py: Frame too long')
+
+        return BINARY_HEADER.pack(BINARY_MARKER, len(payload)) + payload
+
+
+    def to_frame(self, binary=False):
+        """
+        Bytes to put on the wire, separator included
+        Raises ValueError if longer than a peer accepts (MESSAGE_LEN_MAX)
+        """
+        frame = self._frames.get(binary)
+        if frame is None:
+            if binary:
+                frame = self.to_binary()
+            else:
+                frame = self.to_bytes()
+                if len(frame) > MESSAGE_LEN_MAX:
+                    raise ValueError('packet.py: Frame too long')
+                frame += MESSAGE_SEP
+            self._frames[binary] = frame
+        return frame
+
+
 def from_bytes(buf):
-    l = buf[:MESSAGE_LEN_MAX].decode('utf-8', 'strict').split('|')
+    l = str(buf, 'utf-8', 'strict').split('|')
 
     if len(l) < 2:
         raise ValueError('packet.py: Invalid format')
@@ -55,3 +166,126 @@ def from_bytes(buf):
 
     args = l[2:]
     return Packet(msg_type, opcode, *args)
+
+
+def from_binary(payload):
+    try:
+        msg_type = _msg_types[payload[0]]
+        opcode   = _opcodes[msg_type][payload[1]]
+    except (IndexError, KeyError):
+        raise ValueError('packet.py: Invalid binary format')
+
+    if opcode in BINARY_BODY_OPCODES:
+        return Packet(msg_type, opcode, body=bytes(payload[2:]))
+
+    args = []
+    idx = 2
+    while idx < len(payload):
+        length = payload[idx]
+        args.append(str(payload[idx+1:idx+1+length], 'utf-8', 'strict'))
+        idx += 1 + length
+
+    return Packet(msg_type, opcode, *args)
+
+
+class FrameReader:
+    """
+    Incremental parser for a stream of frames, text or binary
+
+    Received bytes go straight into a reusable buffer (see buffer / commit);
+    frames() then extracts every complete frame without copying it first,
+    and carries a trailing partial frame over to the next read.
+    """
+
+    def __init__(self, max_frame_len=MESSAGE_LEN_MAX):
+        # Frames longer than this are a protocol error
+        self.max_frame_len = max_frame_len
+
+        # Whether packets get a copy of the frame they were received in, for
+        # captures; otherwise nothing is copied out of the buffer
+        self.keep_frames = False
+
+        self._buf = bytearray(4096)
+        self._start = 0
+        self._end = 0
+
+
+    def buffer(self, size):
+        """
+        Writable view of at least size bytes, to be filled then commit()ed
+        """
+        if len(self._buf) - self._end < size:
+            # Move the partial frame, if any, to the front, and grow if needed
+            pending = self._end - self._start
+            self._buf[:pending] = self._buf[self._start:self._end]
+            self._start, self._end = 0, pending
+            if len(self._buf) - pending < size:
+                self._buf.extend(bytes(size - (len(self._buf) - pending)))
+
+        return memoryview(self._buf)[self._end:]
+
+
+    def commit(self, count):
+        self._end += count
+
+
+    def recv_into(self, sock, size=16384):
+        """
+        Read from a socket straight into the buffer, return the bytes read
+        """
+        view = self.buffer(size)
+        try:
+            count = sock.recv_into(view, size)
+        finally:
+            view.release()
+        self.commit(count)
+        return count
+
+
+    def frames(self):
+        """
+        Parse and consume every complete frame received so far
+        Raises ValueError on malformed or oversized frames
+        """
+        packets = []
+
+        with memoryview(self._buf) as view:
+            while self._start < self._end:
+                start = self._start
+
+                if self._buf[start] == BINARY_MARKER:
+                    if self._end - start < BINARY_HEADER.size:
+                        break
+                    _, length = BINARY_HEADER.unpack_from(self._buf, start)
+                    if length > self.max_frame_len:
+                        raise ValueError('packet.py: Frame too long')
+                    end = start + BINARY_HEADER.size + length
+                    if self._end < end:
+                        break
+                    with view[start+BINARY_HEADER.size:end] as payload:
+                        packets.append(from_binary(payload))
+                    packets[-1].rx_len = end - start
+                    if self.keep_frames:
+                        packets[-1].rx_frame = bytes(view[start:end])
+                    self._start = end
+                    continue
+
+                idx = self._buf.find(MESSAGE_SEP, start, self._end)
+                if idx < 0:
+                    if self._end - start > self.max_frame_len:
+                        raise ValueError('packet.py: Frame too long')
+                    break
+                if idx - start > self.max_frame_len:
+                    raise ValueError('packet.py: Frame too long')
+                with view[start:idx] as frame:
+                    packets.append(from_bytes(frame))
+                packets[-1].rx_len = idx + 1 - start
+                if self.keep_frames:
+                    packets[-1].rx_frame = bytes(view[start:idx + 1])
+                self._start = idx + 1
+
+        # Nothing pending: start over at the front of the buffer
+        if self._start == self._end:
+            self._start = self._end = 0
+
+        return packets
@@ -4,6 +4,7 @@
 # Proprietary and confidential.
 #
 
+from . import bitboard
 from . import card
 from . import constants
 from . import player
@@ -14,6 +15,10 @@ Contains the context and logic for:
  - Which card has been played in the current pli
  - Can a player play a certain card ?
  - Who is taking the pli so far ?
+
+The taking card and the points are updated as each card is played, under the
+trump suit given to play_card, so that querying them is cheap.
+Hands are given as bitboard masks (see bitboard.py)
 """
 class Pli:
 
@@ -28,6 +33,16 @@ class Pli:
         # A map of each card played
         self._cards = {}
 
+        # Cards played so far in their played order, and their bitboard
+        self._played = []
+        self._mask = 0
+
+        # Maintained as each card is played: who is taking the pli so far,
+        # with which card, and how many points it is worth
+        self._taking_player_idx = None
+        self._taking_card = None
+        self._points = 0
+
 
     @property
     def _ordered_player_indices(self):
@@ -42,9 +57,12 @@ class Pli:
     @property
     def cards(self):
         # Return the array of cards played so far, in their played order
-        return [self._cards[self._players[idx]]
-            for idx in self._ordered_player_indices
-                if self._players[idx] in self._cards]
+        return self._played
+
+
+    @property
+    def mask(self):
+        return self._mask
 
 
     @property
@@ -52,6 +70,15 @@ class Pli:
         return self._players[self._starting_player_idx]
 
 
+    @property
+    def next_player(self):
+        # The player whose turn it is, None once the pli is complete
+        if self.is_complete:
+            return None
+        return self._players[
+            (self._starting_player_idx + len(self._cards)) % 4]
+
+
     @property
     def is_empty(self):
         return len(self._cards) == 0
@@ -66,102 +93,92 @@ class Pli:
         return self._cards[player] if player in self._cards else None
 
 
-    def is_card_legal(self, player, card, hand, trump_suit):
+    def legal_moves(self, player, hand, trump_suit):
+        """
+        Bitboard of the cards of `hand` that `player` may legally play
+        """
 
         # Empty, anything goes
         if self.is_empty:
-            return True
+            return hand
 
         # Player has already played in this pli
         if player in self._cards:
-            return False
+            return 0
 
         player_idx = self._players.index(player)
 
         # Otherwise, determine the required suit, and currently taking card
-        required_suit = self.cards[0].suit
-        taking_card = self.taking_card(trump_suit)
-        taking_player_idx = self.taking_player_idx(trump_suit)
+        required_suit = self._played[0].suit
+        taking_player_idx = self._taking_player_idx
+        taking_card = self._taking_card
 
-        hand_contains_required = any(card for card in hand
-            if card.suit == required_suit)
-        hand_contains_overtaking = any(card for card in hand
-            if card.overtakes(taking_card, trump_suit))
-        hand_contains_trump = any(card for card in hand
-            if card.suit == trump_suit)
+        required = hand & bitboard.SUIT_MASK[required_suit]
+        overtaking = hand & bitboard.BEATEN_BY[trump_suit][taking_card.index]
+        trumps = hand & bitboard.SUIT_MASK.get(trump_suit, 0)
 
         # If there are still cards of the required suit in the hand, only those
         # are legal
-        if hand_contains_required:
-
-            # If the card is not the required suit, it cannot be played
-            if card.suit != required_suit:
-                return False
+        if required:
 
             # If the required suit is trump, we need to figure out if we
             # have trumps of higher values available
             if (required_suit == trump_suit or
-                trump_suit == constants.Trump.AT) and hand_contains_overtaking:
-                return card.overtakes(taking_card, trump_suit)
+                trump_suit == constants.Trump.AT) and overtaking:
+                return required & overtaking
 
-            # The card is of the required suit and there is no requirements
-            return True
+            # Any card of the required suit will do
+            return required
 
         # At this point, the hand does not contain the required color.
         # If it still contains the trump suit, only those can be played
         # except: if the taking player is the player's partner!
-        if hand_contains_overtaking and taking_player_idx % 2 != player_idx % 2:
-            return card.overtakes(taking_card, trump_suit)
-        if hand_contains_trump and taking_player_idx % 2 != player_idx % 2:
-            return card.suit == trump_suit
+        if taking_player_idx % 2 != player_idx % 2:
+            if overtaking:
+                return overtaking
+            if trumps:
+                return trumps
 
         # We contain neither the required color nor do we have to play
         # the trump suit: anything goes
-        return True
+        return hand
 
 
-    def can_play_card(self, player, card, hand, trump_suit):
-        # Complete ?
-        if self.is_complete:
-            return False
+    def is_card_legal(self, player, card, hand, trump_suit):
+        return bool(self.legal_moves(player, hand, trump_suit) & card.mask)
 
-        current_player_idx = self._ordered_player_indices[len(self._cards)]
 
-        # This player's turn ?
-        if player is not self._players[current_player_idx]:
+    def can_play_card(self, player, card, hand, trump_suit):
+        # This player's turn ? (nobody's if complete)
+        if player is not self.next_player:
             return False
 
         # This card legal ?
-        return self.is_card_legal(player, card, hand, trump_suit)
+        return bool(self.legal_moves(player, hand, trump_suit) & card.mask)
 
 
-    def play_card(self, player, card):
+    def play_card(self, player, card, trump_suit):
         self._cards[player] = card
+        self._played.append(card)
+        self._mask |= card.mask
+        self._points += card.point_value(trump_suit)
 
+        if card.overtakes(self._taking_card, trump_suit):
+            self._taking_card = card
+            self._taking_player_idx = self._players.index(player)
 
-    def taking_player_idx(self, trump_suit):
-        taking_card = None
-        taking_player_idx = None
-        for idx in self._ordered_player_indices:
-
-            if not self._players[idx] in self._cards:
-                break
 
-            played_card = self._cards[self._players[idx]]
-            if played_card.overtakes(taking_card, trump_suit):
-                taking_card = played_card
-                taking_player_idx = idx
-
-        return taking_player_idx
+    def taking_player_idx(self, trump_suit):
+        return self._taking_player_idx
 
 
     def taking_player(self, trump_suit):
-        return self._players[self.taking_player_idx(trump_suit)]
+        return self._players[self._taking_player_idx]
 
 
     def taking_card(self, trump_suit):
-        return self._cards[self.taking_player(trump_suit)]
+        return self._taking_card
 
 
     def total_points(self, trump_suit):
-        return sum([card.point_value(trump_suit) for card in self.cards])
+        return self._points
@@ -0,0 +1,221 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Sampled timings of the stages of command handling and broadcast
+
+Each stage is a method of the server, game, packet or transport classes
+(see _points). While profiling is off they are left untouched, so that it
+costs nothing; start() wraps them, stop() puts the originals back.
+
+A sample starts at a root stage (a command being handled, a status being
+broadcast outside of one, frames being written to a socket), for one call in
+every `rate`. Every stage called from it on the same thread is then timed,
+and the timings are added up per call stack.
+"""
+
+import itertools
+import threading
+import time
+
+
+def _points():
+    """
+    (owner, attribute, stage name, whether it starts samples) of every
+    instrumented method
+    """
+    from . import aiotransport
+    from . import game
+    from . import packet
+    from . import server
+    from . import transport
+
+    return [
+        (server.Server, '_handle_command', 'command', True),
+        (server.Server, '_Server__broadcast_game_status', 'broadcast', True),
+        (game.Game, 'pick_trump', 'game.pick_trump', False),
+        (game.Game, 'play_card', 'game.play_card', False),
+        (game.Game, 'snapshot', 'game.snapshot', False),
+        (game.Game, 'proxy_for_player', 'game.proxy_for_player', False),
+        (game.Game, 'public_proxy', 'game.public_proxy', False),
+        (game.GameProxy, 'to_args', 'game_proxy.to_args', False),
+        (game.GameProxy, 'delta_args', 'game_proxy.delta_args', False),
+        (game.GameProxy, 'to_bytes', 'game_proxy.to_bytes', False),
+        (packet.Packet, 'to_frame', 'packet.to_frame', False),
+        (transport.Transport, 'send', 'transport.send', False),
+        (transport.Transport, '_Transport__send_frames', 'socket.write', True),
+        (aiotransport.Transport, 'send', 'transport.send', False),
+        (aiotransport.Transport, '_Transport__flush', 'socket.write', True),
+    ]
+
+
+"""
+Timings of the sampled stages, per call stack
+start() and stop() can be called from any thread, at any time
+"""
+class Profiler:
+
+    def __init__(self):
+        # Map (owner, attribute) -> original method, while started
+        self._originals = {}
+        self._rate = 0
+
+        # Stages being timed on each thread: [name, time spent in children]
+        self._local = threading.local()
+        self._calls = itertools.count()
+
+        # Map call stack -> [calls, total time, time in children]
+        self._stats = {}
+        self._samples = 0
+        self._lock = threading.Lock()
+
+
+    @property
+    def enabled(self):
+        return bool(self._originals)
+
+
+    @property
+    def rate(self):
+        return self._rate
+
+
+    def start(self, rate=100):
+        """
+        Sample one in every rate root stages
+        """
+        self._rate = max(1, int(rate))
+        with self._lock:
+            if self._originals:
+                return
+            for owner, attribute, name, root in _points():
+                original = owner.__dict__[attribute]
+                self._originals[(owner, attribute)] = original
+                setattr(owner, attribute, self.__wrap(original, name, root))
+
+
+    def stop(self):
+        # Samples in progress finish in the wrappers they started in
+        with self._lock:
+            for (owner, attribute), original in self._originals.items():
+                setattr(owner, attribute, original)
+            self._originals = {}
+
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._samples = 0
+
+
+    def __wrap(self, fn, name, root):
+        local = self._local
+
+        def wrapper(*args, **kwargs):
+            frames = getattr(local, 'frames', None)
+            if frames is None:
+                # Outside of a sample: maybe start one
+                if not root or next(self._calls) % self._rate:
+                    return fn(*args, **kwargs)
+                frames = local.frames = []
+                with self._lock:
+                    self._samples += 1
+
+            frames.append([name, 0])
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                children = frames.pop()[1]
+                stack = tuple(f[0] for f in frames) + (name,)
+                if frames:
+                    frames[-1][1] += elapsed
+                else:
+                    local.frames = None
+                self.__record(stack, elapsed, children)
+
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+
+
+    def __record(self, stack, elapsed, children):
+        with self._lock:
+            entry = self._stats.get(stack)
+            if entry is None:
+                entry = [0, 0, 0]
+                self._stats[stack] = entry
+            entry[0] += 1
+            entry[1] += elapsed
+            entry[2] += children
+
+
+    def breakdown(self):
+        """
+        Calls, total and self time of each stage, indented under the stage
+        calling it
+        """
+        with self._lock:
+            stats = sorted(self._stats.items())
+            samples = self._samples
+
+        lines = ["{} samples, 1 in {} ({})".format(samples, self._rate,
+            "on" if self.enabled else "off")]
+        lines.append("{:40s} {:>8s} {:>10s} {:>10s} {:>10s}".format(
+            "stage", "calls", "total ms", "self ms", "mean us"))
+        for stack, (calls, total, children) in stats:
+            lines.append("{:40s} {:8d} {:10.3f} {:10.3f} {:10.1f}".format(
+                "  " * (len(stack) - 1) + stack[-1], calls, 1000 * total,
+                1000 * (total - children), 1e6 * total / calls))
+        return "\n".join(lines) + "\n"
+
+
+    def stacks(self):
+        """
+        Self time of each call stack, in microseconds, in the collapsed
+        format of flame graph tools (flamegraph.pl, speedscope...)
+        """
+        with self._lock:
+            stats = sorted(self._stats.items())
+
+        return "".join("{} {}\n".format(";".join(stack),
+            int(round(1e6 * (total - children))))
+                for stack, (_, total, children) in stats)
+
+
+# The instrumented methods are shared by the whole process, and so is their
+# profiler
+profiler = Profiler()
+
+
+def routes(profiler=profiler):
+    """
+    Control of the profiler over HTTP, see metrics.serve()
+    """
+    def start(params):
+        profiler.start(int(params.get('rate', profiler.rate or 100)))
+        return "Profiling 1 in {}\n".format(profiler.rate)
+
+    def stop(params):
+        profiler.stop()
+        return "Profiling stopped\n"
+
+    def reset(params):
+        profiler.reset()
+        return "Profile reset\n"
+
+    def dump(params):
+        if params.get('format') == 'stacks':
+            return profiler.stacks()
+        return profiler.breakdown()
+
+    return {
+        '/profile': dump,
+        '/profile/start': start,
+        '/profile/stop': stop,
+        '/profile/reset': reset,
+    }
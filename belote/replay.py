@@ -0,0 +1,267 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Rebuild the games of a table from its journal (see journal.py)
+
+Records are applied to a Game the way they happened, without waiting for any
+delay: the end of a pli or of a round is run as soon as the next record needs
+it. Moves are checked by the Game as they were live, and an inconsistent
+journal raises a ValueError.
+
+Snapshots of the game are kept every few plis, so that seeking only replays
+from the closest one.
+"""
+
+import bisect
+import itertools
+import logging
+import random
+
+from . import bitboard
+from . import card
+from . import game
+from . import journal
+from . import player
+from . import scheduler
+
+log = logging.getLogger(__name__)
+
+
+def load(path):
+    """
+    Replay of a journal and all its rotated files
+    """
+    return Replay(itertools.chain.from_iterable(
+        journal.records(p) for p in journal.paths(path)))
+
+
+class Replay:
+
+    def __init__(self, records, checkpoint_interval=8):
+        self._records = list(records)
+
+        # Record index of each deal, and of the first card of each pli (by
+        # round, and all of them)
+        self._rounds = []
+        self._plis = []
+        self._pli_starts = []
+        for idx, record in enumerate(self._records):
+            if record.kind == journal.DEAL:
+                self._rounds.append(idx)
+                self._plis.append([])
+                cards = 0
+            elif record.kind == journal.CARD and self._plis:
+                if cards % 4 == 0:
+                    self._plis[-1].append(idx)
+                    self._pli_starts.append(idx)
+                cards += 1
+
+        # Game snapshots, taken before every checkpoint_interval-th pli:
+        # sorted record indices, and the snapshot of the game right before
+        # each
+        self._checkpoint_interval = checkpoint_interval
+        self._checkpoints = []
+        self._snapshots = []
+
+        # Delayed transitions, run when the next record needs them
+        self._pending = []
+        self._rng = random.Random(0)
+
+        self.__reset()
+        self._position = 0
+
+
+    @property
+    def game(self):
+        return self._game
+
+
+    @property
+    def position(self):
+        # Index of the next record to apply
+        return self._position
+
+
+    @property
+    def rounds(self):
+        return len(self._rounds)
+
+
+    def plis(self, round_idx):
+        # Number of plis started in that round
+        return len(self._plis[round_idx])
+
+
+    def __reset(self):
+        self._pending = []
+        self._game = game.Game(rng=self._rng, schedule=self.__schedule)
+        self._game.on_status_changed = lambda: None
+        self._game.on_round_finished = self.__round_finished
+        self._round_points = None
+
+
+    def __schedule(self, delay, callback):
+        timer = scheduler.Timer(delay, callback)
+        self._pending.append(timer)
+        return timer
+
+
+    def __settle(self, count=None):
+        # Run pending transitions, soonest first
+        self._pending.sort(key=lambda timer: timer.deadline)
+        while self._pending and count != 0:
+            timer = self._pending.pop(0)
+            if not timer.cancelled:
+                timer.callback()
+            if count is not None:
+                count -= 1
+
+
+    def __round_finished(self, trump_suit, points):
+        self._round_points = (trump_suit, list(points))
+
+
+    def __error(self, message):
+        raise ValueError("Journal record {}: {}".format(
+            self._position, message))
+
+
+    def step(self):
+        """
+        Apply the next record, return it (None once all are applied)
+        """
+        if self._position >= len(self._records):
+            return None
+
+        record = self._records[self._position]
+        g = self._game
+
+        if record.kind == journal.HEADER:
+            # New session: the table starts over
+            self.__reset()
+
+        elif record.kind == journal.JOIN:
+            self.__settle()
+            if record.seat != len(g.players):
+                self.__error("player joining seat {}".format(record.seat))
+            g.add_player(player.Player(str(record.seat), journal.name(record)))
+
+        elif record.kind == journal.LEAVE:
+            g.remove_player(g.players[record.seat])
+            self._pending = []
+
+        elif record.kind == journal.DEAL:
+            self.__settle()
+            self.__deal(record)
+
+        elif record.kind == journal.TRUMP:
+            self.__settle()
+            suit = bitboard.TRUMPS[record.arg]
+            g.pick_trump(g.players[record.seat], suit)
+            if g.trump_suit != suit:
+                self.__error("trump {} not picked".format(suit))
+
+        elif record.kind == journal.CARD:
+            self.__settle()
+            self.__checkpoint()
+            p = g.players[record.seat]
+            c = card.from_index(record.arg)
+            g.play_card(p, c)
+            if g.hand(p) & c.mask:
+                self.__error("{} cannot play {}".format(p.name, c.code))
+
+        elif record.kind == journal.ROUND:
+            # Only the end of the round, the next one comes with its deal
+            self._round_points = None
+            self.__settle(1)
+            expected = (bitboard.TRUMPS[record.arg], [record.a, record.b])
+            if self._round_points != expected:
+                self.__error("round ended with {}, recorded {}".format(
+                    self._round_points, expected))
+
+        self._position += 1
+        return record
+
+
+    def __deal(self, record):
+        g = self._game
+        if len(g.players) != 4:
+            self.__error("deal without four players")
+
+        # The round was started (with a deal of our own): use the recorded
+        # one instead
+        hands = [record.a, record.b, record.c]
+        hands.append(bitboard.ALL & ~(record.a | record.b | record.c))
+
+        snapshot = g.snapshot()
+        g.restore(snapshot._replace(
+            starting_player=record.seat,
+            round_ongoing=True,
+            trump_suit=None,
+            hands=tuple(hands),
+            points=(0, 0),
+            taken=(),
+            previous_pli=None,
+            current_pli=(record.seat, ())))
+
+
+    def __checkpoint(self):
+        # Only right before the first card of a pli, once the previous one
+        # is collected: nothing is pending then
+        if self._checkpoints and self._checkpoints[-1] >= self._position:
+            return
+
+        pli_idx = bisect.bisect_left(self._pli_starts, self._position)
+        if pli_idx == len(self._pli_starts) or \
+            self._pli_starts[pli_idx] != self._position or \
+            pli_idx % self._checkpoint_interval:
+            return
+
+        self._checkpoints.append(self._position)
+        self._snapshots.append(self._game.snapshot())
+
+
+    def seek(self, round_idx, pli_idx=None):
+        """
+        Move to right after the deal of the given round or, if pli_idx is
+        given, to right before the first card of that pli
+        """
+        if pli_idx is None:
+            target = self._rounds[round_idx] + 1
+        else:
+            target = self._plis[round_idx][pli_idx]
+
+        # From the closest snapshot, unless already on the way
+        idx = bisect.bisect_right(self._checkpoints, target) - 1
+        if idx >= 0 and not (
+            self._checkpoints[idx] <= self._position <= target):
+            self.__restore(idx)
+        elif self._position > target:
+            self.__reset()
+            self._position = 0
+
+        while self._position < target:
+            self.step()
+
+        # Collect the previous pli, if still on the table
+        if pli_idx is not None:
+            self.__settle()
+
+
+    def __restore(self, idx):
+        self._pending = []
+        self._game.restore(self._snapshots[idx])
+        self._position = self._checkpoints[idx]
+
+
+    def proxy(self, seat=None):
+        """
+        The GameProxy a player at the given seat sees, a spectator's if None
+        """
+        if seat is None:
+            return self._game.public_proxy()
+        return self._game.proxy_for_player(self._game.players[seat])
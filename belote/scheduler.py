@@ -0,0 +1,127 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Run delayed callbacks from a single driver thread
+
+All tables register their delayed transitions (end of pli, end of round)
+here instead of each spawning a threading.Timer thread.
+"""
+
+import heapq
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Timer:
+
+    __slots__ = ('deadline', 'callback', 'cancelled')
+
+    def __init__(self, deadline, callback):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+
+    def cancel(self):
+        # Lazily dropped by whoever runs the timers
+        self.cancelled = True
+
+
+class Scheduler:
+
+    def __init__(self):
+        # Heap of (deadline, sequence, Timer)
+        self._timers = []
+        self._sequence = 0
+        self._cond = threading.Condition()
+
+        self._running = False
+        self._thread = threading.Thread(target=self.__loop)
+        self._thread.daemon = True
+
+
+    def run(self):
+        self._running = True
+        self._thread.start()
+
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+        if self._thread.is_alive() and \
+            threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+    def schedule(self, delay, callback):
+        """
+        Call callback() in delay seconds, return a Timer that can be cancelled
+        """
+        timer = Timer(time.monotonic() + delay, callback)
+        with self._cond:
+            heapq.heappush(self._timers,
+                (timer.deadline, self._sequence, timer))
+            self._sequence += 1
+
+            # Only wake up the driver if its next deadline changed
+            if self._timers[0][2] is timer:
+                self._cond.notify()
+
+        return timer
+
+
+    def __loop(self):
+        while True:
+            with self._cond:
+                timer = None
+                while self._running and timer is None:
+                    if not self._timers:
+                        self._cond.wait()
+                        continue
+
+                    deadline, _, first = self._timers[0]
+                    if first.cancelled:
+                        heapq.heappop(self._timers)
+                        continue
+
+                    now = time.monotonic()
+                    if deadline > now:
+                        self._cond.wait(deadline - now)
+                        continue
+
+                    heapq.heappop(self._timers)
+                    timer = first
+
+                if not self._running:
+                    return
+
+            # Run outside of the lock so that callbacks can schedule
+            try:
+                timer.callback()
+            except Exception:
+                log.exception("Error in scheduled callback")
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared():
+    """
+    Process-wide scheduler, started on first use
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Scheduler()
+            _shared.run()
+        return _shared
@@ -4,22 +4,53 @@
 # Proprietary and confidential.
 #
 
+import asyncio
 import logging
+import os
 import queue
 import socket
 import threading
+import time
 
+from . import aiotransport
+from . import capture
 from . import card
 from . import constants
 from . import packet
 from . import player
 from . import game
+from . import journal
+from . import metrics
+from . import scheduler
+from . import snapshot
 from . import transport
 
 
 log = logging.getLogger(__name__)
 
 
+# Seconds players of a restored table have to come back and reclaim their seat
+RECLAIM_DELAY = 60
+
+# Tables listed in a TABLE_LIST at most, so that it fits in a frame
+TABLE_LIST_MAX = 100
+
+# Metric label of each known opcode; anything else a client sends is counted
+# as 'unknown'
+_opcode_labels = {op.value: op.value
+    for opcodes in (constants.NotifOpcode, constants.CommandOpcode)
+        for op in opcodes}
+
+# Arguments each command cannot do without
+_required_args = {
+    constants.CommandOpcode.CREATE_PLAYER.value: 2,
+    constants.CommandOpcode.JOIN_TABLE.value: 1,
+    constants.CommandOpcode.SPECTATE.value: 1,
+    constants.CommandOpcode.PICK_TRUMP.value: 1,
+    constants.CommandOpcode.PLAY_CARD.value: 1,
+}
+
+
 class Server:
 
     class Link:
@@ -28,31 +59,89 @@ class Server:
             self.addr       = addr
             self.transport  = transport
             self.player     = None
-
-
-    def __init__(self, port):
-
-        # Current game context
-        self._game = game.Game()
-        self._game.on_status_changed = self.__broadcast_game_status
+            self.table      = None
+            # Negotiated binary protocol version, 0 for text
+            self.protocol   = 0
+            # Last proxy sent, base for the next GAME_DELTA
+            self.sent_proxy = None
+            # Watching link.table rather than playing at it
+            self.spectating = False
+            # Packets posted to / handled by the handling thread. Each is
+            # written by one thread only.
+            self.rx_posted  = 0
+            self.rx_handled = 0
+
+
+    class Table:
+
+        def __init__ (self, identifier, game, journal=None):
+            self.identifier = identifier
+            self.game       = game
+            self.journal    = journal
+            # Links of the players seated at this table
+            self.links      = []
+            # Links watching this table, and whether an update is posted
+            self.spectators = []
+            self.spectators_posted = False
+            # GAME_STATUS / GAME_DELTA packets of version packets_version, by
+            # (seat or None for spectators, base version, binary framing)
+            self.packets_version = None
+            self.packets    = {}
+
+
+        @property
+        def is_full(self):
+            # Seats of players gone with a restart are kept for them
+            return len(self.game.players) >= 4
+
+
+    def __init__(self, port, use_asyncio=False, journal_dir=None,
+        snapshot_dir=None, pli_delay=2, round_delay=10, capture_dir=None):
+
+        # Single driver for every delayed game transition
+        self._scheduler = scheduler.Scheduler()
+
+        # Pace of the games, see game.Game
+        self._pli_delay = pli_delay
+        self._round_delay = round_delay
+
+        # Where each table keeps its journal, None not to keep any
+        self._journal_dir = journal_dir
+
+        # Where the state of each table is kept, restored on start, None not
+        # to keep it
+        self._snapshot_dir = snapshot_dir
+        self._snapshots = snapshot.Writer(snapshot_dir) if snapshot_dir else None
+
+        # Where the recent frames of each client are dumped when it drops, or
+        # on demand, None not to keep them
+        self._capture_dir = capture_dir
+
+        # Map table identifier -> Server.Table
+        self._tables = {}
+        self._next_table_id = 0
 
         # Init accept socket
         self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self._sock.bind(('', port))
 
-        # Array of Server.Link instances
-        self._links = []
+        # Map transport -> Server.Link, changed by the threads accepting and
+        # dropping clients and read by the metrics thread: under _links_lock
+        self._links = {}
+        self._links_lock = threading.Lock()
 
         self._running = False
 
-        # RX queue
+        # RX queue: (callable, args...) to run on the handling thread
         self._rx_queue = queue.Queue()
-        self._rx_queue_not_empty = threading.Event()
 
-        # Client accepting thread
+        # Client accepting thread: either a blocking accept() loop creating
+        # a threaded Transport per client, or an asyncio event loop serving
+        # every client
+        self._loop = asyncio.new_event_loop() if use_asyncio else None
         self._accepting_thread = threading.Thread(
-            target=self.__accept_incoming)
+            target=self.__serve if use_asyncio else self.__accept_incoming)
         self._accepting_thread.deamon = True
 
         # Incoming packet handling thread
@@ -60,16 +149,74 @@ class Server:
             target=self.__handle_packet)
         self._handling_thread.deamon = True
 
+        # While a command is handled: (its link, receipt time, metric
+        # labels), until the first frame sent to that link, which is tagged
+        # with them
+        self._answering = None
+
+        self._metrics = metrics.Registry()
+        self.__init_metrics()
+
+
+    def __init_metrics(self):
+        registry = self._metrics
+
+        self._packets = registry.counter('belote_packets_total',
+            'Packets received and sent', ('direction', 'opcode'))
+        self._bytes = registry.counter('belote_bytes_total',
+            'Bytes of the frames received and sent', ('direction', 'opcode'))
+
+        self._rx_wait = registry.histogram('belote_rx_wait_seconds',
+            'Time a received packet waits for the handling thread')
+        self._handling = registry.histogram('belote_handling_seconds',
+            'Time spent handling a command, status frames queued included',
+            ('opcode',))
+        self._latency = registry.histogram('belote_command_latency_seconds',
+            'Time from receiving a command to the first frame answering it '
+            'written to the socket', ('opcode',))
+        self._fan_out = registry.histogram('belote_broadcast_seconds',
+            'Time to queue a new status for every player of a table')
+
+        registry.gauge('belote_tables', 'Open tables',
+            lambda: len(self._tables))
+        registry.gauge('belote_links', 'Connected clients',
+            lambda: len(self.__link_list()))
+        registry.gauge('belote_threads', 'Threads of the server process',
+            threading.active_count)
+        registry.gauge('belote_rx_queue_depth',
+            'Items waiting for the handling thread', self._rx_queue.qsize)
+        registry.gauge('belote_link_rx_queue_depth',
+            'Packets of a client waiting for the handling thread',
+            lambda: {(str(link.addr),): link.rx_posted - link.rx_handled
+                for link in self.__link_list()}, ('link',))
+        registry.gauge('belote_link_tx_queue_bytes',
+            'Bytes waiting to be sent to a client',
+            lambda: {(str(link.addr),): link.transport.tx_pending
+                for link in self.__link_list()}, ('link',))
+
+
+    @property
+    def metrics(self):
+        # metrics.Registry of the server, to export
+        return self._metrics
+
 
     def __lookup_link(self, transport=None):
-        for link in self._links:
-            if transport and link.transport is transport:
-                return link
-        return None
+        with self._links_lock:
+            return self._links.get(transport)
+
+
+    def __link_list(self):
+        with self._links_lock:
+            return list(self._links.values())
 
 
     def run(self):
         self._running = True
+        self._scheduler.run()
+        if self._snapshots:
+            self._snapshots.run()
+            self.__restore_tables()
         self._handling_thread.start()
         self._accepting_thread.start()
 
@@ -77,6 +224,14 @@ class Server:
     def stop(self):
         self._running = False
 
+        self._scheduler.stop()
+
+        # Wake up the handling thread
+        self.__post(lambda: None)
+
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+
         current_thread = threading.current_thread()
 
         if self._accepting_thread.is_alive() and \
@@ -87,9 +242,17 @@ class Server:
             current_thread is not self._handling_thread:
             self._handling_thread.join()
 
-        for link in self._links:
+        if self._snapshots:
+            self._snapshots.stop()
+
+        for link in self.__link_list():
             link.transport.stop()
-        self._links = []
+        with self._links_lock:
+            self._links = {}
+
+        for table in self._tables.values():
+            if table.journal:
+                table.journal.close()
 
         self._sock.shutdown(socket.SHUT_RDWR)
         self._sock.close()
@@ -111,56 +274,399 @@ class Server:
             trans.on_recv = self.__recv
             trans.on_drop = self.__drop
 
-            self._links.append(Server.Link(addr, trans))
+            self.__add_link(addr, trans)
             trans.run()
 
 
+    def __serve(self):
+        asyncio.set_event_loop(self._loop)
+
+        def create_transport():
+            trans = aiotransport.Transport(self._loop)
+            trans.on_connect = self.__connect
+            trans.on_recv = self.__recv
+            trans.on_drop = self.__drop
+            return trans
+
+        self._loop.run_until_complete(
+            self._loop.create_server(create_transport, sock=self._sock))
+        self._loop.run_forever()
+
+
+    def __connect(self, trans, addr):
+        log.info("Accepted incoming client connection on {}".format(addr))
+        self.__add_link(addr, trans)
+
+
+    def __add_link(self, addr, trans):
+        if self._capture_dir:
+            trans.capture = capture.Capture()
+        trans.on_written = self.__written
+        with self._links_lock:
+            self._links[trans] = Server.Link(addr, trans)
+
+
+    def __dump_capture(self, link):
+        name = "{}-{}.capture".format(
+            "-".join(str(part) for part in link.addr[:2]),
+            int(time.time() * 1000))
+        path = os.path.join(self._capture_dir, name)
+        peer = "{} {}".format(link.addr, link.player.name if link.player else "")
+        try:
+            link.transport.capture.dump(path, peer)
+        except OSError as e:
+            log.error("Could not dump capture of {}: {}".format(link.addr, e))
+            return None
+        return path
+
+
+    def __dump_dropped_capture(self, link):
+        path = self.__dump_capture(link)
+        if path:
+            log.info("Dumped recent traffic to {}".format(path))
+
+
+    def dump_captures(self):
+        """
+        Dump the recent frames of every client, return the files written
+        """
+        if not self._capture_dir:
+            return []
+        paths = [self.__dump_capture(link) for link in self.__link_list()]
+        return [path for path in paths if path]
+
+
+    def __create_table(self, identifier=None):
+        if identifier is None:
+            identifier = str(self._next_table_id)
+            self._next_table_id += 1
+
+        table_journal = (journal.Journal(os.path.join(self._journal_dir,
+            "table-{}.journal".format(identifier)))
+                if self._journal_dir else None)
+
+        table = Server.Table(identifier,
+            game.Game(schedule=self.__schedule, journal=table_journal,
+                pli_delay=self._pli_delay, round_delay=self._round_delay),
+            table_journal)
+        table.game.on_status_changed = \
+            lambda: self.__game_status_changed(table)
+        self._tables[identifier] = table
+
+        log.info("Created table {}".format(identifier))
+        return table
+
+
+    def __restore_tables(self):
+        for identifier, table_snapshot in snapshot.load(
+            self._snapshot_dir).items():
+
+            if identifier.isdigit():
+                self._next_table_id = max(self._next_table_id,
+                    int(identifier) + 1)
+
+            table = self.__create_table(identifier)
+            table.game.restore(table_snapshot)
+            log.info("Restored table {} with {}".format(identifier,
+                ", ".join(p.name for p in table.game.players)))
+
+            self._scheduler.schedule(RECLAIM_DELAY,
+                lambda table=table: self.__post(self.__expire_seats, table))
+
+
+    def __expire_seats(self, table):
+        # Players of a restored table that did not come back lose their seat
+        if self._tables.get(table.identifier) is not table:
+            return
+
+        present = [link.player for link in table.links]
+        for p in list(table.game.players):
+            if p not in present:
+                log.info("{} did not come back to table {}".format(
+                    p.name, table.identifier))
+                table.game.remove_player(p)
+
+        self.__close_if_empty(table)
+
+
+    def __reclaim_seat(self, link, identifier):
+        # A player of a restored table coming back
+        for table in self._tables.values():
+            present = [l.player for l in table.links]
+            for p in table.game.players:
+                if p.identifier == identifier and p not in present:
+                    link.player = p
+                    link.table = table
+                    link.sent_proxy = None
+                    table.links.append(link)
+                    log.info("{} is back at table {}".format(
+                        p.name, table.identifier))
+                    self.__send_game_status(link)
+                    return True
+        return False
+
+
+    def __free_table(self):
+        # First table with a free seat, or a new one
+        for table in self._tables.values():
+            if not table.is_full:
+                return table
+        return self.__create_table()
+
+
+    def __leave_table(self, link):
+        table = link.table
+        if table is None:
+            return
+
+        link.table = None
+        if link.spectating:
+            link.spectating = False
+            table.spectators.remove(link)
+        else:
+            table.links.remove(link)
+            table.game.remove_player(link.player)
+
+        self.__close_if_empty(table)
+
+
+    def __close_if_empty(self, table):
+        # Nobody left: close the table
+        if table.links or table.spectators or table.game.players:
+            return
+
+        del self._tables[table.identifier]
+        if table.journal:
+            table.journal.close()
+        if self._snapshots:
+            self._snapshots.remove(table.identifier)
+        log.info("Closed table {}".format(table.identifier))
+
+
+    def __join_table(self, link, table):
+        if table is link.table and not link.spectating:
+            return
+
+        if table.is_full:
+            log.warning("Attempting to join full table {}".format(
+                table.identifier))
+            self.__send_table_list(link)
+            return
+
+        self.__leave_table(link)
+
+        link.table = table
+        link.sent_proxy = None
+        table.links.append(link)
+        table.game.add_player(link.player)
+
+
+    def __spectate_table(self, link, table):
+        if table is link.table and link.spectating:
+            return
+
+        self.__leave_table(link)
+
+        link.table = table
+        link.spectating = True
+        link.sent_proxy = None
+        table.spectators.append(link)
+        self.__send_public_status(link)
+
+
+    def __negotiate(self, link, version):
+        # The client speaks binary up to the given version: settle for the
+        # highest one we both know, and switch over right after telling it
+        try:
+            version = min(int(version), packet.BINARY_VERSION)
+        except ValueError:
+            return
+        if version < 1:
+            return
+
+        self.__send(link, packet.Packet(
+            constants.MessageType.NOTIF,
+            constants.NotifOpcode.PROTOCOL,
+            str(version)))
+        link.transport.binary = True
+        link.protocol = version
+
+
+    def __send_table_list(self, link):
+        # identifier and number of seated players, for each table: those
+        # with a free seat first, as many as fit
+        tables = sorted(self._tables.values(), key=lambda table: table.is_full)
+        args = []
+        for table in tables[:TABLE_LIST_MAX]:
+            args += [table.identifier, str(len(table.game.players))]
+
+        self.__send(link, packet.Packet(
+            constants.MessageType.NOTIF,
+            constants.NotifOpcode.TABLE_LIST,
+            *args))
+
+
     def _handle_command(self, link, rx_cmd):
-        # Create a new player for current game
+        if len(rx_cmd.args) < _required_args.get(rx_cmd.opcode, 0):
+            log.warning("Ignoring command with missing arguments: {}".format(
+                str(rx_cmd)))
+            return
+
+        # Create a new player, seated at the requested table if any or at the
+        # first one with a free seat
         if rx_cmd.opcode == constants.CommandOpcode.CREATE_PLAYER:
-            # Add a new player to current game
             if link.player is None:
+                if len(rx_cmd.args) > 3:
+                    self.__negotiate(link, rx_cmd.args[3])
+                if self.__reclaim_seat(link, rx_cmd.args[0]):
+                    return
                 link.player = player.Player(rx_cmd.args[0], rx_cmd.args[1])
-                self._game.add_player(link.player)
+                table = (self._tables.get(rx_cmd.args[2])
+                    if len(rx_cmd.args) > 2 else None)
+                self.__join_table(link, table or self.__free_table())
+
+        # Lobby: list, create and join tables
+        if rx_cmd.opcode == constants.CommandOpcode.LIST_TABLES:
+            self.__send_table_list(link)
+
+        if rx_cmd.opcode == constants.CommandOpcode.CREATE_TABLE:
+            if link.player is None:
+                return
+            self.__join_table(link, self.__create_table())
+
+        if rx_cmd.opcode == constants.CommandOpcode.JOIN_TABLE:
+            if link.player is None:
+                return
+            table = self._tables.get(rx_cmd.args[0])
+            if table is None:
+                log.warning("Attempting to join unknown table {}".format(
+                    rx_cmd.args[0]))
+                self.__send_table_list(link)
+                return
+            self.__join_table(link, table)
+
+        # Watch a table, with or without a player, offering binary frames
+        if rx_cmd.opcode == constants.CommandOpcode.SPECTATE:
+            table = self._tables.get(rx_cmd.args[0])
+            if table is None:
+                log.warning("Attempting to spectate unknown table {}".format(
+                    rx_cmd.args[0]))
+                self.__send_table_list(link)
+                return
+            if len(rx_cmd.args) > 1 and not link.protocol:
+                self.__negotiate(link, rx_cmd.args[1])
+            self.__spectate_table(link, table)
+
+        # Client lost track of the game status: send it all again
+        if rx_cmd.opcode == constants.CommandOpcode.RESYNC:
+            if link.table is None:
+                return
+            if link.spectating:
+                self.__send_public_status(link)
+                return
+            link.sent_proxy = None
+            self.__send_game_status(link)
 
         # Pick the trump color
         if rx_cmd.opcode == constants.CommandOpcode.PICK_TRUMP:
-            if link.player is None:
+            if link.table is None or link.spectating:
                 return
-            self._game.pick_trump(link.player, rx_cmd.args[0])
+            link.table.game.pick_trump(link.player, rx_cmd.args[0])
 
         # Player plays a given card
         if rx_cmd.opcode == constants.CommandOpcode.PLAY_CARD:
-            if link.player is None:
+            if link.table is None or link.spectating:
                 return
-            self._game.play_card(link.player, card.Card(rx_cmd.args[0]))
+            link.table.game.play_card(link.player,
+                card.from_code(rx_cmd.args[0]))
 
 
     def __handle_packet(self):
         while self._running:
-            # Wait for incoming commands
-            rx = self._rx_queue_not_empty.wait(timeout=1)
+            # Wait for incoming commands (stop() posts one to wake us up)
+            item = self._rx_queue.get()
 
-            if not rx: continue
+            # A bad command must not stop the handling of the next ones
+            try:
+                item[0](*item[1:])
+            except Exception:
+                log.exception("Error handling {}".format(item[0].__name__))
 
-            (rx_packet, link) = self._rx_queue.get()
-            if self._rx_queue.empty():
-                self._rx_queue_not_empty.clear()
 
-            # Server only needs to handle commands for now
-            if rx_packet.msg_type != constants.MessageType.COMMAND:
-                log.warn("Unhandled packet: {}", str(rx_packet))
-                return
+    def __handle_rx_packet(self, rx_packet, link, received_at):
+        started_at = time.perf_counter()
+        self._rx_wait.observe(started_at - received_at)
+        link.rx_handled += 1
+
+        # Server only needs to handle commands for now
+        if rx_packet.msg_type != constants.MessageType.COMMAND:
+            log.warn("Unhandled packet: {}", str(rx_packet))
+            return
 
+        labels = (_opcode_labels.get(rx_packet.opcode, 'unknown'),)
+        self._answering = (link, received_at, labels)
+        try:
             self._handle_command(link, rx_packet)
+        finally:
+            self._answering = None
+
+        # Game status changes are broadcast right away, so their frames are
+        # queued by now
+        self._handling.observe(time.perf_counter() - started_at, labels)
+
+
+    def __written(self, transport, tags):
+        # Called by transports once the frames answering commands are written
+        now = time.perf_counter()
+        for received_at, labels in tags:
+            self._latency.observe(now - received_at, labels)
+
+
+    def __post(self, callback, *args):
+        self._rx_queue.put((callback,) + args)
+
+
+    def __schedule(self, delay, callback):
+        # Game transitions run on the handling thread, like commands, so that
+        # they never race with them. The timer may be cancelled after it was
+        # posted, so check again once on the handling thread.
+        def fire():
+            if not timer.cancelled:
+                callback()
+
+        timer = self._scheduler.schedule(delay, lambda: self.__post(fire))
+        return timer
 
 
     def __recv(self, transport, rx_packet):
         # Do not process right here; set on the queue so that all packets can
         # be processed by the same thread
         link = self.__lookup_link(transport=transport)
-        self._rx_queue.put((rx_packet, link))
-        self._rx_queue_not_empty.set()
+        if link is None:
+            return
+
+        opcode = _opcode_labels.get(rx_packet.opcode, 'unknown')
+        self._packets.inc(('rx', opcode))
+        self._bytes.inc(('rx', opcode), rx_packet.rx_len)
+
+        link.rx_posted += 1
+        self.__post(self.__handle_rx_packet, rx_packet, link,
+            time.perf_counter())
+
+
+    def __send(self, link, tx_packet):
+        opcode = _opcode_labels.get(tx_packet.opcode, 'unknown')
+        self._packets.inc(('tx', opcode))
+        self._bytes.inc(('tx', opcode),
+            len(tx_packet.to_frame(link.transport.binary)))
+
+        # The first frame sent back to a client whose command is handled
+        # answers it
+        tag = None
+        if self._answering is not None and self._answering[0] is link:
+            tag = self._answering[1:]
+            self._answering = None
+        link.transport.send(tx_packet, tag)
 
 
     def __drop(self, transport):
@@ -170,22 +676,103 @@ class Server:
             return
         log.warning("Lost connection to {}".format(link.addr))
 
-        # Remove the link from the array
-        self._links.remove(link)
-        if link.player:
-            self._game.remove_player(link.player)
+        # Forget about the link, and free its seat. Called on the event loop
+        # with asyncio: the capture file is written from the handling thread
+        # too, so that other clients are not kept waiting.
+        with self._links_lock:
+            del self._links[transport]
+        if self._capture_dir:
+            self.__post(self.__dump_dropped_capture, link)
+        self.__post(self.__leave_table, link)
 
         link.transport.stop()
 
 
-    def __broadcast_game_status(self):
-        # Generate a proxy tailored to each client and send
-        for link in self._links:
-            proxy = self._game.proxy_for_player(link.player)
-            if not proxy:
-                continue
-            tx_packet = packet.Packet(
+    def __game_status_changed(self, table):
+        self.__broadcast_game_status(table)
+
+        # Only the snapshot is taken here, the writer thread does the rest
+        if self._snapshots:
+            self._snapshots.save(table.identifier, table.game.snapshot())
+
+
+    def __broadcast_game_status(self, table):
+        # Generate a proxy tailored to each client of the table and send
+        started_at = time.perf_counter()
+        for link in table.links:
+            self.__send_game_status(link)
+        self._fan_out.observe(time.perf_counter() - started_at)
+
+        # Spectators come second: their update is queued behind whatever
+        # the handling thread has left to do, and only sends the state of
+        # the table by then. Intermediate states are skipped.
+        if table.spectators and not table.spectators_posted:
+            table.spectators_posted = True
+            self.__post(self.__broadcast_public_status, table)
+
+
+    def __broadcast_public_status(self, table):
+        table.spectators_posted = False
+        for link in table.spectators:
+            self.__send_public_status(link)
+
+
+    def __send_public_status(self, link):
+        # Spectators get full snapshots, never deltas, so that any of them
+        # can be skipped. One packet, and so one encoded frame, is shared by
+        # every spectator speaking the same protocol.
+        proxy = link.table.game.public_proxy()
+        self.__send(link, self.__table_packet(link.table, proxy,
+            (None, None, link.transport.binary), None))
+
+
+    def __send_game_status(self, link):
+        proxy = link.table.game.proxy_for_player(link.player)
+        if not proxy:
+            return
+
+        previous = link.sent_proxy
+        if link.protocol >= packet.DELTA_VERSION:
+            link.sent_proxy = proxy
+
+        # Keyed by what the packet shows (the view from a seat, from a
+        # version to this one), not by who it is sent to
+        seat = link.table.game.players.index(link.player)
+        key = (seat, previous.version if previous else None,
+            link.transport.binary)
+        self.__send(link, self.__table_packet(link.table, proxy, key,
+            previous))
+
+
+    def __table_packet(self, table, proxy, key, previous):
+        # Packets (and their encoded frames) of the current version are
+        # built once, whoever they are sent to
+        if table.packets_version != proxy.version:
+            table.packets_version = proxy.version
+            table.packets = {}
+
+        tx_packet = table.packets.get(key)
+        if tx_packet is None:
+            tx_packet = self.__status_packet(proxy, previous, key[2])
+            table.packets[key] = tx_packet
+        return tx_packet
+
+
+    def __status_packet(self, proxy, previous, binary):
+        # Only what changed since the last status the client got
+        if previous is not None:
+            return packet.Packet(
+                constants.MessageType.NOTIF,
+                constants.NotifOpcode.GAME_DELTA,
+                *proxy.delta_args(previous))
+
+        if binary:
+            return packet.Packet(
                 constants.MessageType.NOTIF,
                 constants.NotifOpcode.GAME_STATUS,
-                *proxy.to_args())
-            link.transport.send(tx_packet)
+                body=proxy.to_bytes())
+
+        return packet.Packet(
+            constants.MessageType.NOTIF,
+            constants.NotifOpcode.GAME_STATUS,
+            *proxy.to_args())
@@ -0,0 +1,165 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+import heapq
+import logging
+import random
+import time
+
+from . import bitboard
+from . import card
+from . import constants
+from . import game
+from . import player
+from . import scheduler
+
+
+log = logging.getLogger(__name__)
+
+
+"""
+Random seat policy: picks any trump, and any legal card
+Policies are asked to pick_trump(game, player) and play_card(game, player,
+legal) where legal is the bitboard of the cards the player may play
+"""
+class RandomPolicy:
+
+    def __init__(self, rng):
+        self._rng = rng
+        self._trumps = [trump.value for trump in constants.Trump]
+
+
+    def pick_trump(self, game, player):
+        return self._rng.choice(self._trumps)
+
+
+    def play_card(self, game, player, legal):
+        return card.from_mask(legal)[
+            self._rng.randrange(bitboard.count(legal))]
+
+
+"""
+Scripted seat policy: always picks the same trump, and the first legal card
+(in constants.CardCode order), so that runs are reproducible
+"""
+class FirstPolicy:
+
+    def __init__(self, trump=constants.Trump.H.value):
+        self._trump = trump
+
+
+    def pick_trump(self, game, player):
+        return self._trump
+
+
+    def play_card(self, game, player, legal):
+        return card.from_index(next(bitboard.indices(legal)))
+
+
+"""
+Headless, synchronous game driver
+Runs a Game between four seat policies with no timers, sockets or GUI:
+delayed transitions are executed in order on a virtual clock.
+"""
+class Simulator:
+
+    def __init__(self, seed=None, policies=None, journal=None):
+        self._rng = random.Random(seed)
+
+        # Pending delayed transitions: heap of (time, sequence, Timer)
+        self._clock = 0
+        self._sequence = 0
+        self._pending = []
+
+        self._game = game.Game(rng=self._rng, schedule=self.__schedule,
+            journal=journal)
+        self._game.on_status_changed = self.__status_changed
+        self._game.on_round_finished = self.__round_finished
+
+        self._policies = policies or [RandomPolicy(self._rng) for _ in range(4)]
+        self._players = [player.Player(str(idx), "bot{}".format(idx))
+            for idx in range(4)]
+
+        # Statistics
+        self.rounds = 0
+        self.points = [0, 0]
+
+
+    @property
+    def game(self):
+        return self._game
+
+
+    def __schedule(self, delay, callback):
+        timer = scheduler.Timer(self._clock + delay, callback)
+        heapq.heappush(self._pending, (timer.deadline, self._sequence, timer))
+        self._sequence += 1
+        return timer
+
+
+    def __status_changed(self):
+        pass
+
+
+    def __round_finished(self, trump_suit, points):
+        total = sum(points)
+        if total != 162 * bitboard.SCALE:
+            raise AssertionError(
+                "Round with trump {} totals {} points".format(
+                    trump_suit, float(total) / bitboard.SCALE))
+
+        self.rounds += 1
+        self.points[0] += points[0]
+        self.points[1] += points[1]
+
+
+    def __step(self):
+        # Delayed transitions first, as they would have fired while the
+        # players are thinking
+        if self._pending:
+            self._clock, _, timer = heapq.heappop(self._pending)
+            if not timer.cancelled:
+                timer.callback()
+            return
+
+        g = self._game
+
+        if g.state == game.Game.State.ANNOUNCING:
+            announcing = g.announcing_player
+            policy = self._policies[g.players.index(announcing)]
+            g.pick_trump(announcing, policy.pick_trump(g, announcing))
+            return
+
+        if g.state == game.Game.State.ONGOING:
+            current = g.current_pli.next_player
+            legal = g.current_pli.legal_moves(
+                current, g.hand(current), g.trump_suit)
+            policy = self._policies[g.players.index(current)]
+            played = policy.play_card(g, current, legal)
+            if not played.mask & legal:
+                raise AssertionError("Policy played illegal card {}".format(
+                    played.code))
+            g.play_card(current, played)
+            return
+
+        raise AssertionError("Simulation stuck in state {}".format(g.state))
+
+
+    def run(self, rounds):
+        """
+        Play the given number of rounds, return the number of rounds per second
+        """
+        if not self._game.players:
+            for p in self._players:
+                self._game.add_player(p)
+
+        target = self.rounds + rounds
+        start = time.perf_counter()
+        while self.rounds < target:
+            self.__step()
+        elapsed = time.perf_counter() - start
+
+        return rounds / elapsed if elapsed else float('inf')
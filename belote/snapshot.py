@@ -0,0 +1,258 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Keep the state of each table on disk, to restore it after a restart
+
+Tables hand over a Game.snapshot() (immutable values, cheap to take) and a
+writer thread encodes and writes it. Only the latest snapshot of a table is
+written: if the disk is slower than the game, intermediate ones are skipped.
+Each file is replaced atomically, so that a crash leaves either the previous
+snapshot or the new one.
+"""
+
+import logging
+import os
+import struct
+import threading
+
+from . import bitboard
+from . import game
+from . import packet
+from . import player
+
+log = logging.getLogger(__name__)
+
+
+VERSION = 1
+
+_MAGIC = b'BLTS'
+_NONE = 0xFF
+
+_CARDS = bitboard.count(bitboard.ALL)
+
+_header = struct.Struct('>4sBBBBBI')
+_points = struct.Struct('>II')
+_hand = struct.Struct('>I')
+
+_SUFFIX = '.snapshot'
+
+
+def _encode_str(value):
+    encoded = packet.truncate_utf8(value)
+    return bytes([len(encoded)]) + encoded
+
+
+def _encode_pli(pli):
+    if pli is None:
+        return bytes([_NONE])
+    starting_player_idx, cards = pli
+    return bytes([starting_player_idx, len(cards)]) + bytes(cards)
+
+
+def to_bytes(snapshot):
+    out = bytearray(_header.pack(_MAGIC, VERSION,
+        snapshot.starting_player,
+        int(snapshot.round_ongoing),
+        bitboard.TRUMPS.index(snapshot.trump_suit),
+        len(snapshot.players),
+        snapshot.version))
+
+    for p in snapshot.players:
+        out += _encode_str(p.identifier)
+        out += _encode_str(p.name)
+    for hand in snapshot.hands:
+        out += _hand.pack(hand)
+    out += _points.pack(*snapshot.points)
+
+    out += bytes([len(snapshot.deck)]) + bytes(snapshot.deck)
+    out += bytes([len(snapshot.taken)])
+    for pli in snapshot.taken:
+        out += _encode_pli(pli)
+    out += _encode_pli(snapshot.previous_pli)
+    out += _encode_pli(snapshot.current_pli)
+
+    return bytes(out)
+
+
+def from_bytes(buf):
+    """
+    Decode a snapshot, with new Player instances for its players
+    Raises ValueError if buf is not a valid snapshot
+    """
+    try:
+        magic, version, starting_player, round_ongoing, trump_idx, count, \
+            state_version = _header.unpack_from(buf, 0)
+        if magic != _MAGIC or version != VERSION:
+            raise ValueError("not a snapshot, or of another version")
+        offset = _header.size
+
+        def read_bytes(length):
+            nonlocal offset
+            if offset + length > len(buf):
+                raise ValueError("truncated snapshot")
+            value = bytes(buf[offset:offset + length])
+            offset += length
+            return value
+
+        def read_byte():
+            return read_bytes(1)[0]
+
+        def check(valid, what):
+            if not valid:
+                raise ValueError("invalid {} in snapshot".format(what))
+
+        def read_str():
+            return read_bytes(read_byte()).decode('utf-8')
+
+        def read_cards(max_count):
+            cards = tuple(read_bytes(read_byte()))
+            check(len(cards) <= max_count, "number of cards")
+            check(all(idx < _CARDS for idx in cards), "card")
+            return cards
+
+        def read_pli():
+            starting_player_idx = read_byte()
+            if starting_player_idx == _NONE:
+                return None
+            check(starting_player_idx < count, "pli starting player")
+            return (starting_player_idx, read_cards(4))
+
+        check(count <= 4, "number of players")
+        check(starting_player < 4, "starting player")
+        check(trump_idx < len(bitboard.TRUMPS), "trump suit")
+        trump_suit = bitboard.TRUMPS[trump_idx]
+
+        players = []
+        for _ in range(count):
+            identifier = read_str()
+            players.append(player.Player(identifier, read_str()))
+        hands = tuple(_hand.unpack(read_bytes(_hand.size))[0]
+            for _ in range(count))
+        check(all(not hand & ~bitboard.ALL for hand in hands), "hand")
+        points = _points.unpack(read_bytes(_points.size))
+
+        deck = read_cards(_CARDS)
+        taken = tuple(read_pli() for _ in range(read_byte()))
+        check(len(taken) <= _CARDS // 4 and None not in taken, "plis taken")
+        previous_pli = read_pli()
+        current_pli = read_pli()
+        check(not round_ongoing or (count == 4 and current_pli is not None),
+            "round")
+
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError("invalid snapshot: {}".format(e))
+
+    return game.Game.Snapshot(
+        players=tuple(players),
+        starting_player=starting_player,
+        round_ongoing=bool(round_ongoing),
+        trump_suit=trump_suit,
+        hands=hands,
+        points=points,
+        taken=taken,
+        previous_pli=previous_pli,
+        current_pli=current_pli,
+        deck=deck,
+        version=state_version)
+
+
+def load(directory):
+    """
+    Map table identifier -> latest snapshot saved in directory
+    """
+    snapshots = {}
+    for filename in os.listdir(directory):
+        if not filename.endswith(_SUFFIX):
+            continue
+
+        path = os.path.join(directory, filename)
+        try:
+            with open(path, 'rb') as f:
+                snapshots[filename[:-len(_SUFFIX)]] = from_bytes(f.read())
+        except (OSError, ValueError) as e:
+            log.error("Could not load snapshot {}: {}".format(path, e))
+
+    return snapshots
+
+
+class Writer:
+
+    def __init__(self, directory):
+        self._directory = directory
+
+        # Map table identifier -> latest snapshot not written yet, None for
+        # a table whose snapshot is to be removed
+        self._pending = {}
+        self._cond = threading.Condition()
+
+        self._running = False
+        self._thread = threading.Thread(target=self.__loop)
+        self._thread.daemon = True
+
+
+    def run(self):
+        self._running = True
+        self._thread.start()
+
+
+    def stop(self):
+        # Whatever is pending is still written
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+
+        if self._thread.is_alive() and \
+            threading.current_thread() is not self._thread:
+            self._thread.join()
+
+
+    def save(self, identifier, snapshot):
+        with self._cond:
+            self._pending[identifier] = snapshot
+            self._cond.notify()
+
+
+    def remove(self, identifier):
+        self.save(identifier, None)
+
+
+    def __path(self, identifier):
+        return os.path.join(self._directory, identifier + _SUFFIX)
+
+
+    def __write(self, identifier, snapshot):
+        path = self.__path(identifier)
+
+        if snapshot is None:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(to_bytes(snapshot))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+
+    def __loop(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                pending = self._pending
+                self._pending = {}
+
+            for identifier, snapshot in pending.items():
+                try:
+                    self.__write(identifier, snapshot)
+                except OSError as e:
+                    log.error("Could not save snapshot of table {}: {}"
+                        .format(identifier, e))
@@ -9,31 +9,113 @@ Provides a way to send / receive packets through a socket
 """
 
 
+import collections
 import logging
-import queue
 import socket
 import threading
 
+from . import constants
 from . import packet
 
 log = logging.getLogger(__name__)
 
-MESSAGE_SEP = b'\n'
+MESSAGE_SEP = packet.MESSAGE_SEP
+
+# Bytes queued for a client that does not read fast enough before the
+# connection is dropped
+TX_QUEUE_MAX = 1 << 20
+
+# Most buffers handed to a single sendmsg()
+_IOV_MAX = 64
+
+
+class TxQueue:
+    """
+    Frames waiting to be sent
+    Queuing a game snapshot drops the queued ones it makes obsolete; past
+    max_len bytes, push() refuses frames and the connection should be dropped.
+    A frame may carry a tag, handed back by drain() with the frames; the tags
+    of dropped frames go to the snapshot dropping them.
+    Not thread-safe by itself.
+    """
+
+    def __init__(self, max_len=TX_QUEUE_MAX):
+        self._max_len = max_len
+
+        # (superseded by snapshots, frame bytes, tags)
+        self._frames = collections.deque()
+        self._len = 0
+
+
+    def __len__(self):
+        return len(self._frames)
+
+
+    @property
+    def size(self):
+        # Bytes queued
+        return self._len
+
+
+    def push(self, tx_packet, tx_bytes, tag=None):
+        tags = () if tag is None else (tag,)
+
+        if (tx_packet.opcode in packet.SNAPSHOT_OPCODES
+            and tx_packet.msg_type == constants.MessageType.NOTIF):
+            kept = [f for f in self._frames if not f[0]]
+            if len(kept) != len(self._frames):
+                tags = sum((f[2] for f in self._frames if f[0]), ()) + tags
+                self._frames = collections.deque(kept)
+                self._len = sum(len(f[1]) for f in kept)
+
+        if self._len + len(tx_bytes) > self._max_len:
+            return False
+
+        superseded = (tx_packet.opcode in packet.SUPERSEDED_OPCODES
+            and tx_packet.msg_type == constants.MessageType.NOTIF)
+        self._frames.append((superseded, tx_bytes, tags))
+        self._len += len(tx_bytes)
+        return True
+
+
+    def drain(self):
+        """
+        (every queued frame, the tags they carry)
+        """
+        frames = [f[1] for f in self._frames]
+        tags = [tag for f in self._frames for tag in f[2]]
+        self._frames.clear()
+        self._len = 0
+        return frames, tags
+
 
 class Transport:
 
-    def __init__(self, socket):
-        # Callbacks
+    def __init__(self, socket, max_frame_len=packet.MESSAGE_LEN_MAX):
+        # Callbacks; on_written gets the tags given to send() once their
+        # frames are written to the socket
         self.on_recv = None
         self.on_drop = None
+        self.on_written = None
 
         # Socket
         self._sock = socket
         self._sock_alive = True
 
+        # Whether to send binary frames (see packet.py), once negotiated.
+        # Both kinds of frames are always accepted on reception.
+        self.binary = False
+
+        # Received bytes, until they form complete frames
+        self._rx_frames = packet.FrameReader(max_frame_len)
+
+        # capture.Capture of the recent frames, None not to keep any
+        self._capture = None
+
         # TX queue
-        self._tx_queue = queue.Queue()
-        self._tx_queue_not_empty = threading.Event()
+        self._tx_queue = TxQueue()
+        self._tx_cond = threading.Condition()
+        self._tx_overflow = False
 
         # TX and RX threads
         self._running = False
@@ -43,6 +125,24 @@ class Transport:
         self._rx_thread.deamon = True
 
 
+    @property
+    def tx_pending(self):
+        # Bytes waiting to be sent
+        return self._tx_queue.size
+
+
+    @property
+    def capture(self):
+        return self._capture
+
+
+    @capture.setter
+    def capture(self, capture):
+        # Received frames are only copied out of the buffer while captured
+        self._capture = capture
+        self._rx_frames.keep_frames = capture is not None
+
+
     def run(self):
         # start TX and RX threads
         self._running = True
@@ -51,10 +151,15 @@ class Transport:
 
 
     def stop(self):
-        self._running = False
+        with self._tx_cond:
+            self._running = False
+            self._tx_cond.notify()
 
         if self._sock_alive:
-            self._sock.shutdown(socket.SHUT_RDWR)
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
             self._sock.close()
 
         current_thread = threading.current_thread()
@@ -67,24 +172,44 @@ class Transport:
 
     def __tx(self):
         """
-        send pending packets from queue
+        send pending packets from queue, all at once
         """
 
-        while self._running:
+        while True:
 
-            # Wait for pending events
-            tx = self._tx_queue_not_empty.wait(timeout=1)
+            # Wait for pending frames
+            with self._tx_cond:
+                while self._running and not len(self._tx_queue):
+                    self._tx_cond.wait()
+                if not self._running:
+                    return
+                frames, tags = self._tx_queue.drain()
 
-            if not tx: continue
+            try:
+                self.__send_frames(frames)
+            except OSError:
+                # The RX thread will notice and report the drop
+                return
 
-            tx_packet = self._tx_queue.get()
-            if self._tx_queue.empty():
-                self._tx_queue_not_empty.clear()
+            if tags and self.on_written:
+                self.on_written(self, tags)
 
-            tx_bytes = tx_packet.to_bytes() + MESSAGE_SEP
-            self._sock.sendall(tx_bytes)
 
-            log.debug("-->  {}".format(str(tx_packet)))
+    def __send_frames(self, frames):
+        if not hasattr(self._sock, 'sendmsg'):
+            self._sock.sendall(b''.join(frames))
+            return
+
+        # One vectored write for the whole batch, resumed on partial writes
+        while frames:
+            sent = self._sock.sendmsg(frames[:_IOV_MAX])
+            while sent:
+                if sent >= len(frames[0]):
+                    sent -= len(frames[0])
+                    frames.pop(0)
+                else:
+                    frames[0] = memoryview(frames[0])[sent:]
+                    sent = 0
 
 
     def __rx_error(self):
@@ -103,25 +228,46 @@ class Transport:
 
         while self._running:
             try:
-                rx_bytes = self._sock.recv(16384)
+                received = self._rx_frames.recv_into(self._sock)
             except:
-                rx_bytes = None
+                received = 0
 
-            if not rx_bytes:
+            if not received:
                 return self.__rx_error()
 
-            # We might read several packets at once, let's separate
-            while len(rx_bytes):
-
-                idx = rx_bytes.find(MESSAGE_SEP)
-
-                rx_packet = packet.from_bytes(rx_bytes[:idx])
-                log.debug("<--  {}".format(str(rx_packet)))
+            # We might read several packets at once, or only part of one
+            try:
+                rx_packets = self._rx_frames.frames()
+            except ValueError as e:
+                log.error("Invalid frame: {}".format(e))
+                return self.__rx_error()
 
+            for rx_packet in rx_packets:
+                if self._capture is not None:
+                    self._capture.rx(rx_packet.rx_frame)
                 self.on_recv(self, rx_packet)
-                rx_bytes = rx_bytes[idx+1:]
 
 
-    def send(self, tx_packet):
-        self._tx_queue.put(tx_packet)
-        self._tx_queue_not_empty.set()
+    def send(self, tx_packet, tag=None):
+        # Encode right away, with the framing in use at the time of sending
+        tx_bytes = tx_packet.to_frame(self.binary)
+        if self._capture is not None:
+            self._capture.tx(tx_bytes)
+
+        with self._tx_cond:
+            if self._tx_overflow:
+                return
+
+            if not self._tx_queue.push(tx_packet, tx_bytes, tag):
+                # The RX thread will notice and report the drop
+                log.error("Client not reading, dropping connection")
+                self._tx_overflow = True
+                try:
+                    self._sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    # Already disconnected: the RX thread reports the drop
+                    # all the same
+                    pass
+                return
+
+            self._tx_cond.notify()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+"""
+Microbenchmarks: time the hot paths, save the results as JSON, and compare
+them against a baseline
+"""
+
+import argparse
+import logging
+import sys
+
+from belote import benchmark
+
+def main():
+
+    # Logging
+    logging.basicConfig(format='%(name)16s - %(levelname)8s - %(message)s')
+    logging.getLogger('belote').setLevel(logging.WARNING)
+    log = logging.getLogger('cli')
+
+    # Arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('names', nargs='*',
+        help='Only run the benchmarks whose name contains one of these')
+    parser.add_argument('-s', '--seed', default=0,
+        help='Random seed')
+    parser.add_argument('-r', '--repeat', default=5,
+        help='Timed batches per benchmark')
+    parser.add_argument('-o', '--output', default=None,
+        help='Save the results to this JSON file')
+    parser.add_argument('-c', '--compare', default=None,
+        help='Baseline JSON file to compare the results against')
+    parser.add_argument('-t', '--threshold', default=10,
+        help='Slowdown, in %%, reported as a regression')
+
+    args = parser.parse_args()
+
+    def report(name, result):
+        print("{:24s} {:12.1f} ns/op".format(name, result['ns_per_op']),
+            flush=True)
+
+    results = benchmark.run(int(args.seed), int(args.repeat), args.names,
+        report)
+
+    if args.output:
+        benchmark.save(results, args.output)
+
+    if args.compare:
+        rows = benchmark.compare(benchmark.load(args.compare), results,
+            float(args.threshold) / 100)
+
+        print()
+        print("{:24s} {:>12s} {:>12s} {:>8s}".format(
+            "", "baseline", "current", "ratio"))
+        for name, base, current, ratio, regressed in rows:
+            print("{:24s} {:12.1f} {:12.1f} {:7.2f}x{}".format(
+                name, base, current, ratio, "  REGRESSION" if regressed else ""))
+
+        if any(row[4] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+"""
+Print the frames of a traffic capture dumped by the server
+"""
+
+import argparse
+import datetime
+import sys
+
+from belote import capture
+
+def main():
+
+    # Arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('captures', nargs='+', help='Capture files')
+    parser.add_argument('-x', '--hex', action='store_true',
+        help='Print the raw bytes of each frame too')
+
+    args = parser.parse_args()
+
+    for path in args.captures:
+        try:
+            peer, frames = capture.load(path)
+        except (OSError, ValueError) as e:
+            sys.exit("Could not load {}: {}".format(path, e))
+
+        print("{}: {} ({} frames)".format(path, peer, len(frames)))
+        for timestamp, direction, frame in frames:
+            try:
+                text = capture.describe(capture.decode(frame))
+            except (ValueError, IndexError, KeyError) as e:
+                text = "<invalid frame: {}>".format(e)
+
+            print("{} {} {}".format(
+                datetime.datetime.fromtimestamp(timestamp)
+                    .strftime('%H:%M:%S.%f')[:-3],
+                "<--" if direction == capture.RX else "-->",
+                text))
+            if args.hex:
+                print("             {}".format(frame.hex(' ')))
+
+
+if __name__ == '__main__':
+    main()
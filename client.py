@@ -14,6 +14,7 @@ import os
 
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 
+from belote           import gui
 from belote.client    import Client
 from belote.transport import Transport
 
@@ -21,7 +22,6 @@ def main():
 
     # Logging
     logging.basicConfig(format='%(name)16s - %(levelname)8s - %(message)s')
-    logging.getLogger('belote').setLevel(logging.DEBUG)
     log = logging.getLogger('cli')
 
     default_name = os.environ['USER'] if 'USER' in os.environ else 'Guest'
@@ -35,11 +35,23 @@ def main():
         help='Windowed mode')
     parser.add_argument('-n', '--name', default=default_name,
         help='Player name')
+    parser.add_argument('-t', '--table', default=None,
+        help='Table to join (default: first one with a free seat)')
+    parser.add_argument('-s', '--spectate', action='store_true',
+        help='Watch the table instead of playing')
+    parser.add_argument('-f', '--fps', default=gui.MAX_FPS, type=int,
+        help='Most frames per second to draw')
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='Log debug messages')
 
     args = parser.parse_args()
 
+    logging.getLogger('belote').setLevel(
+        logging.DEBUG if args.verbose else logging.INFO)
+
     # Launch client instance
-    client = Client(args.host, int(args.port), args.name, bool(args.windowed))
+    client = Client(args.host, int(args.port), args.name, bool(args.windowed),
+        args.table, bool(args.spectate), args.fps)
     client.run()
 
 
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+"""
+Load test: connect many headless clients to a server and report latency,
+throughput, and the server's CPU and memory use
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+import time
+
+from belote.loadtest import LoadTest
+
+def main():
+
+    # Logging
+    logging.basicConfig(format='%(name)16s - %(levelname)8s - %(message)s')
+    logging.getLogger('belote').setLevel(logging.WARNING)
+    log = logging.getLogger('cli')
+
+    # Arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('host', nargs='?', default='localhost',
+        help='Host location')
+    parser.add_argument('-p', '--port', default=4242,
+        help='Port')
+    parser.add_argument('-c', '--clients', default=100,
+        help='Number of clients (4 per table)')
+    parser.add_argument('-d', '--duration', default=30,
+        help='Seconds to run for')
+    parser.add_argument('-i', '--interval', default=1,
+        help='Seconds between reports')
+    parser.add_argument('--policy', default='random',
+        choices=['random', 'first'],
+        help='How clients pick their moves')
+    parser.add_argument('--text', action='store_true',
+        help='Stick to the text protocol')
+    parser.add_argument('--think', default=0,
+        help='Seconds clients wait before each move')
+    parser.add_argument('--ramp', default=50,
+        help='Clients connecting per second')
+    parser.add_argument('-s', '--seed', default=None,
+        help='Random seed')
+    parser.add_argument('--pid', default=None,
+        help='Pid of the server, to report its CPU and memory use')
+    parser.add_argument('--spawn', action='store_true',
+        help='Start a local server for the test (arguments after -- go to '
+            'it)')
+
+    argv = sys.argv[1:]
+    server_args = []
+    if '--' in argv:
+        server_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+
+    server = None
+    pid = int(args.pid) if args.pid else None
+    if args.spawn:
+        server = subprocess.Popen([sys.executable, 'server.py', '-q',
+            '-p', str(args.port)] + server_args)
+        pid = server.pid
+        time.sleep(1)
+        if server.poll() is not None:
+            log.error("Server exited")
+            return
+    elif server_args:
+        parser.error("server arguments given without --spawn")
+
+    try:
+        LoadTest(args.host, int(args.port), int(args.clients),
+            policy=args.policy,
+            binary=not args.text,
+            think=float(args.think),
+            ramp=float(args.ramp),
+            seed=int(args.seed) if args.seed is not None else None,
+            server_pid=pid).run(float(args.duration), float(args.interval))
+    finally:
+        if server:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+"""
+Control the profiler of a running server (started with --metrics-port), and
+dump its per-stage breakdown or flame graph stacks
+"""
+
+import argparse
+import sys
+import urllib.error
+import urllib.parse
+import urllib.request
+
+def main():
+
+    # Arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('action', choices=['start', 'stop', 'reset', 'dump'],
+        help='What to do')
+    parser.add_argument('-p', '--port', default=9100,
+        help='Metrics port of the server')
+    parser.add_argument('-r', '--rate', default=None,
+        help='Profile one in this many commands (start)')
+    parser.add_argument('--stacks', action='store_true',
+        help='Dump collapsed stacks, for flamegraph.pl or speedscope')
+    parser.add_argument('-o', '--output', default=None,
+        help='Dump to this file')
+
+    args = parser.parse_args()
+
+    path = '/profile' if args.action == 'dump' else '/profile/' + args.action
+    params = {}
+    if args.rate is not None:
+        params['rate'] = args.rate
+    if args.stacks:
+        params['format'] = 'stacks'
+
+    url = 'http://127.0.0.1:{}{}?{}'.format(int(args.port), path,
+        urllib.parse.urlencode(params))
+    try:
+        with urllib.request.urlopen(url) as response:
+            text = response.read().decode('utf-8')
+    except (urllib.error.URLError, OSError) as e:
+        sys.exit("Could not reach the server: {}".format(e))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+"""
+Replay a table journal: show the game at a given round and pli
+"""
+
+import argparse
+import logging
+
+from belote import replay
+
+def main():
+
+    # Logging
+    logging.basicConfig(format='%(name)16s - %(levelname)8s - %(message)s')
+    logging.getLogger('belote').setLevel(logging.WARNING)
+    log = logging.getLogger('cli')
+
+    # Arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('journal', help='Journal file')
+    parser.add_argument('-r', '--round', default=None,
+        help='Round to show (default: list the rounds)')
+    parser.add_argument('-p', '--pli', default=None,
+        help='Pli of the round to show (default: right after the deal)')
+    parser.add_argument('-s', '--seat', default=None,
+        help='Seat to look from (default: spectator)')
+
+    args = parser.parse_args()
+
+    game_replay = replay.load(args.journal)
+
+    if args.round is None:
+        print("{} rounds".format(game_replay.rounds))
+        for round_idx in range(game_replay.rounds):
+            print("{:6d}: {} plis".format(round_idx,
+                game_replay.plis(round_idx)))
+        return
+
+    game_replay.seek(int(args.round),
+        int(args.pli) if args.pli is not None else None)
+    proxy = game_replay.proxy(int(args.seat) if args.seat is not None else None)
+
+    print("State:    {}".format(proxy.state.value))
+    print("Trump:    {}".format(proxy.trump_suit))
+    print("Points:   {} - {}".format(proxy.player_points, proxy.enemy_points))
+    print("Players:  {}".format(", ".join(proxy.players)))
+    print("Starting: {}".format(proxy.players[proxy.starting_player]))
+    print("Hand:     {}".format(" ".join(c.code for c in proxy.hand)))
+    print("Pli:      {}".format(" ".join(c.code or "-"
+        for c in proxy.current_pli)))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,26 +15,68 @@ import os
 
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = "hide"
 
+from belote import metrics
+from belote import profiling
 from belote.server import Server
 
 def main():
 
     # Logging
     logging.basicConfig(format='%(name)16s - %(levelname)8s - %(message)s')
-    logging.getLogger('belote').setLevel(logging.DEBUG)
     log = logging.getLogger('cli')
 
     # Arguments
     parser = argparse.ArgumentParser(description=__doc__)
     parser.add_argument('-p', '--port', default=4242,
         help='Port')
+    parser.add_argument('--pli-delay', default=2,
+        help='Seconds a complete pli stays on the table')
+    parser.add_argument('--round-delay', default=10,
+        help='Seconds between the last card of a round and the next deal')
+    parser.add_argument('-q', '--quiet', action='store_true',
+        help='Only log warnings and errors')
+    parser.add_argument('-v', '--verbose', action='store_true',
+        help='Log debug messages')
+    parser.add_argument('--asyncio', action='store_true',
+        help='Serve all clients from a single asyncio event loop')
+    parser.add_argument('-j', '--journal', default=None,
+        help='Directory where to keep a journal of each table')
+    parser.add_argument('-s', '--snapshots', default=None,
+        help='Directory where to keep the state of each table, restored on '
+            'start')
+    parser.add_argument('--metrics-port', default=None,
+        help='Local port where to serve metrics in the Prometheus format, '
+            'and control the profiler (see profiler.py)')
+    parser.add_argument('--metrics-file', default=None,
+        help='File where to write metrics in the Prometheus format, every '
+            '10 seconds')
+    parser.add_argument('--profile', default=None,
+        help='Profile one in this many commands from the start')
+    parser.add_argument('-c', '--captures', default=None,
+        help='Directory where to dump the recent traffic of a client when it '
+            'drops, or on demand through the metrics port')
 
     args = parser.parse_args()
 
+    logging.getLogger('belote').setLevel(logging.WARNING if args.quiet
+        else logging.DEBUG if args.verbose else logging.INFO)
+
     # Launch server instance
-    server = Server(int(args.port))
+    server = Server(int(args.port), bool(args.asyncio), args.journal,
+        args.snapshots, float(args.pli_delay), float(args.round_delay),
+        args.captures)
     server.run()
 
+    if args.profile:
+        profiling.profiler.start(int(args.profile))
+    if args.metrics_port:
+        routes = profiling.routes()
+        routes['/capture/dump'] = lambda params: "".join(
+            path + "\n" for path in server.dump_captures())
+        metrics.serve(server.metrics, int(args.metrics_port), routes=routes)
+    if args.metrics_file:
+        metrics.FileExporter(server.metrics, args.metrics_file).run()
+
 
 
 if __name__ == '__main__':
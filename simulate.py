@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+"""
+Headless self-play: run rounds between random bots and report throughput
+"""
+
+import argparse
+import logging
+
+from belote import bitboard
+from belote.journal import Journal
+from belote.simulation import Simulator
+
+def main():
+
+    # Logging
+    logging.basicConfig(format='%(name)16s - %(levelname)8s - %(message)s')
+    logging.getLogger('belote').setLevel(logging.WARNING)
+    log = logging.getLogger('cli')
+
+    # Arguments
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-r', '--rounds', default=10000,
+        help='Number of rounds to play')
+    parser.add_argument('-s', '--seed', default=None,
+        help='Random seed')
+    parser.add_argument('-j', '--journal', default=None,
+        help='Record the games to this journal file')
+
+    args = parser.parse_args()
+
+    seed = int(args.seed) if args.seed is not None else None
+
+    # Launch simulation
+    game_journal = Journal(args.journal) if args.journal else None
+    simulator = Simulator(seed, journal=game_journal)
+    rate = simulator.run(int(args.rounds))
+    if game_journal:
+        game_journal.close()
+
+    print("{} rounds, {:.0f} rounds/s, points: {} - {}".format(
+        simulator.rounds, rate,
+        bitboard.display_points(simulator.points[0]),
+        bitboard.display_points(simulator.points[1])))
+
+
+if __name__ == '__main__':
+    main()
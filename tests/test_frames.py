@@ -0,0 +1,198 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+FrameReader on streams cut anywhere, and on invalid frames
+"""
+
+import pytest
+
+from belote import constants
+from belote import packet
+from belote import transport
+
+
+def _packets():
+    return [
+        packet.Packet(constants.MessageType.COMMAND,
+            constants.CommandOpcode.CREATE_PLAYER, "1a2b", "Zoé", "", "2"),
+        packet.Packet(constants.MessageType.NOTIF,
+            constants.NotifOpcode.GAME_STATUS, body=bytes(range(40))),
+        packet.Packet(constants.MessageType.COMMAND,
+            constants.CommandOpcode.PLAY_CARD, "10H"),
+        packet.Packet(constants.MessageType.NOTIF,
+            constants.NotifOpcode.TABLE_LIST, *["x" * 200] * 15),
+    ]
+
+
+def _stream():
+    # Text and binary frames, interleaved
+    return b''.join(p.to_frame(binary=bool(idx % 2))
+        for idx, p in enumerate(_packets()))
+
+
+def _feed(reader, data):
+    view = reader.buffer(len(data))
+    view[:len(data)] = data
+    view.release()
+    reader.commit(len(data))
+    return reader.frames()
+
+
+def _check(received):
+    expected = _packets()
+    assert len(received) == len(expected)
+    for got, sent in zip(received, expected):
+        assert got.msg_type == sent.msg_type
+        assert got.opcode == sent.opcode
+        assert got.args == sent.args
+        assert got.body == sent.body
+
+
+def test_whole_stream():
+    _check(_feed(packet.FrameReader(), _stream()))
+
+
+def test_split_at_every_offset():
+    stream = _stream()
+    for cut in range(len(stream) + 1):
+        reader = packet.FrameReader()
+        received = _feed(reader, stream[:cut])
+        received += _feed(reader, stream[cut:])
+        _check(received)
+
+
+def test_byte_by_byte():
+    reader = packet.FrameReader()
+    received = []
+    for byte in _stream():
+        received += _feed(reader, bytes([byte]))
+    _check(received)
+
+
+def test_frames_kept_only_when_asked():
+    frames = [p.to_frame(binary=bool(idx % 2))
+        for idx, p in enumerate(_packets())]
+
+    received = _feed(packet.FrameReader(), b''.join(frames))
+    assert [p.rx_len for p in received] == [len(f) for f in frames]
+    assert all(p.rx_frame == b'' for p in received)
+
+    reader = packet.FrameReader()
+    reader.keep_frames = True
+    received = _feed(reader, b''.join(frames))
+    assert [p.rx_frame for p in received] == frames
+
+
+def test_oversized_text_frame():
+    reader = packet.FrameReader(max_frame_len=64)
+    with pytest.raises(ValueError):
+        _feed(reader, b'COMMAND|PLAY_CARD|' + b'x' * 100)
+
+
+def test_oversized_binary_frame():
+    reader = packet.FrameReader(max_frame_len=64)
+    frame = packet.Packet(constants.MessageType.NOTIF,
+        constants.NotifOpcode.GAME_STATUS, body=bytes(100)).to_binary()
+    with pytest.raises(ValueError):
+        _feed(reader, frame[:packet.BINARY_HEADER.size])
+
+
+def test_frame_at_the_limit():
+    reader = packet.FrameReader(max_frame_len=64)
+    frame = packet.Packet(constants.MessageType.NOTIF,
+        constants.NotifOpcode.GAME_STATUS, body=bytes(62)).to_binary()
+    assert len(_feed(reader, frame)) == 1
+
+
+def test_frames_too_long_to_send():
+    args = ["x" * 200] * 30
+    sent = packet.Packet(constants.MessageType.NOTIF,
+        constants.NotifOpcode.TABLE_LIST, *args)
+    with pytest.raises(ValueError):
+        sent.to_frame(binary=True)
+    with pytest.raises(ValueError):
+        sent.to_frame(binary=False)
+
+    body = packet.Packet(constants.MessageType.NOTIF,
+        constants.NotifOpcode.GAME_STATUS, body=bytes(70000))
+    with pytest.raises(ValueError):
+        body.to_binary()
+
+
+def _notif(opcode, *args):
+    sent = packet.Packet(constants.MessageType.NOTIF, opcode, *args)
+    return sent, sent.to_frame()
+
+
+def test_tx_queue_snapshot_drops_superseded_frames():
+    queue = transport.TxQueue()
+    old_status = _notif(constants.NotifOpcode.GAME_STATUS, "old")
+    delta = _notif(constants.NotifOpcode.GAME_DELTA, "1", "2")
+    table_list = _notif(constants.NotifOpcode.TABLE_LIST, "0", "4")
+    new_status = _notif(constants.NotifOpcode.GAME_STATUS, "new")
+
+    for sent in [old_status, table_list, delta]:
+        assert queue.push(*sent)
+    assert queue.push(*new_status)
+
+    # Other notifications stay, in order, before the new snapshot
+    frames = [table_list[1], new_status[1]]
+    assert len(queue) == 2
+    assert queue.size == sum(len(f) for f in frames)
+    assert queue.drain() == (frames, [])
+    assert len(queue) == 0 and queue.size == 0
+
+
+def test_tx_queue_keeps_deltas_and_commands():
+    queue = transport.TxQueue()
+    sent = [
+        _notif(constants.NotifOpcode.GAME_DELTA, "1", "2"),
+        _notif(constants.NotifOpcode.GAME_DELTA, "2", "3"),
+    ]
+    command = packet.Packet(constants.MessageType.COMMAND,
+        constants.CommandOpcode.PLAY_CARD, "7H")
+    sent.append((command, command.to_frame()))
+    for s in sent:
+        assert queue.push(*s)
+
+    # Deltas only go with a newer snapshot
+    assert queue.drain() == ([s[1] for s in sent], [])
+
+
+def test_tx_queue_overflow():
+    status = _notif(constants.NotifOpcode.GAME_STATUS, "x" * 50)
+    table_list = _notif(constants.NotifOpcode.TABLE_LIST, "y" * 50)
+    queue = transport.TxQueue(max_len=2 * len(table_list[1]))
+
+    assert queue.push(*table_list)
+    assert queue.push(*table_list)
+    assert not queue.push(*table_list)
+    assert queue.size == 2 * len(table_list[1])
+
+    # A snapshot frees what it supersedes before the limit is checked
+    queue = transport.TxQueue(max_len=len(status[1]) + len(table_list[1]))
+    assert queue.push(*status)
+    assert queue.push(*table_list)
+    assert queue.push(*status)
+    assert queue.size == len(status[1]) + len(table_list[1])
+    assert queue.drain() == ([table_list[1], status[1]], [])
+
+
+def test_tx_queue_tags():
+    queue = transport.TxQueue()
+    status = _notif(constants.NotifOpcode.GAME_STATUS, "old")
+    table_list = _notif(constants.NotifOpcode.TABLE_LIST, "0", "4")
+
+    assert queue.push(*status, tag="status")
+    assert queue.push(*table_list, tag="list")
+    assert queue.drain()[1] == ["status", "list"]
+
+    # A snapshot dropping a tagged frame answers for it
+    assert queue.push(*status, tag="first")
+    assert queue.push(*status)
+    assert queue.push(*status, tag="last")
+    assert queue.drain() == ([status[1]], ["first", "last"])
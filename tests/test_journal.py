@@ -0,0 +1,75 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Journal records, rotation and reading back
+"""
+
+import os
+
+from belote import journal
+from belote import simulation
+
+
+def _records(path):
+    return [r for p in journal.paths(path) for r in journal.records(p)]
+
+
+def test_records_read_back(tmp_path):
+    path = str(tmp_path / "game.journal")
+    j = journal.Journal(path)
+    for seat, name in enumerate(["alice", "bob", "Zoé", "李雷"]):
+        j.join(seat, name)
+    j.deal(2, (0x1, 0x2, 0x4))
+    j.card(2, 31)
+    j.leave(1)
+    j.close()
+
+    records = list(journal.records(path))
+    assert [r.kind for r in records] == [journal.HEADER] + \
+        [journal.JOIN] * 4 + [journal.DEAL, journal.CARD, journal.LEAVE]
+    assert [journal.name(r) for r in records[1:5]] == \
+        ["alice", "bob", "Zoé", "李雷"]
+    assert records[5] == journal.Record(journal.DEAL, 2, 0, 0x1, 0x2, 0x4)
+    assert (records[6].seat, records[6].arg) == (2, 31)
+    assert records[7].seat == 1
+
+
+def test_truncated_record_ignored(tmp_path):
+    path = str(tmp_path / "game.journal")
+    j = journal.Journal(path)
+    j.join(0, "alice")
+    j.close()
+
+    with open(path, 'ab') as f:
+        f.write(b'\x05\x00')
+
+    assert [r.kind for r in journal.records(path)] == \
+        [journal.HEADER, journal.JOIN]
+
+
+def test_rotation(tmp_path):
+    path = str(tmp_path / "game.journal")
+    j = journal.Journal(path, max_bytes=40 * journal.RECORD_LEN, backups=3)
+    simulation.Simulator(seed=1, journal=j).run(10)
+    j.close()
+
+    paths = journal.paths(path)
+    assert paths == [path + ".3", path + ".2", path + ".1", path]
+    for p in paths:
+        assert os.path.getsize(p) % journal.RECORD_LEN == 0
+
+        # Every file can be read on its own: it starts with the players
+        records = list(journal.records(p))
+        assert records[0].kind == journal.HEADER
+        assert [r.kind for r in records[1:5]] == [journal.JOIN] * 4
+        assert [journal.name(r) for r in records[1:5]] == \
+            ["bot0", "bot1", "bot2", "bot3"]
+
+    # Only complete rounds went to the older files
+    for p in paths[:-1]:
+        assert list(journal.records(p))[-1].kind == journal.ROUND
+    assert sum(r.kind == journal.ROUND for r in _records(path)) <= 10
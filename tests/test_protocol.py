@@ -0,0 +1,164 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Binary frames and game statuses decode to what was encoded
+"""
+
+import random
+
+import pytest
+
+from belote import bitboard
+from belote import card
+from belote import constants
+from belote import game
+from belote import packet
+from belote import player
+
+
+NAMES = ["alice", "Zoé", "李雷", ""]
+
+
+def _proxies(seed, rounds=2):
+    """
+    Proxies of every seat after every move of a few random rounds
+    """
+    rng = random.Random(seed)
+    timers = []
+    g = game.Game(rng=rng,
+        schedule=lambda delay, callback: timers.append(callback))
+    g.on_status_changed = lambda: None
+    players = [player.Player(str(idx), name)
+        for idx, name in enumerate(NAMES)]
+
+    proxies = []
+    for p in players:
+        g.add_player(p)
+        proxies += [g.proxy_for_player(seat) for seat in g.players]
+
+    for _ in range(rounds):
+        g.pick_trump(g.announcing_player,
+            rng.choice([trump.value for trump in constants.Trump]))
+        for _ in range(32):
+            current = g.current_pli.next_player
+            legal = g.current_pli.legal_moves(current, g.hand(current),
+                g.trump_suit)
+            g.play_card(current, card.from_mask(legal)[
+                rng.randrange(bitboard.count(legal))])
+            proxies += [g.proxy_for_player(seat) for seat in players]
+            while timers:
+                timers.pop(0)()
+                proxies += [g.proxy_for_player(seat) for seat in players]
+
+    return proxies
+
+
+@pytest.mark.parametrize('msg_type, opcodes', [
+    (constants.MessageType.COMMAND, list(constants.CommandOpcode)),
+    (constants.MessageType.NOTIF, list(constants.NotifOpcode)),
+])
+def test_packet_binary_round_trip(msg_type, opcodes):
+    for opcode in opcodes:
+        if opcode in packet.BINARY_BODY_OPCODES:
+            sent = packet.Packet(msg_type, opcode, body=b'\x01\x02\xff')
+        else:
+            sent = packet.Packet(msg_type, opcode, "", "7H", "Zoé", "x" * 255)
+
+        frame = sent.to_binary()
+        assert frame[0] == packet.BINARY_MARKER
+        received = packet.from_binary(frame[packet.BINARY_HEADER.size:])
+
+        assert received.msg_type == msg_type
+        assert received.opcode == opcode
+        assert received.args == sent.args
+        assert received.body == sent.body
+
+
+def test_truncate_utf8():
+    assert packet.truncate_utf8("Zoé", 255) == "Zoé".encode('utf-8')
+    assert packet.truncate_utf8("Zoé", 3) == b"Zo"
+    assert packet.truncate_utf8("李雷", 5) == "李".encode('utf-8')
+    assert packet.truncate_utf8("", 0) == b""
+
+
+def test_long_args_cut_at_character_boundary():
+    sent = packet.Packet(constants.MessageType.COMMAND,
+        constants.CommandOpcode.CREATE_PLAYER, "1a2b", "é" * 200, "李" * 100)
+    frame = sent.to_binary()
+    received = packet.from_binary(frame[packet.BINARY_HEADER.size:])
+    assert received.args == ["1a2b", "é" * 127, "李" * 85]
+
+
+def test_long_names_cut_at_character_boundary():
+    g = game.Game(schedule=lambda delay, callback: None)
+    g.on_status_changed = lambda: None
+    g.add_player(player.Player("0", "é" * 200))
+    decoded = game.from_bytes(g.public_proxy().to_bytes())
+    assert decoded.to_args()[5] == "é" * 127
+
+
+def test_packet_text_round_trip():
+    sent = packet.Packet(constants.MessageType.COMMAND,
+        constants.CommandOpcode.CREATE_PLAYER, "1a2b", "Zoé", "", "2")
+    assert packet.from_bytes(sent.to_bytes()) == sent
+
+
+def test_invalid_binary_payload():
+    with pytest.raises(ValueError):
+        packet.from_binary(b'\xff\x00')
+    with pytest.raises(ValueError):
+        packet.from_binary(b'')
+
+
+def test_game_status_bytes_round_trip():
+    for proxy in _proxies(0):
+        decoded = game.from_bytes(proxy.to_bytes())
+        assert decoded.to_args() == proxy.to_args()
+
+
+def test_game_status_text_round_trip():
+    for proxy in _proxies(1):
+        frame = packet.Packet(constants.MessageType.NOTIF,
+            constants.NotifOpcode.GAME_STATUS, *proxy.to_args()).to_bytes()
+        decoded = game.from_args(packet.from_bytes(frame).args)
+        assert decoded.to_args() == proxy.to_args()
+
+
+def test_game_delta_round_trip():
+    proxies = _proxies(2)
+    for previous, proxy in zip(proxies, proxies[1:]):
+        frame = packet.Packet(constants.MessageType.NOTIF,
+            constants.NotifOpcode.GAME_DELTA,
+            *proxy.delta_args(previous)).to_frame(True)
+        args = packet.from_binary(frame[packet.BINARY_HEADER.size:]).args
+
+        updated = game.apply_delta(previous, args)
+        assert updated.version == proxy.version
+        assert updated.to_args() == proxy.to_args()
+
+
+def test_game_delta_of_another_version():
+    previous, proxy = _proxies(3)[-2:]
+    stale = game.from_bytes(previous.to_bytes())
+    stale._version -= 1
+    assert game.apply_delta(stale, proxy.delta_args(previous)) is None
+
+
+def test_malformed_game_delta():
+    # The errors a client catches to ask for a RESYNC instead
+    rng = random.Random(4)
+    proxies = _proxies(4, rounds=1)
+    for previous, proxy in zip(proxies, proxies[1:]):
+        args = proxy.delta_args(previous)
+        for _ in range(5):
+            bad = list(args)
+            bad[rng.randrange(1, len(bad))] = rng.choice(["x", "99", "-1", ""])
+            bad = bad[:rng.randrange(2, len(bad) + 1)]
+            try:
+                game.apply_delta(previous, bad)
+            except (ValueError, IndexError, KeyError):
+                pass
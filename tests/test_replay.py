@@ -0,0 +1,82 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Replay of journals written by simulated games, over several sessions
+"""
+
+from belote import journal
+from belote import replay
+from belote import simulation
+
+
+def _simulate(path, seed, rounds, **kwargs):
+    j = journal.Journal(path, **kwargs)
+    sim = simulation.Simulator(seed=seed, journal=j)
+    sim.run(rounds)
+    j.close()
+    return sim
+
+
+def _records(path):
+    return [r for p in journal.paths(path) for r in journal.records(p)]
+
+
+def _replay_all(r, count):
+    # Bounded, so that a replay going back on itself fails instead of hanging
+    for _ in range(count):
+        assert r.step() is not None
+    assert r.step() is None
+
+
+def _view(proxy):
+    # Everything but the version, which the replay counts on its own
+    return proxy.to_args()[:-1]
+
+
+def test_single_session(tmp_path):
+    path = str(tmp_path / "game.journal")
+    sim = _simulate(path, 3, 5)
+
+    r = replay.load(path)
+    assert r.rounds == 5
+    _replay_all(r, len(_records(path)))
+    for seat in range(4):
+        assert _view(r.proxy(seat)) == \
+            _view(sim.game.proxy_for_player(sim.game.players[seat]))
+
+
+def test_several_sessions(tmp_path):
+    path = str(tmp_path / "game.journal")
+    _simulate(path, 4, 3)
+    _simulate(path, 5, 4)
+    sim = _simulate(path, 6, 6, max_bytes=60 * journal.RECORD_LEN)
+
+    r = replay.load(path)
+    assert r.rounds == 13
+    _replay_all(r, len(_records(path)))
+    assert _view(r.proxy()) == _view(sim.game.public_proxy())
+
+
+def test_seek(tmp_path):
+    path = str(tmp_path / "game.journal")
+    _simulate(path, 7, 2)
+    _simulate(path, 8, 3)
+
+    # What the players see before every pli, stepping through
+    r = replay.Replay(_records(path))
+    expected = {}
+    for round_idx in range(r.rounds):
+        for pli_idx in range(r.plis(round_idx)):
+            r.seek(round_idx, pli_idx)
+            expected[round_idx, pli_idx] = [_view(r.proxy(seat))
+                for seat in range(4)]
+
+    # Same, seeking back and forth
+    r = replay.Replay(_records(path), checkpoint_interval=3)
+    for key in sorted(expected, reverse=True) + sorted(expected)[::7]:
+        r.seek(*key)
+        assert [_view(r.proxy(seat)) for seat in range(4)] == expected[key]
@@ -0,0 +1,148 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Bitboard rules against the card-by-card rules they replaced
+"""
+
+import random
+
+from belote import bitboard
+from belote import card
+from belote import constants
+from belote import pli
+from belote import player
+
+
+REGULAR_ORDER = ['A', '10', 'K', 'Q', 'J', '9', '8', '7']
+TRUMP_ORDER = ['J', '9', 'A', '10', 'K', 'Q', '8', '7']
+
+TRUMPS = [trump.value for trump in constants.Trump]
+
+
+def _is_trump(code, trump):
+    return trump == code[-1] or trump == constants.Trump.AT
+
+
+def _overtakes(code, other, trump):
+    if other is None:
+        return True
+    if _is_trump(code, trump) != _is_trump(other, trump):
+        return _is_trump(code, trump)
+    if code[-1] != other[-1]:
+        return False
+    order = TRUMP_ORDER if _is_trump(code, trump) else REGULAR_ORDER
+    return order.index(code[:-1]) < order.index(other[:-1])
+
+
+def _is_card_legal(played, player_idx, code, hand, trump):
+    # played: (player index, code) in the order they were played
+    if not played:
+        return True
+
+    required_suit = played[0][1][-1]
+    taking_idx, taking = None, None
+    for idx, other in played:
+        if _overtakes(other, taking, trump):
+            taking_idx, taking = idx, other
+
+    has_required = any(c[-1] == required_suit for c in hand)
+    has_overtaking = any(_overtakes(c, taking, trump) for c in hand)
+    has_trump = any(c[-1] == trump for c in hand)
+
+    if has_required:
+        if code[-1] != required_suit:
+            return False
+        if (required_suit == trump or trump == constants.Trump.AT) \
+            and has_overtaking:
+            return _overtakes(code, taking, trump)
+        return True
+
+    if has_overtaking and taking_idx % 2 != player_idx % 2:
+        return _overtakes(code, taking, trump)
+    if has_trump and taking_idx % 2 != player_idx % 2:
+        return code[-1] == trump
+    return True
+
+
+def _random_pli(rng):
+    players = [player.Player(str(idx), str(idx)) for idx in range(4)]
+    deck = list(card.all)
+    rng.shuffle(deck)
+    hands = [deck[idx * 8:idx * 8 + 8] for idx in range(4)]
+    trump = rng.choice(TRUMPS)
+    start = rng.randrange(4)
+
+    p = pli.Pli(players, start)
+    played = []
+    for offset in range(rng.randrange(4)):
+        seat = (start + offset) % 4
+        codes = [c.code for c in hands[seat]]
+        legal = [c for c in hands[seat]
+            if _is_card_legal(played, seat, c.code, codes, trump)]
+        chosen = rng.choice(legal)
+        p.play_card(players[seat], chosen, trump)
+        hands[seat].remove(chosen)
+        played.append((seat, chosen.code))
+
+    return p, players, hands, trump, played, (start + len(played)) % 4
+
+
+def test_legal_moves_match_card_rules():
+    rng = random.Random(0)
+    for _ in range(5000):
+        p, players, hands, trump, played, seat = _random_pli(rng)
+        hand = hands[seat]
+        codes = [c.code for c in hand]
+
+        expected = bitboard.from_cards(c for c in hand
+            if _is_card_legal(played, seat, c.code, codes, trump))
+        assert p.legal_moves(players[seat], bitboard.from_cards(hand),
+            trump) == expected
+
+
+def test_taking_player_matches_card_rules():
+    rng = random.Random(1)
+    for _ in range(2000):
+        p, players, hands, trump, played, _ = _random_pli(rng)
+        if not played:
+            continue
+        taking_idx, taking = None, None
+        for idx, code in played:
+            if _overtakes(code, taking, trump):
+                taking_idx, taking = idx, code
+        assert p.taking_player_idx(trump) == taking_idx
+
+
+REGULAR_POINTS = {'A': 11, '10': 10, 'K': 4, 'Q': 3, 'J': 2,
+    '9': 0, '8': 0, '7': 0}
+TRUMP_POINTS = {'J': 20, '9': 14, 'A': 11, '10': 10, 'K': 4, 'Q': 3,
+    '8': 0, '7': 0}
+
+
+def _point_value(code, trump):
+    points = (TRUMP_POINTS if _is_trump(code, trump) else REGULAR_POINTS)
+    if trump == constants.Trump.AT:
+        return points[code[:-1]] * 152 / 248
+    if trump == constants.Trump.NT:
+        return points[code[:-1]] * 152 / 120
+    return points[code[:-1]]
+
+
+def test_points_match_card_values():
+    rng = random.Random(2)
+    for _ in range(2000):
+        cards = rng.sample(card.all, rng.randrange(33))
+        trump = rng.choice(TRUMPS)
+        expected = sum(_point_value(c.code, trump) for c in cards)
+        assert abs(bitboard.points(bitboard.from_cards(cards), trump)
+            - expected * bitboard.SCALE) < 1e-6
+
+
+def test_all_cards_are_152_points():
+    for trump in TRUMPS:
+        assert bitboard.display_points(
+            bitboard.points(bitboard.ALL, trump)) == 152
@@ -0,0 +1,55 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Lobby of a server with many tables, through a real connection
+"""
+
+import queue
+import socket
+import time
+
+from belote import constants
+from belote import packet
+from belote import server
+from belote import transport
+
+
+def _connect(port):
+    # The server listens once its event loop runs
+    deadline = time.monotonic() + 5
+    while True:
+        try:
+            return socket.create_connection(('localhost', port))
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+def test_table_list_fits_in_a_frame():
+    # With asyncio, as stop() waits for a blocking accept() to return
+    s = server.Server(0, use_asyncio=True)
+    for _ in range(800):
+        s._Server__create_table()
+    s.run()
+
+    try:
+        t = transport.Transport(_connect(s._sock.getsockname()[1]))
+        received = queue.Queue()
+        t.on_recv = lambda t, rx_packet: received.put(rx_packet)
+        t.on_drop = lambda t: received.put(None)
+        t.run()
+
+        t.send(packet.Packet(constants.MessageType.COMMAND,
+            constants.CommandOpcode.LIST_TABLES))
+        table_list = received.get(timeout=5)
+        assert table_list.opcode == constants.NotifOpcode.TABLE_LIST
+        assert len(table_list.args) == 2 * server.TABLE_LIST_MAX
+        assert table_list.args[:2] == ["0", "0"]
+        t.stop()
+    finally:
+        s.stop()
@@ -0,0 +1,164 @@
+#
+# Copyright (C) Florian Denis - All Rights Reserved
+# Unauthorized copying of this file, via any medium is strictly prohibited.
+# Proprietary and confidential.
+#
+
+"""
+Games restored from serialized snapshots look the same to every player
+"""
+
+import random
+
+import pytest
+
+from belote import bitboard
+from belote import card
+from belote import constants
+from belote import game
+from belote import player
+from belote import snapshot
+
+
+def _game(rng, timers):
+    g = game.Game(rng=rng,
+        schedule=lambda delay, callback: timers.append(callback))
+    g.on_status_changed = lambda: None
+    return g
+
+
+def _snapshots(seed, rounds=2):
+    """
+    Game and snapshot of it after every move of a few random rounds
+    """
+    rng = random.Random(seed)
+    timers = []
+    g = _game(rng, timers)
+    for idx, name in enumerate(["alice", "Zoé", "李雷", ""]):
+        g.add_player(player.Player(str(idx), name))
+        yield g, g.snapshot()
+
+    for _ in range(rounds):
+        g.pick_trump(g.announcing_player,
+            rng.choice([trump.value for trump in constants.Trump]))
+        yield g, g.snapshot()
+        for _ in range(32):
+            current = g.current_pli.next_player
+            legal = g.current_pli.legal_moves(current, g.hand(current),
+                g.trump_suit)
+            g.play_card(current, card.from_mask(legal)[
+                rng.randrange(bitboard.count(legal))])
+            yield g, g.snapshot()
+            while timers:
+                timers.pop(0)()
+                yield g, g.snapshot()
+
+
+def _views(g):
+    # What each player sees, by identifier, version aside
+    return {p.identifier: g.proxy_for_player(p).to_args()[:-1]
+        for p in g.players}
+
+
+def test_restore_from_bytes():
+    for original, taken in _snapshots(0):
+        decoded = snapshot.from_bytes(snapshot.to_bytes(taken))
+        assert [(p.identifier, p.name) for p in decoded.players] == \
+            [(p.identifier, p.name) for p in taken.players]
+
+        timers = []
+        restored = _game(random.Random(0), timers)
+        restored.restore(decoded)
+        assert _views(restored) == _views(original)
+        assert restored.public_proxy().to_args()[:-1] == \
+            original.public_proxy().to_args()[:-1]
+        assert restored.version >= original.version
+
+
+def test_restored_game_goes_on():
+    for _, taken in _snapshots(1, rounds=1):
+        if not taken.round_ongoing or taken.trump_suit is None:
+            continue
+
+        # Restored as is, and from bytes: the next move is the same
+        games = []
+        for restored_from in [taken,
+            snapshot.from_bytes(snapshot.to_bytes(taken))]:
+            timers = []
+            g = _game(random.Random(1), timers)
+            g.restore(restored_from)
+            current = g.current_pli.next_player
+            if not current:
+                break
+            legal = g.current_pli.legal_moves(current, g.hand(current),
+                g.trump_suit)
+            g.play_card(current, card.from_mask(legal)[0])
+            while timers:
+                timers.pop(0)()
+            games.append(g)
+
+        if len(games) == 2:
+            assert _views(games[0]) == _views(games[1])
+
+
+def test_invalid_snapshot():
+    taken = snapshot.to_bytes(list(_snapshots(2, rounds=1))[-5][1])
+    with pytest.raises(ValueError):
+        snapshot.from_bytes(taken[:-3])
+    with pytest.raises(ValueError):
+        snapshot.from_bytes(b'BLTX' + taken[4:])
+
+
+def test_corrupt_snapshot():
+    rng = random.Random(5)
+    for _, taken in list(_snapshots(5, rounds=1))[::10]:
+        buf = snapshot.to_bytes(taken)
+        for cut in range(len(buf)):
+            with pytest.raises(ValueError):
+                snapshot.from_bytes(buf[:cut])
+
+        # Whatever decodes can be restored
+        for _ in range(50):
+            corrupt = bytearray(buf)
+            corrupt[rng.randrange(len(corrupt))] = rng.randrange(256)
+            try:
+                decoded = snapshot.from_bytes(bytes(corrupt))
+            except ValueError:
+                continue
+            _game(random.Random(0), []).restore(decoded)
+
+
+def test_load_skips_corrupt_files(tmp_path):
+    taken = list(_snapshots(6, rounds=1))[40][1]
+    buf = snapshot.to_bytes(taken)
+    (tmp_path / "good.snapshot").write_bytes(buf)
+    (tmp_path / "truncated.snapshot").write_bytes(buf[:len(buf) // 2])
+    (tmp_path / "bad_trump.snapshot").write_bytes(buf[:7] + b'\x63' + buf[8:])
+
+    loaded = snapshot.load(str(tmp_path))
+    assert list(loaded) == ["good"]
+
+
+def test_writer(tmp_path):
+    writer = snapshot.Writer(str(tmp_path))
+    writer.run()
+    taken = [s for _, s in _snapshots(3, rounds=1)]
+    for s in taken:
+        writer.save("table", s)
+    writer.save("other", taken[10])
+    writer.save("gone", taken[5])
+    writer.remove("gone")
+    writer.stop()
+
+    loaded = snapshot.load(str(tmp_path))
+    assert sorted(loaded) == ["other", "table"]
+    assert snapshot.to_bytes(loaded["table"]) == snapshot.to_bytes(taken[-1])
+    assert snapshot.to_bytes(loaded["other"]) == snapshot.to_bytes(taken[10])
+
+
+def test_long_names_cut_at_character_boundary():
+    taken = list(_snapshots(4, rounds=0))[-1][1]
+    long_names = taken._replace(players=(player.Player("0", "é" * 200),) +
+        taken.players[1:])
+    decoded = snapshot.from_bytes(snapshot.to_bytes(long_names))
+    assert decoded.players[0].name == "é" * 127